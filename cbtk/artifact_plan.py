@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+
+import glob,re
+from path_filter import MAGIC,PathPattern,PatternSet
+
+
+# Artifact plan files list one path or wildcard pattern per line under an os section:
+#
+#   [windows]
+#   C:/Windows/Prefetch/*.pf
+#   C:/Windows/System32/config/SAM
+#   C:/Users/*/NTUSER.DAT
+#   C:/Windows/System32/winevt/Logs/      <- trailing slash collects the whole directory recursively
+#
+#   [linux]
+#   /var/log/**/*.gz
+#   /etc/passwd
+#
+# Sections are windows, linux and mac. Blank lines and lines starting with # are ignored.
+
+SECTION = re.compile(r"^\[\s*(\w+)\s*\]$")
+OS_TYPES = ("windows","linux","mac")
+
+
+# accepts artifact plan file path
+# returns dict of os_type -> list of raw entries
+def read_plan_file(path):
+    entries = dict((os_type, []) for os_type in OS_TYPES)
+    section = None
+    with open(str(path), mode="r") as f:
+        for n, line in enumerate(f, start=1):
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            m = SECTION.match(line)
+            if m:
+                section = m.group(1).lower()
+                if section not in entries:
+                    raise ValueError("{}:{} unknown os section [{}] - expected one of {}".format(path, n, section, ", ".join(OS_TYPES)))
+                continue
+            if not section:
+                raise ValueError("{}:{} entry before any [windows]/[linux]/[mac] section".format(path, n))
+            if line not in entries[section]:
+                entries[section].append(line)
+    return entries
+
+
+# accepts raw entry
+# returns (literal root components, pattern segments, absolute flag)
+def split_entry(entry):
+    absolute = entry.startswith(("/","\\"))
+    is_dir = entry.endswith(("/","\\"))
+    parts = [p for p in re.split(r"[\\/]+", entry) if p]
+    for i, part in enumerate(parts):
+        if MAGIC.search(part):
+            root, segments = parts[:i], parts[i:]
+            break
+    else:
+        if is_dir:
+            root, segments = parts, []
+        else:
+            root, segments = parts[:-1], [glob.escape(parts[-1])]
+    if is_dir:
+        segments = segments + ["**","*"]
+    return root, segments, absolute
+
+
+class CollectionPlan:
+    """Artifact entries for one os compiled into the fewest traversal roots - nested and overlapping paths are merged"""
+
+    def __init__(self, entries, os_type="windows"):
+        self.os_type = os_type.lower()
+        self.case_sensitive = self.os_type != "windows"
+        self.absolute = False
+        self.roots = self.compile(entries)
+
+
+    def key(self, parts):
+        return tuple(parts if self.case_sensitive else (p.lower() for p in parts))
+
+
+    # accepts list of raw entries
+    # returns list of (root components, PatternSet) - a root is folded into an ancestor root
+    # whenever the ancestor's patterns would list the root directory anyway, so no directory is listed twice
+    def compile(self, entries):
+        groups = {}
+        for entry in entries:
+            root, segments, absolute = split_entry(entry)
+            self.absolute = self.absolute or absolute
+            group = groups.setdefault(self.key(root), (root, []))
+            if segments not in group[1]:
+                group[1].append(segments)
+
+        kept = []
+        for key in sorted(groups, key=len):
+            root, segment_lists = groups[key]
+            for kept_key, kept_root, kept_lists in kept:
+                if key[:len(kept_key)] != kept_key:
+                    continue
+                relative = root[len(kept_key):]
+                patterns = PatternSet(PathPattern(s, self.case_sensitive) for s in kept_lists)
+                states = patterns.start()
+                for name in relative:
+                    states = patterns.descend(states, name)
+                    if states is None:
+                        break
+                if states is not None:
+                    prefix = [glob.escape(name) for name in relative]
+                    kept_lists.extend(prefix + s for s in segment_lists if prefix + s not in kept_lists)
+                    break
+            else:
+                kept.append((key, root, list(segment_lists)))
+
+        return [(root, PatternSet(PathPattern(s, self.case_sensitive) for s in segment_lists))
+                for _, root, segment_lists in kept]
+
+
+    # accepts root components
+    # returns raw path string suitable for translate_path()
+    def root_path(self, root):
+        path = "/".join(root)
+        if self.absolute and self.os_type != "windows":
+            path = "/" + path
+        return path or "/"
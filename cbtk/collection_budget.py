@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+
+import json,logging,pathlib,re,threading,time
+from lr_transfer import format_size
+
+
+SKIPPED_NAME = "skipped_files.jsonl"
+SIZE_UNITS = {"": 1, "b": 1, "k": 1024, "kb": 1024, "m": 1024 ** 2, "mb": 1024 ** 2, "g": 1024 ** 3, "gb": 1024 ** 3, "t": 1024 ** 4, "tb": 1024 ** 4}
+
+
+# accepts size string [500M] [2GB] [4096]
+# returns bytes - raises ValueError for anything else (argparse reports it as an invalid value)
+def parse_size(value):
+    m = re.match(r"^\s*(\d+(?:\.\d+)?)\s*([a-zA-Z]*)\s*$", str(value))
+    if not m or m.group(2).lower() not in SIZE_UNITS:
+        raise ValueError("invalid size {}".format(value))
+    return int(float(m.group(1)) * SIZE_UNITS[m.group(2).lower()])
+
+
+class CollectionBudget:
+    """Per-file size cap plus per-host and per-sweep byte budgets shared by every job of a sweep
+
+    bytes are reserved when a download starts and released again if it fails, and every file left
+    behind is appended to a JSON lines file so a later run can pull it"""
+
+    def __init__(self, max_file_size=None, host_bytes=None, sweep_bytes=None, skipped_path=None):
+        self.max_file_size = max_file_size
+        self.host_bytes = host_bytes
+        self.sweep_bytes = sweep_bytes
+        self.skipped_path = pathlib.Path(skipped_path) if skipped_path else None
+        self.lock = threading.Lock()
+        self.used = 0
+        self.used_by_host = {}
+        self.skipped = 0
+        self.skipped_bytes = 0
+        self.fp = None
+
+
+    # accepts hostname, remote path and listing entry
+    # returns None and reserves the file's bytes if it fits, otherwise the reason it was skipped
+    def admit(self, host, remote, entry):
+        size = entry.get("size") or 0
+        with self.lock:
+            if self.max_file_size is not None and size > self.max_file_size:
+                reason = "max_file_size"
+            elif self.host_bytes is not None and self.used_by_host.get(host, 0) + size > self.host_bytes:
+                reason = "host_budget"
+            elif self.sweep_bytes is not None and self.used + size > self.sweep_bytes:
+                reason = "sweep_budget"
+            else:
+                self.used += size
+                self.used_by_host[host] = self.used_by_host.get(host, 0) + size
+                return None
+            self.skip(host, remote, entry, reason)
+            return reason
+
+
+    # accepts hostname and listing entry of a download that failed
+    # returns its reserved bytes to the budgets
+    def release(self, host, entry):
+        size = entry.get("size") or 0
+        with self.lock:
+            self.used -= size
+            self.used_by_host[host] = self.used_by_host.get(host, 0) - size
+
+
+    # accepts hostname, remote path, listing entry and reason - caller holds the lock
+    # appends the skipped file to the skipped files list
+    def skip(self, host, remote, entry, reason):
+        self.skipped += 1
+        self.skipped_bytes += entry.get("size") or 0
+        if not self.skipped_path:
+            return
+        record = {"host": host, "path": remote, "size": entry.get("size"), "last_write_time": entry.get("last_write_time"),
+                  "reason": reason, "skipped": int(time.time())}
+        try:
+            if self.fp is None:
+                self.skipped_path.parent.mkdir(parents=True, exist_ok=True)
+                self.fp = open(str(self.skipped_path), mode="a")
+            self.fp.write(json.dumps(record) + "\n")
+            self.fp.flush()
+        except OSError as e:
+            print("ERROR: Could not record skipped file {} - {}".format(self.skipped_path, e))
+            logging.error("Could not record skipped file {} - {}".format(self.skipped_path, e))
+
+
+    def close(self):
+        with self.lock:
+            if self.fp:
+                self.fp.close()
+                self.fp = None
+        if self.skipped:
+            print("Budget - skipped {} file(s) ({}) - listed in {}".format(self.skipped, format_size(self.skipped_bytes), self.skipped_path or "-"))
@@ -0,0 +1,210 @@
+#!/usr/bin/env python3
+
+import argparse,logging,pathlib,queue,sqlite3,sys,threading,time
+
+
+DEFAULT_INDEX_PATH = pathlib.Path.home().joinpath(".cbtk","collection_index.db")
+BATCH_SIZE = 1000 # records written per transaction
+FLUSH_INTERVAL = 1.0 # seconds a partial batch waits before it is committed
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    host TEXT NOT NULL COLLATE NOCASE,
+    sensor_id INTEGER,
+    path TEXT NOT NULL,
+    name TEXT NOT NULL COLLATE NOCASE,
+    size INTEGER,
+    create_time INTEGER,
+    last_write_time INTEGER,
+    listed INTEGER,
+    collected INTEGER,
+    sha256 TEXT,
+    local_path TEXT,
+    PRIMARY KEY (host, path)
+);
+CREATE INDEX IF NOT EXISTS files_name ON files (name);
+CREATE INDEX IF NOT EXISTS files_sha256 ON files (sha256);
+"""
+LISTED = """INSERT INTO files (host, sensor_id, path, name, size, create_time, last_write_time, listed) VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT (host, path) DO UPDATE SET sensor_id=excluded.sensor_id, size=excluded.size, create_time=excluded.create_time,
+last_write_time=excluded.last_write_time, listed=excluded.listed"""
+COLLECTED = """INSERT INTO files (host, sensor_id, path, name, size, create_time, last_write_time, collected, sha256, local_path) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT (host, path) DO UPDATE SET sensor_id=excluded.sensor_id, size=excluded.size, create_time=excluded.create_time,
+last_write_time=excluded.last_write_time, collected=excluded.collected, sha256=excluded.sha256, local_path=excluded.local_path"""
+FIELDS = ["host","sensor_id","path","size","last_write_time","listed","collected","sha256","local_path"]
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description="Query the SQLite index of every file get_dir.py and stack_files.py listed or collected")
+    parser.add_argument("-db","--index", help="Collection index path (defaults to ~/.cbtk/collection_index.db)", required=False)
+    subparsers = parser.add_subparsers(dest="command")
+    find = subparsers.add_parser("find", help="Hosts that had a file - exact name, or a SQL LIKE pattern [%%.ps1]")
+    find.add_argument("name")
+    find.add_argument("-c","--collected", help="Only files that were downloaded", action="store_true", required=False)
+    host = subparsers.add_parser("host", help="Every file listed or collected from a host")
+    host.add_argument("hostname")
+    host.add_argument("-c","--collected", help="Only files that were downloaded", action="store_true", required=False)
+    sha = subparsers.add_parser("hash", help="Hosts and paths a sha256 was collected from")
+    sha.add_argument("sha256")
+    subparsers.add_parser("summary", help="Files listed, collected and bytes per host")
+    sql = subparsers.add_parser("sql", help="Run a read-only SQL query against the files table")
+    sql.add_argument("query")
+    args = vars(parser.parse_args())
+    if not args["command"]:
+        parser.print_help()
+        sys.exit(0)
+    return args
+
+
+# accepts listing entry timestamp
+# returns integer epoch or None
+def epoch(value):
+    try:
+        return int(value) if value is not None else None
+    except (TypeError, ValueError):
+        return None
+
+
+# accepts database path
+# returns sqlite connection in WAL mode so queries can run while a sweep is writing
+def connect(path, readonly=False):
+    if readonly:
+        db = sqlite3.connect("file:{}?mode=ro".format(pathlib.Path(path).as_posix()), uri=True)
+    else:
+        db = sqlite3.connect(str(path), timeout=60) # sharded sweeps write from several processes
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("PRAGMA synchronous=NORMAL")
+    db.row_factory = sqlite3.Row
+    return db
+
+
+class CollectionIndex:
+    """SQLite index of listed and collected files - callers only queue records, one writer thread commits them in batches"""
+
+    def __init__(self, path=None, batch_size=BATCH_SIZE, flush_interval=FLUSH_INTERVAL):
+        self.path = pathlib.Path(path) if path else DEFAULT_INDEX_PATH
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.queue = queue.Queue()
+        self.thread = None
+        self.written = 0
+
+
+    # creates the schema and starts the writer thread
+    def open(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        db = connect(self.path)
+        db.executescript(SCHEMA)
+        db.close()
+        self.thread = threading.Thread(target=self.run, name="collection-index")
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+
+    # accepts hostname, sensor id, listed directory srcpath and listing
+    # queues every file entry of the listing
+    def record_listing(self, host, sensor_id, srcpath, listing):
+        listed = int(time.time())
+        rows = [(host, sensor_id, "{}{}".format(srcpath, entry["filename"]), entry["filename"], entry.get("size"),
+                 epoch(entry.get("create_time")), epoch(entry.get("last_write_time")), listed)
+                for entry in listing if "DIRECTORY" not in entry.get("attributes", [])]
+        if rows:
+            self.queue.put((LISTED, rows))
+
+
+    # accepts hostname, sensor id, remote path, listing entry, sha256 and local path or archive member
+    # queues one collected file
+    def record_file(self, host, sensor_id, remote, entry, sha256=None, local_path=None, size=None):
+        name = entry.get("filename") or remote.replace("\\","/").split("/")[-1]
+        row = (host, sensor_id, remote, name, size if size is not None else entry.get("size"), epoch(entry.get("create_time")),
+               epoch(entry.get("last_write_time")), int(time.time()), sha256, str(local_path) if local_path else None)
+        self.queue.put((COLLECTED, [row]))
+
+
+    # writer thread - drains the queue into one transaction per batch or flush interval
+    def run(self):
+        db = connect(self.path)
+        done = False
+        while not done:
+            batch = []
+            pending = 0
+            deadline = time.time() + self.flush_interval
+            while pending < self.batch_size:
+                try:
+                    item = self.queue.get(timeout=max(0, deadline - time.time()))
+                except queue.Empty:
+                    break
+                if item is None:
+                    done = True
+                    break
+                batch.append(item)
+                pending += len(item[1])
+            if not batch:
+                continue
+            try:
+                with db:
+                    for statement, rows in batch:
+                        db.executemany(statement, rows)
+                self.written += pending
+            except sqlite3.Error as e:
+                print("ERROR: Could not update collection index {} - {}".format(self.path, e))
+                logging.error("Could not update collection index {} - {} - {} record(s) dropped".format(self.path, e, pending))
+        db.close()
+
+
+    # commits everything queued and stops the writer thread
+    def close(self):
+        if self.thread:
+            self.queue.put(None)
+            self.thread.join()
+            self.thread = None
+
+
+# accepts sqlite connection, query and parameters
+# prints result rows tab separated with a header
+def print_rows(db, query, params=()):
+    cursor = db.execute(query, params)
+    columns = [column[0] for column in cursor.description]
+    print("\t".join(columns))
+    rows = 0
+    for row in cursor:
+        print("\t".join("" if value is None else str(value) for value in row))
+        rows += 1
+    print("{} row(s)".format(rows), file=sys.stderr)
+
+
+def main():
+    args = get_args()
+    path = pathlib.Path(args["index"]) if args["index"] else DEFAULT_INDEX_PATH
+    if not path.exists():
+        print("ERROR: Collection index does not exist - {}".format(path))
+        sys.exit(1)
+    db = connect(path, readonly=True)
+    columns = ", ".join(FIELDS)
+    collected = " AND collected IS NOT NULL" if args.get("collected") else ""
+    try:
+        if args["command"] == "find":
+            match = "LIKE" if "%" in args["name"] else "="
+            print_rows(db, "SELECT {} FROM files WHERE name {} ?{} ORDER BY host, path".format(columns, match, collected), (args["name"],))
+        elif args["command"] == "host":
+            print_rows(db, "SELECT {} FROM files WHERE host = ?{} ORDER BY path".format(columns, collected), (args["hostname"],))
+        elif args["command"] == "hash":
+            print_rows(db, "SELECT {} FROM files WHERE sha256 = ? ORDER BY host, path".format(columns), (args["sha256"].lower(),))
+        elif args["command"] == "summary":
+            print_rows(db, "SELECT host, sensor_id, COUNT(listed) AS listed, COUNT(collected) AS collected, SUM(CASE WHEN collected IS NOT NULL THEN size ELSE 0 END) AS bytes, "
+                           "MAX(COALESCE(collected, listed)) AS last_seen FROM files GROUP BY host ORDER BY host")
+        elif args["command"] == "sql":
+            print_rows(db, args["query"])
+    except sqlite3.Error as e:
+        print("ERROR: Query failed - {}".format(e))
+        sys.exit(1)
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    try:
+        main()
+    except KeyboardInterrupt:
+        print("\rInterrupted!")
+        sys.exit(0)
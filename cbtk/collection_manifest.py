@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+
+import json,logging,os,pathlib,threading,time
+
+
+MANIFEST_NAME = ".cbtk_manifest.jsonl"
+PARTIAL_SUFFIX = ".cbtkpart" # in-progress downloads are renamed into place only once complete
+
+
+class CollectionManifest:
+    """Append-only per-host record of remote file metadata and which downloads completed"""
+
+    def __init__(self, dstpath):
+        self.path = pathlib.Path(dstpath).joinpath(MANIFEST_NAME)
+        self.entries = {}
+        self.lock = threading.Lock()
+        self.fp = None
+
+
+    # reads existing manifest - the last record for a remote path wins
+    # compacts the file when most of its lines are superseded records
+    def load(self):
+        lines = 0
+        try:
+            with open(str(self.path), mode="r") as f:
+                for line in f:
+                    lines += 1
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue # torn final line from an interrupted run
+                    self.entries[record["path"]] = record
+        except OSError:
+            return self
+        if lines > 2 * len(self.entries) + 100:
+            self.compact()
+        return self
+
+
+    # rewrites manifest with one line per remote path
+    def compact(self):
+        tmp_path = self.path.with_name(self.path.name + PARTIAL_SUFFIX)
+        with open(str(tmp_path), mode="w") as f:
+            for record in self.entries.values():
+                f.write(json.dumps(record) + "\n")
+        os.replace(str(tmp_path), str(self.path))
+
+
+    # accepts remote path, listing entry and local file path
+    # returns True if the file finished in a previous run, is unchanged remotely and is intact locally
+    def is_complete(self, remote, entry, dstfile):
+        record = self.entries.get(remote)
+        if not record or record.get("status") != "complete":
+            return False
+        if record.get("size") != entry.get("size") or record.get("last_write_time") != entry.get("last_write_time"):
+            return False
+        try:
+            return os.path.getsize(str(dstfile)) == record.get("size")
+        except OSError:
+            return False
+
+
+    # accepts remote path, listing entry, status and optional extra fields
+    # appends a record and flushes it so an interrupted run keeps everything finished so far
+    def record(self, remote, entry, status, **extra):
+        record = {
+            "path": remote,
+            "size": entry.get("size"),
+            "create_time": entry.get("create_time"),
+            "last_write_time": entry.get("last_write_time"),
+            "status": status,
+            "collected": int(time.time()),
+        }
+        record.update(extra)
+        with self.lock:
+            self.entries[remote] = record
+            try:
+                if self.fp is None:
+                    self.path.parent.mkdir(parents=True, exist_ok=True)
+                    self.fp = open(str(self.path), mode="a")
+                self.fp.write(json.dumps(record) + "\n")
+                self.fp.flush()
+            except OSError as e:
+                print("ERROR: Could not update manifest {} - {}".format(self.path, e))
+                logging.error("Could not update manifest {} - {}".format(self.path, e))
+
+
+    def close(self):
+        with self.lock:
+            if self.fp:
+                self.fp.close()
+                self.fp = None
@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+
+import argparse,json,os,pathlib,socket,sys
+
+
+# Thin client for collector_daemon.py - it only needs the standard library, so a request costs a socket
+# round trip instead of importing cbapi, loading credentials and pulling the sensor list:
+#
+#   collector_client.py get -hn HOST -gd C:/Windows/Prefetch/ -dst ./out     (any get_dir.py options)
+#   collector_client.py run -hl hostlist.txt -cmd "ipconfig /all"
+#   collector_client.py status | refresh | stop
+#
+# Messages are JSON lines - the client sends one request and the daemon streams output messages back,
+# ending with a done message.
+
+DEFAULT_SOCKET_PATH = pathlib.Path.home().joinpath(".cbtk", "collector.sock")
+COMMANDS = ("get","run","status","refresh","stop")
+
+
+# accepts writable binary file and message dictionary
+def send_message(wfile, message):
+    wfile.write(json.dumps(message).encode("utf-8") + b"\n")
+    wfile.flush()
+
+
+# accepts readable binary file
+# yields message dictionaries until the other end closes the connection
+def read_messages(rfile):
+    for line in rfile:
+        if line.strip():
+            yield json.loads(line.decode("utf-8"))
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description="Send collection and command requests to a running collector_daemon.py")
+    parser.add_argument("-s","--socket", help="Daemon socket path (defaults to ~/.cbtk/collector.sock)", default=str(DEFAULT_SOCKET_PATH), required=False)
+    parser.add_argument("command", help="get runs get_dir.py options, run runs a command on sensors, status/refresh/stop manage the daemon", choices=COMMANDS)
+    parser.add_argument("arguments", help="Options for get or run [-hn HOST -gd C:/Windows/Temp/ -dst out]", nargs=argparse.REMAINDER)
+    return vars(parser.parse_args())
+
+
+# accepts socket path and request dictionary
+# prints every output message as it arrives
+# returns True if the daemon reported the request as successful
+def submit(path, request):
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        client.connect(str(path))
+    except OSError as e:
+        print("ERROR: Could not connect to collector daemon at {} - {} (start it with collector_daemon.py)".format(path, e))
+        return False
+    ok = False
+    with client, client.makefile("rb") as rfile, client.makefile("wb") as wfile:
+        send_message(wfile, request)
+        for message in read_messages(rfile):
+            if message["type"] == "output":
+                sys.stdout.write(message["text"])
+                sys.stdout.flush()
+            elif message["type"] == "done":
+                ok = message.get("ok", False)
+    return ok
+
+
+def main():
+    args = get_args()
+    request = {"command": args["command"], "arguments": args["arguments"], "cwd": os.getcwd()}
+    sys.exit(0 if submit(args["socket"], request) else 1)
+
+
+if __name__ == "__main__":
+    try:
+        main()
+    except KeyboardInterrupt:
+        print("\rInterrupted! - jobs already handed to the daemon keep running")
+        sys.exit(1)
@@ -0,0 +1,366 @@
+#!/usr/bin/env python3
+
+import argparse,logging,os,pathlib,socket,socketserver,sys,threading,time
+from cbapi.response import *
+from collector_client import DEFAULT_SOCKET_PATH,read_messages,send_message
+from get_dir import build_job,build_shared,check_args,finish,get_args as get_dir_args,translate_path
+from hostlist import resolve_hostlist
+from job_tracker import JobTracker
+from lr_batch import DEFAULT_COMMAND_TIMEOUT,RunCommand
+from lr_metrics import Metrics
+from lr_scheduler import DEFAULT_MAX_JOBS,DEFAULT_RETRIES,LiveResponseScheduler,host_priority,parse_priority_hosts
+from sensor_inventory import SensorInventory
+
+
+# Long-running collector - the API client, sensor inventory and Live Response scheduler (and with it cbapi's
+# session manager) stay warm between requests, so a pull from collector_client.py only pays for the Live
+# Response round trips. Requests share one scheduler, so --max_jobs applies across every client at once.
+#
+# Output printed while serving a request - by the request thread or by its jobs - is streamed back to that
+# request's client. Per-file --verbose lines printed from a job's transfer threads stay in the daemon's output.
+
+PATH_ARGS = ("hostlist","dstpath","artifact_plan","index","dedup_store","known_hashes","metrics_file","prom_file") # resolved against the client's cwd
+ROUTE = threading.local()
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description="Serve get_dir.py collections and commands from a warm Carbon Black Response API client over a local socket")
+    parser.add_argument("-s","--socket", help="Socket path clients connect to (defaults to ~/.cbtk/collector.sock)", default=str(DEFAULT_SOCKET_PATH), required=False)
+    parser.add_argument("-mj","--max_jobs", help="Live Response jobs running at once across every request (defaults to 10)", type=int, default=DEFAULT_MAX_JOBS, required=False)
+    parser.add_argument("-rt","--retries", help="Retries with exponential backoff for jobs failing on session or timeout errors (defaults to 3)", type=int, default=DEFAULT_RETRIES, required=False)
+    parser.add_argument("-lf","--logfile", help="Destination log file (defaults to cwd/collector_daemon.log) (does not truncate automatically with each program execution)", required=False)
+    parser.add_argument("-ic","--inventory_cache", help="Sensor inventory snapshot path (defaults to ~/.cbtk/sensor_inventory.json)", required=False)
+    parser.add_argument("-it","--inventory_ttl", help="Seconds before the sensor inventory is refreshed between requests (defaults to 900, 0 only refreshes on request)", type=int, default=900, required=False)
+    parser.add_argument("-ri","--refresh_inventory", help="Ignore the sensor inventory snapshot and pull a fresh sensor list at startup", action="store_true", required=False)
+    return vars(parser.parse_args())
+
+
+# accepts argument list sent with a run request
+# returns parsed args - argparse errors and --help reach the client through the output router
+def get_command_args(argv):
+    parser = argparse.ArgumentParser(prog="collector_client.py run", description="Run a command on sensors and print its output per host")
+    parser.add_argument("-hn","--hostname", help="Sensor hostname", required=False)
+    parser.add_argument("-hl","--hostlist", help="Hostlist of sensors separated by newlines. Can contain hostnames, IPs or CIDR ranges.", required=False)
+    parser.add_argument("-cmd","--command", help="Command line to run on each sensor [\"ipconfig /all\"]", required=True)
+    parser.add_argument("-ct","--command_timeout", help="Seconds to wait for the command on each sensor (defaults to 120)", type=int, default=DEFAULT_COMMAND_TIMEOUT, required=False)
+    parser.add_argument("-ph","--priority_hosts", help="Comma separated hostnames dispatched ahead of the rest of the hostlist", required=False)
+    parser.add_argument("-to","--timeout", help="Seconds to wait for jobs before reporting outstanding hosts as timed out (defaults to no timeout)", type=int, required=False)
+    return vars(parser.parse_args(argv))
+
+
+# accepts parsed args, keys holding paths and the client's working directory
+# rewrites relative paths so they mean what they meant in the client's shell
+def absolute_paths(args, keys, cwd):
+    for key in keys:
+        if args.get(key):
+            args[key] = str(pathlib.Path(cwd).joinpath(os.path.expanduser(args[key])))
+
+
+class ClientStream:
+    """Serialises messages from every thread working on one request onto its client connection"""
+
+    def __init__(self, wfile):
+        self.wfile = wfile
+        self.lock = threading.Lock()
+        self.closed = False
+
+
+    # accepts message dictionary - dropped once the client has gone away
+    def send(self, message):
+        with self.lock:
+            if self.closed:
+                return
+            try:
+                send_message(self.wfile, message)
+            except OSError:
+                self.closed = True
+
+
+    def output(self, text):
+        self.send({"type": "output", "text": text})
+
+
+class OutputRouter:
+    """Stands in for sys.stdout/sys.stderr - whole lines written by a thread serving a request go to that request's client"""
+
+    def __init__(self, stream):
+        self.stream = stream
+
+
+    def write(self, text):
+        sink = getattr(ROUTE, "sink", None)
+        if sink is None:
+            return self.stream.write(text)
+        ROUTE.buffer += text
+        if "\n" in ROUTE.buffer:
+            lines, _, ROUTE.buffer = ROUTE.buffer.rpartition("\n")
+            sink.output(lines + "\n")
+        return len(text)
+
+
+    def flush(self):
+        if getattr(ROUTE, "sink", None) is None:
+            self.stream.flush()
+
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+
+# accepts ClientStream
+# routes this thread's output to it until detach()
+def attach(sink):
+    ROUTE.sink = sink
+    ROUTE.buffer = ""
+
+
+def detach():
+    sink = getattr(ROUTE, "sink", None)
+    if sink and ROUTE.buffer:
+        sink.output(ROUTE.buffer)
+    ROUTE.sink = None
+    ROUTE.buffer = ""
+
+
+# accepts job callable
+# returns job callable whose output goes to the client of the request submitting it
+def routed(fn):
+    sink = getattr(ROUTE, "sink", None)
+
+    def run(session):
+        attach(sink)
+        try:
+            return fn(session)
+        finally:
+            detach()
+    return run
+
+
+# accepts command line, hostname and timeout
+# returns job callable printing the command's output under a banner for the host
+def command_job(command, host, timeout):
+    operation = RunCommand(command, timeout=timeout)
+
+    def run(session):
+        output = operation.run(session)["output"] or ""
+        print("----------\n{}\n----------\n{}".format(host, output.rstrip("\n"))) # one write so hosts never interleave
+    return run
+
+
+class CollectorDaemon:
+    """Keeps the API client, sensor inventory and Live Response scheduler warm between client requests"""
+
+    def __init__(self, cb, args):
+        self.cb = cb
+        self.ttl = args["inventory_ttl"]
+        self.inventory = SensorInventory(cb, cache_path=args["inventory_cache"], ttl=self.ttl).load(refresh=args["refresh_inventory"])
+        self.scheduler = LiveResponseScheduler(cb, max_jobs=args["max_jobs"], retries=args["retries"])
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.active = 0
+        self.served = 0
+        self.server = None
+
+
+    # accepts request dictionary
+    # returns True if the request succeeded - its output has already gone to the client
+    def handle(self, request):
+        handlers = {"get": self.get, "run": self.run, "status": self.status, "refresh": self.refresh, "stop": self.stop}
+        handler = handlers.get(request.get("command"))
+        if not handler:
+            print("ERROR: Unknown request {} - expected one of {}".format(request.get("command"), ", ".join(sorted(handlers))))
+            return False
+        with self.lock:
+            self.active += 1
+        try:
+            return handler(request.get("arguments") or [], request.get("cwd") or os.getcwd())
+        except SystemExit as e:
+            return e.code in (0, None) # argparse --help and usage errors
+        except Exception as e:
+            print("ERROR: {} request failed - {}".format(request.get("command"), e))
+            logging.error("{} request failed - {} - {}".format(request.get("command"), request.get("arguments"), e))
+            return False
+        finally:
+            with self.lock:
+                self.active -= 1
+                self.served += 1
+
+
+    # accepts refresh flag
+    # returns SensorInventory - pulled again once it is older than --inventory_ttl
+    def current_inventory(self, refresh=False):
+        with self.lock:
+            if refresh or (self.ttl > 0 and time.time() - self.inventory.fetched > self.ttl):
+                self.inventory.load(refresh=True)
+        return self.inventory
+
+
+    # accepts parsed args with hostname or hostlist
+    # yields (query, online sensor) - unknown and offline sensors are reported and left out
+    def targets(self, args):
+        inventory = self.current_inventory()
+        if args["hostname"]:
+            found = [("hostname:{}".format(args["hostname"]), inventory.lookup_hostname(args["hostname"]))]
+        else:
+            found = resolve_hostlist(args["hostlist"], inventory)
+        for query, sensor in found:
+            if not sensor:
+                print("Sensor query did not return any results - {}".format(query))
+                logging.error("Sensor query did not return any results - {}".format(query))
+            elif sensor.status.lower() != "online":
+                print("Sensor is offline - {} derived from {}".format(sensor.computer_name, query))
+                logging.error("Sensor is offline - {} derived from {}".format(sensor.computer_name, query))
+            else:
+                yield query, sensor
+
+
+    # accepts JobTracker, sensor, job callable and set of priority hostnames
+    def submit(self, tracker, sensor, fn, priority_hosts):
+        tracker.add(sensor.computer_name, self.scheduler.submit(sensor.computer_name, routed(fn), sensor.id,
+                                                                priority=host_priority(sensor, priority_hosts)))
+
+
+    # accepts get_dir.py argument list and client cwd
+    # collects exactly like get_dir.py, minus the options that need a process of their own
+    def get(self, argv, cwd):
+        args = get_dir_args(argv, prog="collector_client.py get")
+        absolute_paths(args, PATH_ARGS, cwd)
+        error = check_args(args)
+        if not error and (args["watch"] or args["shards"] > 1 or args["progress"]):
+            error = "--watch, --shards and --progress are not available through the collector daemon - run get_dir.py"
+        if not error and not ((args["get_directory"] or args["artifact_plan"]) and args["dstpath"] and (args["hostname"] or args["hostlist"])):
+            error = "--hostname or --hostlist, and --dstpath required with --get_directory or --artifact_plan"
+        if error:
+            print(error)
+            return False
+
+        metrics = Metrics(jsonl_path=args["metrics_file"], prom_path=args["prom_file"])
+        shared = build_shared(args, metrics)
+        tracker = JobTracker(timeout=args["timeout"], status=self.scheduler.status)
+        priority_hosts = parse_priority_hosts(args["priority_hosts"])
+        try:
+            for query, sensor in self.targets(args):
+                job = build_job(args, sensor, shared, query)
+                if job:
+                    self.submit(tracker, sensor, job.run, priority_hosts)
+            return tracker.wait()
+        finally:
+            finish(metrics, None, shared)
+
+
+    # accepts run argument list and client cwd
+    # runs one command on every sensor and prints each host's output as it completes
+    def run(self, argv, cwd):
+        args = get_command_args(argv)
+        absolute_paths(args, ("hostlist",), cwd)
+        if not (args["hostname"] or args["hostlist"]):
+            print("--hostname or --hostlist required with --command")
+            return False
+        tracker = JobTracker(timeout=args["timeout"], status=self.scheduler.status)
+        priority_hosts = parse_priority_hosts(args["priority_hosts"])
+        for query, sensor in self.targets(args):
+            print("Running command - {}: {}".format(sensor.computer_name, args["command"]))
+            self.submit(tracker, sensor, command_job(args["command"], sensor.computer_name, args["command_timeout"]), priority_hosts)
+        return tracker.wait()
+
+
+    def status(self, argv, cwd):
+        print("Collector daemon - up {:.0f}s - requests served: {} - active: {}".format(time.time() - self.started, self.served, self.active - 1))
+        print("Inventory - {} sensor(s) - refreshed {:.0f}s ago".format(len(self.inventory.sensors), time.time() - self.inventory.fetched))
+        print("Queue - {}".format(self.scheduler.status()))
+        return True
+
+
+    def refresh(self, argv, cwd):
+        inventory = self.current_inventory(refresh=True)
+        print("Inventory - {} sensor(s)".format(len(inventory.sensors)))
+        return True
+
+
+    def stop(self, argv, cwd):
+        print("Stopping collector daemon - jobs still running are abandoned")
+        threading.Thread(target=self.server.shutdown, name="collector-stop").start()
+        return True
+
+
+class RequestHandler(socketserver.StreamRequestHandler):
+    """Reads one request from a client connection and streams its output back, ending with a done message"""
+
+    def handle(self):
+        try:
+            request = next(read_messages(self.rfile))
+        except (StopIteration, ValueError):
+            return
+        stream = ClientStream(self.wfile)
+        attach(stream)
+        try:
+            ok = self.server.collector.handle(request)
+        finally:
+            detach()
+        stream.send({"type": "done", "ok": bool(ok)})
+
+
+class CollectorServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """Unix socket server handling each client connection in its own thread"""
+
+    daemon_threads = True
+
+
+# accepts socket path
+# removes a socket left behind by a daemon that is no longer running
+# returns False if a daemon is already listening on it
+def prepare_socket(path):
+    if path.exists():
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            probe.connect(str(path))
+            return False
+        except OSError:
+            path.unlink()
+        finally:
+            probe.close()
+    path.parent.mkdir(parents=True, exist_ok=True)
+    return True
+
+
+def main():
+    args = get_args()
+
+    if not args["logfile"]:
+        logging.basicConfig(filename="collector_daemon.log",level=logging.ERROR)
+    else:
+        logpath = translate_path(args["logfile"],os_type=sys.platform)
+        logging.basicConfig(filename=logpath or "collector_daemon.log",level=logging.ERROR)
+
+    path = pathlib.Path(args["socket"]).expanduser()
+    if not prepare_socket(path):
+        print("Collector daemon already running at {}".format(path))
+        sys.exit(0)
+
+    cb = CbResponseAPI()
+    collector = CollectorDaemon(cb, args)
+    sys.stdout = OutputRouter(sys.stdout)
+    sys.stderr = OutputRouter(sys.stderr)
+
+    umask = os.umask(0o177) # socket is only usable by this user
+    try:
+        server = CollectorServer(str(path), RequestHandler)
+    finally:
+        os.umask(umask)
+    server.collector = collector
+    collector.server = server
+    print("Collector daemon listening on {} - {} sensor(s) in inventory".format(path, len(collector.inventory.sensors)))
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        if path.exists():
+            path.unlink()
+
+
+if __name__ == "__main__":
+    try:
+        main()
+    except KeyboardInterrupt:
+        print("\rInterrupted!")
+        sys.exit(0)
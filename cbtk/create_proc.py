@@ -0,0 +1,294 @@
+#!/usr/bin/env python3
+
+import argparse,csv,json,logging,pathlib,re,sys,threading,time
+from cbapi.response import *
+from artifact_plan import OS_TYPES,read_plan_file
+from get_dir import translate_path
+from hostlist import resolve_hostlist
+from job_tracker import JobTracker
+from lr_batch import DEFAULT_COMMAND_TIMEOUT
+from lr_scheduler import DEFAULT_MAX_JOBS,DEFAULT_RETRIES,LiveResponseScheduler,host_priority,parse_priority_hosts
+from output_parsers import parser_for
+from remote_archive import EXIT_MARKER,quote_posix
+from sensor_inventory import SensorInventory
+from wait_queue import DEFAULT_DEADLINE,DEFAULT_POLL_INTERVAL,OfflineWaitQueue,default_queue_path,job_fingerprint
+
+
+# Command files name each command under an os section - commands sharing a name across sections are
+# variants of one command and land in the same results file. An optional :seconds after the name
+# overrides --command_timeout for that command:
+#
+#   [windows]
+#   netstat = netstat -ano
+#   tasklist = tasklist /v
+#   autoruns:600 = C:\Tools\autorunsc.exe -a * -c
+#
+#   [linux]
+#   netstat = netstat -antup
+#   ps = ps auxww
+#
+# Every host's result for a command is appended to dstpath/<name>.jsonl (or .csv) the moment it completes.
+# netstat, tasklist and ps output is also parsed into one row per socket/process in dstpath/<name>.rows.jsonl.
+
+COMMAND_LINE = re.compile(r"^([A-Za-z0-9_.-]+)(?::(\d+))?\s*=\s*(.+)$")
+RESULT_FIELDS = ["host","sensor_id","os_type","name","command","status","exit_status","started","seconds","error","output"]
+FORMATS = ("jsonl","csv")
+WATCH_QUEUE_KEYS = ("create_proc","name","command_file","command_timeout","dstpath","format","no_parse","no_wrap") # what is run - a watch queue only resumes for the same job
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description="Run commands on sensors using Carbon Black Response API and record each host's output, exit status and timing")
+    parser.add_argument("-hn","--hostname", help="Sensor hostname", required=False)
+    parser.add_argument("-hl","--hostlist", help="Hostlist of sensors separated by newlines. Can contain hostnames, IPs or CIDR ranges.", required=False)
+    parser.add_argument("-cp","--create_proc", help="Command line run on every os, after any --command_file commands [\"netstat -an\"]", required=False)
+    parser.add_argument("-n","--name", help="Results name for --create_proc (defaults to command)", default="command", required=False)
+    parser.add_argument("-cf","--command_file", help="Command file of named commands per os ([windows]/[linux]/[mac] sections)", required=False)
+    parser.add_argument("-dst","--dstpath", help="Destination directory for results files", required=False)
+    parser.add_argument("-fmt","--format", help="Results file format (defaults to jsonl)", choices=FORMATS, default="jsonl", required=False)
+    parser.add_argument("-ct","--command_timeout", help="Seconds to wait for each command (defaults to 120)", type=int, default=DEFAULT_COMMAND_TIMEOUT, required=False)
+    parser.add_argument("-np","--no_parse", help="Keep raw output only - skip the netstat/tasklist/ps row parsers", action="store_true", required=False)
+    parser.add_argument("-nw","--no_wrap", help="Run commands as given instead of through cmd.exe or /bin/sh (exit status is not captured)", action="store_true", required=False)
+    parser.add_argument("-mj","--max_jobs", help="Live Response jobs running at once (defaults to 10)", type=int, default=DEFAULT_MAX_JOBS, required=False)
+    parser.add_argument("-rt","--retries", help="Retries with exponential backoff for jobs failing on session or timeout errors (defaults to 3)", type=int, default=DEFAULT_RETRIES, required=False)
+    parser.add_argument("-ph","--priority_hosts", help="Comma separated hostnames dispatched ahead of the rest of the hostlist", required=False)
+    parser.add_argument("-w","--watch", help="Queue offline sensors and run the commands on each one as soon as it checks in", action="store_true", required=False)
+    parser.add_argument("-dl","--deadline", help="Seconds to keep waiting for offline sensors with --watch (defaults to 86400)", type=int, default=DEFAULT_DEADLINE, required=False)
+    parser.add_argument("-pi","--poll_interval", help="Seconds between sensor status refreshes with --watch (defaults to 300)", type=int, default=DEFAULT_POLL_INTERVAL, required=False)
+    parser.add_argument("-wq","--watch_queue", help="Persistent queue file for --watch so a restarted sweep picks up where it stopped (defaults to ~/.cbtk/create_proc_<job hash>_watch_queue.json, one per set of job arguments)", required=False)
+    parser.add_argument("-to","--timeout", help="Seconds to wait for jobs before reporting outstanding hosts as timed out (defaults to no timeout)", type=int, required=False)
+    parser.add_argument("-lf","--logfile", help="Destination log file (defaults to cwd/create_proc.log) (does not truncate automatically with each program execution)", required=False)
+    parser.add_argument("-ic","--inventory_cache", help="Sensor inventory snapshot path (defaults to ~/.cbtk/sensor_inventory.json)", required=False)
+    parser.add_argument("-it","--inventory_ttl", help="Seconds before the sensor inventory snapshot is refreshed (defaults to 900, 0 disables the snapshot)", type=int, default=900, required=False)
+    parser.add_argument("-ri","--refresh_inventory", help="Ignore the sensor inventory snapshot and pull a fresh sensor list", action="store_true", required=False)
+    return vars(parser.parse_args())
+
+
+# accepts --command_file path or None, --create_proc command line or None, its results name and the default timeout
+# returns dict of os_type -> list of (name, command line, timeout) - raises ValueError on malformed lines
+def read_commands(path, command, name, timeout):
+    lines = read_plan_file(path) if path else dict((os_type, []) for os_type in OS_TYPES)
+    commands = {}
+    for os_type in OS_TYPES:
+        for line in lines[os_type]:
+            m = COMMAND_LINE.match(line)
+            if not m:
+                raise ValueError("malformed command [{}] {} - expected name = command or name:seconds = command".format(os_type, line))
+            commands.setdefault(os_type, []).append((m.group(1), m.group(3).strip(), int(m.group(2)) if m.group(2) else timeout))
+        if command:
+            commands.setdefault(os_type, []).append((name, command, timeout))
+    return commands
+
+
+# accepts command line and os_type
+# returns command line run through the os shell so it prints EXIT_MARKER and its exit status last
+def wrap_command(command, os_type):
+    if os_type.lower() == "windows":
+        return 'cmd.exe /v:on /s /c "{} & echo {}!errorlevel!"'.format(command, EXIT_MARKER) # delayed expansion reads errorlevel after the command
+    if os_type.lower() in ["linux","mac"]:
+        return "/bin/sh -c {}".format(quote_posix("{}; echo {}$?".format(command, EXIT_MARKER)))
+    return command
+
+
+# accepts command output
+# returns (output without the exit marker, exit status or None if the marker is missing)
+def split_exit_status(output):
+    head, marker, tail = output.rpartition(EXIT_MARKER)
+    if not marker:
+        return output, None
+    try:
+        return head, int(tail.split()[0])
+    except (IndexError, ValueError):
+        return output, None
+
+
+class CommandResults:
+    """Appends each host's command results, and rows parsed from their output, to one file per command as jobs complete"""
+
+    def __init__(self, dstpath, fmt="jsonl"):
+        self.dstpath = pathlib.Path(dstpath)
+        self.fmt = fmt
+        self.lock = threading.Lock()
+        self.files = {}
+        self.results = 0
+        self.rows = 0
+
+
+    # accepts results file name and csv columns - caller holds the lock
+    # returns (file, csv writer or None), opened for append on first use
+    def open(self, name, fields):
+        if name not in self.files:
+            path = self.dstpath.joinpath("{}.{}".format(name, self.fmt))
+            new = not path.exists() or path.stat().st_size == 0
+            self.dstpath.mkdir(parents=True, exist_ok=True)
+            fp = open(str(path), mode="a", newline="" if self.fmt == "csv" else None)
+            writer = csv.DictWriter(fp, fieldnames=fields, extrasaction="ignore", restval="") if self.fmt == "csv" else None
+            if writer and new:
+                writer.writeheader()
+            self.files[name] = (fp, writer)
+        return self.files[name]
+
+
+    # accepts results file name, csv columns and iterable of records
+    # returns number of records written
+    def write(self, name, fields, records):
+        count = 0
+        with self.lock:
+            fp, writer = self.open(name, fields)
+            for record in records:
+                if writer:
+                    writer.writerow(record)
+                else:
+                    fp.write(json.dumps(record) + "\n")
+                count += 1
+            fp.flush()
+        return count
+
+
+    # accepts result dictionary and (fields, parser) for its output or None
+    # returns number of parsed rows written
+    def add(self, result, parser=None):
+        self.write(result["name"], RESULT_FIELDS, [result])
+        rows = 0
+        if parser and result["status"] == "ok":
+            fields, parse = parser
+            rows = self.write("{}.rows".format(result["name"]), ["host"] + fields,
+                              (dict({"host": result["host"]}, **row) for row in parse(result["output"])))
+        with self.lock:
+            self.results += 1
+            self.rows += rows
+        return rows
+
+
+    def close(self):
+        with self.lock:
+            for fp, _ in self.files.values():
+                fp.close()
+            self.files = {}
+        print("Results - {} command result(s) - {} parsed row(s) - {}".format(self.results, self.rows, self.dstpath))
+
+
+class CreateProc:
+    """Job running a host's commands one after another in a single Live Response session, recording each result as it completes"""
+
+    def __init__(self, commands, results, host, sensor_id=None, os_type="windows", parse=True, wrap=True):
+        self.commands = commands
+        self.results = results
+        self.host = host
+        self.sensor_id = sensor_id
+        self.os_type = os_type
+        self.parse = parse
+        self.wrap = wrap
+
+
+    # accepts live session
+    # returns None - output goes straight to the results files so finished jobs hold no output in memory
+    def run(self, session):
+        for name, command, timeout in self.commands:
+            started = time.time()
+            result = {"host": self.host, "sensor_id": self.sensor_id, "os_type": self.os_type, "name": name, "command": command,
+                      "status": "ok", "exit_status": None, "started": int(started), "error": None, "output": None}
+            try:
+                output = session.create_process(wrap_command(command, self.os_type) if self.wrap else command, wait_for_output=True, wait_timeout=timeout)
+                if isinstance(output, bytes):
+                    output = output.decode("utf-8", errors="replace")
+                result["output"], result["exit_status"] = split_exit_status(output or "") if self.wrap else (output or "", None)
+            except Exception as e:
+                result["status"] = "failed"
+                result["error"] = str(e)
+                print("ERROR: {} failed - {} - {}".format(name, self.host, e))
+                logging.error("Command {} failed - {} - {}".format(name, self.host, e))
+            result["seconds"] = round(time.time() - started, 3)
+            rows = self.results.add(result, parser_for(command) if self.parse else None)
+            print("[{}] {} - {} - exit {} ({:.1f}s){}".format(self.host, name, result["status"], result["exit_status"], result["seconds"],
+                                                             " - {} row(s)".format(rows) if rows else ""))
+
+
+def main():
+    args = get_args()
+    cb = CbResponseAPI()
+
+    if not args["logfile"]:
+        logging.basicConfig(filename="create_proc.log",level=logging.ERROR)
+    else:
+        logpath = translate_path(args["logfile"],os_type=sys.platform)
+        logging.basicConfig(filename=logpath or "create_proc.log",level=logging.ERROR)
+
+    if not ((args["create_proc"] or args["command_file"]) and args["dstpath"] and (args["hostname"] or args["hostlist"])):
+        print("--hostname or --hostlist, and --dstpath required with --create_proc or --command_file")
+        sys.exit(0)
+
+    try:
+        commands = read_commands(args["command_file"], args["create_proc"], args["name"], args["command_timeout"])
+    except (OSError, ValueError) as e:
+        print("ERROR: Could not read command file - {}".format(e))
+        sys.exit(1)
+
+    inventory = SensorInventory(cb, cache_path=args["inventory_cache"], ttl=args["inventory_ttl"]).load(refresh=args["refresh_inventory"])
+    scheduler = LiveResponseScheduler(cb, max_jobs=args["max_jobs"], retries=args["retries"])
+    priority_hosts = parse_priority_hosts(args["priority_hosts"])
+    tracker = JobTracker(timeout=args["timeout"], status=scheduler.status)
+    results = CommandResults(args["dstpath"], fmt=args["format"])
+    wait_queue = None
+    if args["watch"]:
+        fingerprint = job_fingerprint(args, WATCH_QUEUE_KEYS)
+        try:
+            wait_queue = OfflineWaitQueue(inventory, args["watch_queue"] or default_queue_path("create_proc", fingerprint),
+                                          deadline=args["deadline"], poll_interval=args["poll_interval"], fingerprint=fingerprint).load()
+        except ValueError as e:
+            print("ERROR: {}".format(e))
+            sys.exit(1)
+
+    # accepts online sensor and the query it was derived from
+    # schedules the commands for its os on it
+    def dispatch(sensor, query):
+        if wait_queue:
+            wait_queue.discard(sensor)
+        os_type=sensor.os_environment_display_string.split(" ")[0] # returns mac, linux, or windows
+        host_commands = commands.get(os_type.lower())
+        if not host_commands:
+            print("No commands for os_type {} - {}".format(os_type, sensor.computer_name))
+            return
+        print("Running {} command(s) on {}".format(len(host_commands), sensor.computer_name))
+
+        job = CreateProc(host_commands, results, sensor.computer_name, sensor_id=sensor.id, os_type=os_type,
+                         parse=not args["no_parse"], wrap=not args["no_wrap"])
+        tracker.add(sensor.computer_name, scheduler.submit(sensor.computer_name, job.run, sensor.id,
+                                                          priority=host_priority(sensor, priority_hosts)))
+
+    if args["hostname"]:
+        targets = [("hostname:{}".format(args["hostname"]), inventory.lookup_hostname(args["hostname"]))]
+    else:
+        targets = resolve_hostlist(args["hostlist"], inventory)
+
+    for query, sensor in targets:
+        if not sensor:
+            print("Sensor query did not return any results - {}".format(query))
+            logging.error("Sensor query did not return any results - {}".format(query))
+            continue
+        if sensor.status.lower() != "online" and wait_queue:
+            wait_queue.add(sensor, query)
+            continue
+        if sensor.status.lower() != "online":
+            print("Sensor is offline - {} derived from {}".format(sensor.computer_name, query))
+            logging.error("Sensor is offline - {} derived from {}".format(sensor.computer_name, query))
+            continue
+        dispatch(sensor, query)
+
+    try:
+        if wait_queue:
+            wait_queue.watch(dispatch, wait=tracker.poll)
+        tracker.wait()
+        print("Exiting now")
+        sys.exit(0)
+    except KeyboardInterrupt:
+        sys.exit(0)
+    finally:
+        results.close()
+
+
+if __name__ == "__main__":
+    try:
+        main()
+    except KeyboardInterrupt:
+        print("\rInterrupted!")
+        sys.exit(0)
@@ -1,21 +1,90 @@
 #!/usr/bin/env python3
 
-import argparse,ipaddress,logging,os,pathlib,re,sys,time
+import argparse,hashlib,logging,os,pathlib,sqlite3,sys,tarfile,time,zipfile
 #import glob,configparser,json
-from cbapi.live_response_api import LiveResponseError
 from cbapi.response import *
 from pprint import pprint
-
-
-def get_args():
-    parser = argparse.ArgumentParser(description="Download entire directories from sensors using Carbon Black Response API")
+from artifact_plan import CollectionPlan,read_plan_file
+from collection_budget import SKIPPED_NAME,CollectionBudget,parse_size
+from collection_index import CollectionIndex
+from collection_manifest import CollectionManifest,PARTIAL_SUFFIX
+from host_archive import ARCHIVE_FORMATS,HostArchive
+from hostlist import resolve_hostlist
+from job_tracker import JobTracker
+from lr_metrics import Metrics,ProgressDisplay
+from lr_scheduler import DEFAULT_MAX_JOBS,DEFAULT_RETRIES,LiveResponseScheduler,host_priority,parse_priority_hosts
+from lr_traversal import DEFAULT_CONCURRENCY,DirectoryWalker
+from lr_transfer import DEFAULT_CHUNK_SIZE,format_size,print_progress,stream_file
+from object_store import ObjectStore
+from path_filter import compile_glob
+from remote_archive import DEFAULT_ARCHIVE_TIMEOUT,ArchiveMembers,RemoteArchiveError,create_remote_archive,delete_remote_file
+from remote_hash import DEFAULT_HASH_TIMEOUT,RemoteHashError,hash_remote_directory,path_key,read_known_hashes
+from sensor_inventory import SensorInventory,SensorRecord
+from shard_driver import ShardedDriver,shard_path
+from wait_queue import DEFAULT_DEADLINE,DEFAULT_POLL_INTERVAL,OfflineWaitQueue,default_queue_path,job_fingerprint
+
+
+WATCH_QUEUE_KEYS = ("get_directory","artifact_plan","dstpath","recurse","max_depth","archive","endpoint_archive","known_hashes",
+                    "dedup_store","index","max_file_size","host_budget") # what is collected - a watch queue only resumes for the same job
+
+
+# accepts argument list and program name - both default to the command line
+def get_args(argv=None, prog=None):
+    parser = argparse.ArgumentParser(prog=prog, description="Download entire directories from sensors using Carbon Black Response API")
     parser.add_argument("-hn","--hostname", help="Sensor hostname", required=False)
     parser.add_argument("-hl","--hostlist", help="Hostlist of sensors separated by newlines. Can contain hostnames, IPs or CIDR ranges.", required=False)
-    parser.add_argument("-gd","--get_directory", help="Pull down every file in directory [C:/Windows/Prefetch]", required=False)
+    parser.add_argument("-gd","--get_directory", help="Pull down every file in directory [C:/Windows/Prefetch], or only files matching a wildcard pattern [C:/Windows/Prefetch/*.pf] [C:/Users/**/NTUSER.DAT]", required=False)
+    parser.add_argument("-ap","--artifact_plan", help="Artifact plan file of paths/wildcard patterns per os ([windows]/[linux]/[mac] sections) - collected in one Live Response session per host", required=False)
     parser.add_argument("-dst","--dstpath", help="Destination directory path for storing retrieved files", required=False)
     parser.add_argument("-r","--recurse", help="Recursive flag for use with --get_directory", action="store_true", required=False)
+    parser.add_argument("-ar","--archive", help="Stream each host's files into one compressed archive (dstpath/<host>.<format>) instead of a directory tree", choices=ARCHIVE_FORMATS, required=False)
+    parser.add_argument("-ea","--endpoint_archive", help="Archive --get_directory on the sensor (Compress-Archive on windows, tar on linux/mac) and download it in one transfer - falls back to per-file collection if archiving fails", action="store_true", required=False)
+    parser.add_argument("-eat","--endpoint_archive_timeout", help="Seconds to wait for the sensor to finish --endpoint_archive (defaults to 600)", type=int, default=DEFAULT_ARCHIVE_TIMEOUT, required=False)
+    parser.add_argument("-kh","--known_hashes", help="Hash --get_directory on the sensor first and only download files whose sha256 is not in this known-hash file (one hash per line) or collection index database", required=False)
+    parser.add_argument("-kht","--known_hashes_timeout", help="Seconds to wait for the sensor to finish hashing with --known_hashes (defaults to 600)", type=int, default=DEFAULT_HASH_TIMEOUT, required=False)
+    parser.add_argument("-ds","--dedup_store", help="Store each unique file once in this content-addressed directory and hardlink it into the per-host trees", required=False)
+    parser.add_argument("-ix","--index", help="Record every listed and collected file in this SQLite collection index (query it with collection_index.py)", required=False)
+    parser.add_argument("-f","--force", help="Ignore the per-host manifest and download every file again", action="store_true", required=False)
+    parser.add_argument("-md","--max_depth", help="Maximum subdirectory depth for use with --recurse (defaults to unlimited)", type=int, required=False)
+    parser.add_argument("-mfs","--max_file_size", help="Skip files larger than this [50M] [2G] - skipped files are listed in dstpath/skipped_files.jsonl", type=parse_size, required=False)
+    parser.add_argument("-hb","--host_budget", help="Bytes to collect per host at most [500M]", type=parse_size, required=False)
+    parser.add_argument("-sb","--sweep_budget", help="Bytes to collect across the whole sweep at most [20G]", type=parse_size, required=False)
+    parser.add_argument("-sf","--small_first", help="Download the smallest listed files first instead of in listing order", action="store_true", required=False)
+    parser.add_argument("-c","--concurrency", help="List/get requests kept in flight per Live Response session (defaults to 4)", type=int, default=DEFAULT_CONCURRENCY, required=False)
+    parser.add_argument("-cs","--chunk_size", help="Bytes buffered in memory per file transfer (defaults to 1048576)", type=int, default=DEFAULT_CHUNK_SIZE, required=False)
+    parser.add_argument("-mj","--max_jobs", help="Live Response jobs running at once (defaults to 10)", type=int, default=DEFAULT_MAX_JOBS, required=False)
+    parser.add_argument("-rt","--retries", help="Retries with exponential backoff for jobs failing on session or timeout errors (defaults to 3)", type=int, default=DEFAULT_RETRIES, required=False)
+    parser.add_argument("-ph","--priority_hosts", help="Comma separated hostnames dispatched ahead of the rest of the hostlist", required=False)
+    parser.add_argument("-w","--watch", help="Queue offline sensors and collect from each one as soon as it checks in", action="store_true", required=False)
+    parser.add_argument("-dl","--deadline", help="Seconds to keep waiting for offline sensors with --watch (defaults to 86400)", type=int, default=DEFAULT_DEADLINE, required=False)
+    parser.add_argument("-pi","--poll_interval", help="Seconds between sensor status refreshes with --watch (defaults to 300)", type=int, default=DEFAULT_POLL_INTERVAL, required=False)
+    parser.add_argument("-wq","--watch_queue", help="Persistent queue file for --watch so a restarted sweep picks up where it stopped (defaults to ~/.cbtk/get_dir_<job hash>_watch_queue.json, one per set of job arguments)", required=False)
+    parser.add_argument("-sh","--shards", help="Split --hostlist across this many worker processes, each with its own API connection (defaults to 1) - --sweep_budget is divided between them", type=int, default=1, required=False)
+    parser.add_argument("-to","--timeout", help="Seconds to wait for jobs before reporting outstanding hosts as timed out (defaults to no timeout)", type=int, required=False)
+    parser.add_argument("-mf","--metrics_file", help="Append per-host/per-phase timing events to this JSON lines file", required=False)
+    parser.add_argument("-pf","--prom_file", help="Write metrics for the prometheus node_exporter textfile collector to this path at exit", required=False)
+    parser.add_argument("-pg","--progress", help="Show a live progress line instead of per-file output", action="store_true", required=False)
+    parser.add_argument("-v","--verbose", help="Print every file as it is listed and downloaded", action="store_true", required=False)
     parser.add_argument("-lf","--logfile", help="Destination log file (defaults to cwd/get_dir.log) (does not truncate automatically with each program execution)", required=False)
-    return vars(parser.parse_args())
+    parser.add_argument("-ic","--inventory_cache", help="Sensor inventory snapshot path (defaults to ~/.cbtk/sensor_inventory.json)", required=False)
+    parser.add_argument("-it","--inventory_ttl", help="Seconds before the sensor inventory snapshot is refreshed (defaults to 900, 0 disables the snapshot)", type=int, default=900, required=False)
+    parser.add_argument("-ri","--refresh_inventory", help="Ignore the sensor inventory snapshot and pull a fresh sensor list", action="store_true", required=False)
+    return vars(parser.parse_args(argv))
+
+
+# accepts parsed args
+# returns message for the first incompatible combination of options, or None
+def check_args(args):
+    if args["archive"] and args["dedup_store"]:
+        return "--archive and --dedup_store cannot be combined"
+    if args["known_hashes"] and (args["endpoint_archive"] or args["artifact_plan"]):
+        return "--known_hashes hashes one --get_directory on the sensor and cannot be combined with --endpoint_archive or --artifact_plan"
+    if args["shards"] > 1 and args["watch"]:
+        return "--shards and --watch cannot be combined"
+    budgeted = args["max_file_size"] is not None or args["host_budget"] is not None or args["sweep_budget"] is not None
+    if budgeted and args["endpoint_archive"]:
+        return "--endpoint_archive downloads whole directories and cannot be combined with --max_file_size, --host_budget or --sweep_budget"
+    return None
 
 
 # accepts string
@@ -26,19 +95,6 @@ def print_banner(banner):
     print("----------")
 
 
-# accepts string
-# determines whether that string is an ip, cidr range, or hostname - returns verdict as a string
-def translate_host(host):
-    ip = "^(([0-9]|[1-9][0-9]|1[0-9]{2}|2[0-4][0-9]|25[0-5])\.){3}([0-9]|[1-9][0-9]|1[0-9]{2}|2[0-4][0-9]|25[0-5])$"
-    cidr = "^(([0-9]|[1-9][0-9]|1[0-9]{2}|2[0-4][0-9]|25[0-5])\.){3}([0-9]|[1-9][0-9]|1[0-9]{2}|2[0-4][0-9]|25[0-5])(\/(3[0-2]|[1-2][0-9]|[0-9]))$"
-    if re.match(ip, host):
-        return "ip"
-    if re.match(cidr, host):
-        return "cidr"
-    else:
-        return "hostname"
-
-
 # accepts raw path, and os_type
 # returns
 def translate_path(path,os_type="windows",new_dir=None):
@@ -62,64 +118,475 @@ def translate_path(path,os_type="windows",new_dir=None):
     return pure_path
 
 
+# accepts raw --get_directory value, sensor os_type and dict of compiled patterns
+# returns (translated source path, PathPattern or None) - wildcard patterns are compiled once per os_type
+def translate_source(path, os_type, patterns):
+    if os_type.lower() not in patterns:
+        patterns[os_type.lower()] = compile_glob(path, os_type=os_type)
+    root, pattern = patterns[os_type.lower()]
+    return translate_path(root, os_type=os_type), pattern
+
+
+# accepts dict of os_type -> plan entries, sensor os_type, dict of compiled plans and local host dstpath
+# returns list of (translated source path, local dstpath, PatternSet) roots - plans are compiled once per os_type
+def translate_plan(entries, os_type, plans, dstpath):
+    if os_type.lower() not in plans:
+        plans[os_type.lower()] = CollectionPlan(entries.get(os_type.lower(), []), os_type=os_type)
+    plan = plans[os_type.lower()]
+    roots = []
+    for root, pattern in plan.roots:
+        srcpath = translate_path(plan.root_path(root), os_type=os_type)
+        if not srcpath:
+            continue
+        local = pathlib.Path(dstpath).joinpath(*[part.replace(":","") for part in root])
+        roots.append((srcpath, str(local), pattern))
+    return roots
+
+
 class GetDirectory:
     """Job for listing and downloading directory contents from an endpoint"""
 
-    def __init__(self, srcpath, dstpath, recurse=False):
+    def __init__(self, srcpath, dstpath, recurse=False, chunk_size=DEFAULT_CHUNK_SIZE, concurrency=DEFAULT_CONCURRENCY, max_depth=None,
+                 resume=True, store=None, host=None, pattern=None, plan=None, archive_format=None, os_type="windows",
+                 endpoint_archive=False, endpoint_archive_timeout=DEFAULT_ARCHIVE_TIMEOUT, metrics=None, verbose=False, index=None, sensor_id=None, budget=None, smallest_first=False,
+                 known_hashes=None, known_hashes_timeout=DEFAULT_HASH_TIMEOUT):
         self.srcpath = srcpath
         self.dstpath = dstpath
         self.recurse = recurse
-
-
+        self.chunk_size = chunk_size
+        self.concurrency = concurrency
+        self.max_depth = max_depth
+        self.resume = resume
+        self.store = store
+        self.host = host or pathlib.Path(dstpath).name
+        self.pattern = pattern
+        self.plan = plan
+        self.archive_format = archive_format
+        self.os_type = os_type
+        self.endpoint_archive = endpoint_archive
+        self.endpoint_archive_timeout = endpoint_archive_timeout
+        self.metrics = metrics
+        self.verbose = verbose
+        self.index = index
+        self.sensor_id = sensor_id
+        self.budget = budget
+        self.smallest_first = smallest_first
+        self.known_hashes = known_hashes
+        self.known_hashes_timeout = known_hashes_timeout
+        self.remote_hashes = {}
+        self.states = {}
+        self.manifest = None
+        self.archive = None
+
+
+    # accepts live session
+    # returns True if the source directory could be listed (or archived on the endpoint)
     def run(self, session):
-        self.get_contents(session, self.srcpath, self.dstpath, self.recurse)
+        if self.archive_format:
+            dstpath = pathlib.Path(self.dstpath)
+            self.archive = HostArchive(dstpath.with_name("{}.{}".format(dstpath.name, self.archive_format)), self.archive_format).open(self.resume)
+        else:
+            self.manifest = CollectionManifest(self.dstpath)
+            if self.resume:
+                self.manifest.load()
+        try:
+            if self.plan:
+                return self.get_plan(session, self.plan)
+            if self.pattern:
+                return self.get_plan(session, [(self.srcpath, self.dstpath, self.pattern)])
+            if self.endpoint_archive and self.get_archived(session, self.srcpath, self.dstpath):
+                return True
+            if self.known_hashes is not None:
+                self.hash_remote(session, self.srcpath)
+            return self.get_contents(session, self.srcpath, self.dstpath, self.recurse)
+        finally:
+            if self.archive:
+                self.archive.close()
+            else:
+                self.manifest.close()
+
+
+    # accepts live session and list of (srcpath, dstpath, pattern) roots
+    # collects every root in one traversal - the patterns decide how deep to go and subtrees that cannot match are never listed
+    # returns True if the first root could be listed
+    def get_plan(self, session, roots):
+        walker = DirectoryWalker(session, concurrency=self.concurrency, max_depth=self.max_depth, metrics=self.metrics, host=self.host,
+                                 smallest_first=self.smallest_first)
+        self.states = dict((srcpath, (pattern, pattern.start())) for srcpath, _, pattern in roots)
+        return walker.walk_roots([(srcpath, dstpath) for srcpath, dstpath, _ in roots], self.descend_pattern,
+                          lambda path, entry, dst: self.get_file(session, path, entry, dst), on_listing=self.index_listing, want_file=self.match_file)
+
+
+    # accepts live session, srcpath and dstpath
+    # archives srcpath on the endpoint, downloads the one archive, removes it remotely and unpacks it through get_file
+    # returns False if the endpoint could not archive the directory so the caller can fall back to per-file collection
+    def get_archived(self, session, srcpath, dstpath):
+        depth = (self.max_depth + 1 if self.max_depth is not None else None) if self.recurse else 1
+        self.say("Archiving on endpoint: {}".format(srcpath))
+        started = time.time()
+        try:
+            remote = create_remote_archive(session, srcpath, self.os_type, depth=depth, timeout=self.endpoint_archive_timeout)
+        except RemoteArchiveError as e:
+            if self.metrics:
+                self.metrics.record(self.host, "endpoint_archive", time.time() - started, error=e, path=srcpath, started=started)
+            print("ERROR: Endpoint archive failed - falling back to per-file collection - {} - {}".format(srcpath, e))
+            logging.error("Endpoint archive failed - falling back to per-file collection - {} - {} - {}".format(srcpath, e, self.host))
+            return False
+
+        local = pathlib.Path(dstpath).parent.joinpath(".{}.{}{}".format(self.host, remote.split("_")[-1], PARTIAL_SUFFIX))
+        local.parent.mkdir(parents=True, exist_ok=True)
+        try:
+            written = stream_file(session, remote, local, chunk_size=self.chunk_size, progress=self.progress(remote))
+            self.say("Got: {} - {}".format(remote, format_size(written)))
+            if self.metrics:
+                self.metrics.record(self.host, "endpoint_archive", time.time() - started, size=written, path=srcpath, started=started)
+        except Exception as e:
+            if self.metrics:
+                self.metrics.record(self.host, "endpoint_archive", time.time() - started, error=e, path=srcpath, started=started)
+            print("ERROR: Endpoint archive download failed - falling back to per-file collection - {} - {}".format(remote, e))
+            logging.error("Endpoint archive download failed - falling back to per-file collection - {} - {} - {}".format(remote, e, self.host))
+            if local.exists():
+                os.remove(str(local))
+            return False
+        finally:
+            delete_remote_file(session, remote)
+
+        try:
+            members = ArchiveMembers(local, srcpath)
+            try:
+                built = set()
+                for parent, entry, parts in members.entries():
+                    local_dir = str(pathlib.Path(dstpath).joinpath(*parts[:-1]))
+                    if not self.archive and local_dir not in built:
+                        self.build_directory(parent, None, local_dir)
+                        built.add(local_dir)
+                    self.get_file(members, parent, entry, local_dir)
+            finally:
+                members.close()
+        except (OSError, tarfile.TarError, zipfile.BadZipFile) as e:
+            print("ERROR: Could not unpack endpoint archive - falling back to per-file collection - {} - {}".format(remote, e))
+            logging.error("Could not unpack endpoint archive - falling back to per-file collection - {} - {} - {}".format(remote, e, self.host))
+            return False
+        finally:
+            os.remove(str(local))
+        return True
 
 
     # accepts live session and srcpath
-    # returns list of dictionaries (files) with metadata
-    def get_listing(self, session, srcpath):
+    # hashes srcpath on the endpoint so files with a known sha256 are never downloaded - on failure every file is downloaded
+    def hash_remote(self, session, srcpath):
+        depth = (self.max_depth + 1 if self.max_depth is not None else None) if self.recurse else 1
+        self.say("Hashing on endpoint: {}".format(srcpath))
+        started = time.time()
         try:
-            query = session.list_directory(srcpath)
-        except LiveResponseError as e:
-            print("ERROR: {} - {} - {}".format(e,srcpath,session.session_data["hostname"]))
-            logging.error("{} - {} - {}".format(e,srcpath,session.session_data["hostname"]))
+            self.remote_hashes = hash_remote_directory(session, srcpath, self.os_type, depth=depth, timeout=self.known_hashes_timeout)
+        except RemoteHashError as e:
+            if self.metrics:
+                self.metrics.record(self.host, "remote_hash", time.time() - started, error=e, path=srcpath, started=started)
+            print("ERROR: Endpoint hashing failed - downloading every file - {} - {}".format(srcpath, e))
+            logging.error("Endpoint hashing failed - downloading every file - {} - {} - {}".format(srcpath, e, self.host))
+            return
+        if self.metrics:
+            self.metrics.record(self.host, "remote_hash", time.time() - started, path=srcpath, started=started)
+        known = sum(1 for digest in self.remote_hashes.values() if digest in self.known_hashes)
+        print("Hashed on endpoint - {}: {} file(s) - {} known and skipped".format(self.host, len(self.remote_hashes), known))
+
+
+    # accepts remote path and file entry
+    # returns True if the endpoint hash of the file is in the known-hash set - recorded as known in the manifest
+    def is_known(self, remote, entry):
+        digest = self.remote_hashes.get(path_key(remote, self.os_type))
+        if not digest or digest not in self.known_hashes:
+            return False
+        self.say("Known: {} - {}".format(entry["filename"], digest))
+        if self.manifest:
+            self.manifest.record(remote, entry, "known", sha256=digest)
+        return True
+
+
+    # accepts live session, srcpath and dstpath - recurse optional
+    # lists and downloads srcpath with up to self.concurrency requests in flight on the session
+    # returns True if srcpath could be listed
+    def get_contents(self, session, srcpath, dstpath, recurse=False):
+        fetch = lambda path, entry, dst: self.get_file(session, path, entry, dst)
+        walker = DirectoryWalker(session, concurrency=self.concurrency, max_depth=self.max_depth if recurse else None, metrics=self.metrics, host=self.host,
+                                 smallest_first=self.smallest_first)
+        descend = self.descend if recurse else self.skip_directory
+        return walker.walk(srcpath, dstpath, descend, fetch, on_listing=self.build_directory)
+
+
+    # accepts listed srcpath, listing and local dstpath
+    # queues the listing for the collection index
+    def index_listing(self, srcpath, listing, dstpath):
+        if self.index and listing:
+            self.index.record_listing(self.host, self.sensor_id, srcpath, listing)
+
+
+    # accepts listed srcpath, listing and local dstpath
+    # builds local directory once the remote directory could be listed
+    def build_directory(self, srcpath, listing, dstpath):
+        self.index_listing(srcpath, listing, dstpath)
+        if self.archive:
+            return
+        if not os.path.isdir(dstpath):
+            if dstpath == self.dstpath:
+                print("ERROR: --dstpath does not exist! - building {} now...".format(dstpath))
+            pathlib.Path(dstpath).mkdir(parents=True,exist_ok=True)
+
+
+    # accepts parent srcpath, directory entry, parent dstpath and depth
+    # returns local path for the subdirectory
+    def descend(self, srcpath, entry, dstpath, depth):
+        self.say("BUILDING DIRECTORY AND RECURSING - {}".format(entry["filename"]))
+        return str(pathlib.Path(dstpath).joinpath(entry["filename"]))
+
+
+    # accepts parent srcpath, directory entry, parent dstpath and depth
+    # returns local path for the subdirectory, or None if no file beneath it can match the root's pattern
+    def descend_pattern(self, srcpath, entry, dstpath, depth):
+        pattern, states = self.states[srcpath]
+        states = pattern.descend(states, entry["filename"])
+        if states is None:
             return None
-        return query
+        self.states["{}{}{}".format(srcpath,entry["filename"],srcpath[-1])] = (pattern, states)
+        return str(pathlib.Path(dstpath).joinpath(entry["filename"]))
 
 
-    def get_contents(self, session, srcpath, dstpath, recurse=False):
-        query = self.get_listing(session, srcpath)
-        if not query:
+    def match_file(self, srcpath, entry, dstpath):
+        pattern, states = self.states[srcpath]
+        return pattern.match_file(states, entry["filename"])
+
+
+    def skip_directory(self, srcpath, entry, dstpath, depth):
+        print("GET FAILED - Directory: {} - Add with trailing backslash to get contents".format(entry["filename"]))
+        return None
+
+
+    # accepts live session, parent srcpath, file entry and local dstpath
+    # streams remote file into dstpath (runs on a walker thread) - skips files the manifest shows are unchanged and complete
+    # downloads land in a partial file that is only renamed into place once complete
+    def get_file(self, session, srcpath, entry, dstpath):
+        remote = r"{}{}".format(srcpath,entry["filename"])
+        if self.archive:
+            return self.archive_file(session, remote, entry)
+        pure_dst_file = pathlib.Path(dstpath).joinpath(entry["filename"])
+        if self.manifest and self.manifest.is_complete(remote, entry, pure_dst_file):
+            self.say("Unchanged: {}".format(entry["filename"]))
+            return
+        if self.remote_hashes and self.is_known(remote, entry):
+            return
+        if not self.admit(remote, entry):
             return
 
-        if not os.path.isdir(dstpath):
-            print("ERROR: --dstpath does not exist! - building {} now...".format(dstpath))
-            d = pathlib.Path(dstpath)
-            d.mkdir(parents=True,exist_ok=False)
-
-        for f in query:
-            if "DIRECTORY" in f["attributes"]:
-                if recurse:
-                    if not (f["filename"]=="." or f["filename"]==".."):
-                        print("BUILDING DIRECTORY AND RECURSING - {}".format(f["filename"]))
-                        p = pathlib.Path(dstpath).joinpath(f["filename"])
-                        p.mkdir(exist_ok=True)
-                        contents = self.get_contents(session,"{}{}{}".format(srcpath,f["filename"],srcpath[-1]),str(p),recurse=recurse)
-                        continue
-                else:
-                    print("GET FAILED - Directory: {} - Add with trailing backslash to get contents".format(f["filename"]))
-                    continue
+        self.say("Getting: {}".format(entry["filename"]))
+        if self.pattern or self.plan:
+            pure_dst_file.parent.mkdir(parents=True, exist_ok=True) # only directories holding matches are built
+        digest = None
+        stats = {}
+        started = transferred = time.time()
+        hasher = hashlib.sha256() if (self.store or self.index) else None
+        if self.store:
+            partial_file = self.store.temp_path()
+        else:
+            partial_file = pure_dst_file.with_name(pure_dst_file.name + PARTIAL_SUFFIX)
+        try:
+            written = stream_file(session, remote, partial_file, chunk_size=self.chunk_size,
+                                  progress=self.progress(entry["filename"]), hasher=hasher, stats=stats)
+            transferred = time.time()
+            digest = hasher.hexdigest() if hasher else None
+            if self.store:
+                self.store.add(partial_file, digest)
+                self.store.link(digest, pure_dst_file)
+                self.store.record(self.host, remote, digest, written)
             else:
-                print("Getting: {}".format(f["filename"]))
-                pure_dst_file = pathlib.Path(dstpath).joinpath(f["filename"])
-                with open(str(pure_dst_file), mode="wb") as dstfile:
-                    dstfile.write(session.get_file(r"{}{}".format(srcpath,f["filename"])))
+                os.replace(str(partial_file), str(pure_dst_file))
+        except Exception as e:
+            self.record_file(session, remote, started, transferred, stats, 0, e)
+            if self.budget:
+                self.budget.release(self.host, entry)
+            if self.store and partial_file.exists():
+                os.remove(str(partial_file))
+            if self.manifest:
+                self.manifest.record(remote, entry, "failed", error=str(e))
+            raise
+        self.record_file(session, remote, started, transferred, stats, written)
+        if self.manifest:
+            self.manifest.record(remote, entry, "complete", written=written, sha256=digest)
+        if self.index:
+            self.index.record_file(self.host, self.sensor_id, remote, entry, sha256=digest, local_path=pure_dst_file, size=written)
+        self.say("Got: {} - {}".format(entry["filename"], format_size(written)))
+
+
+    # accepts live session, remote path and file entry
+    # streams remote file into a spool and appends it to the host archive - skips files the archive index already holds unchanged
+    def archive_file(self, session, remote, entry):
+        if self.archive.is_complete(remote, entry):
+            self.say("Unchanged: {}".format(entry["filename"]))
+            return
+        if self.remote_hashes and self.is_known(remote, entry):
+            return
+        if not self.admit(remote, entry):
+            return
 
+        self.say("Getting: {}".format(entry["filename"]))
+        hasher = hashlib.sha256() if self.index else None
+        stats = {}
+        started = transferred = time.time()
+        try:
+            with self.archive.spool() as spool:
+                written = stream_file(session, remote, spool, chunk_size=self.chunk_size, progress=self.progress(entry["filename"]), hasher=hasher, stats=stats)
+                transferred = time.time()
+                self.archive.add(spool, remote, entry, written)
+        except Exception as e:
+            self.record_file(session, remote, started, transferred, stats, 0, e)
+            if self.budget:
+                self.budget.release(self.host, entry)
+            raise
+        self.record_file(session, remote, started, transferred, stats, written)
+        if self.index:
+            self.index.record_file(self.host, self.sensor_id, remote, entry, sha256=hasher.hexdigest(), local_path=self.archive.path, size=written)
+        self.say("Got: {} - {}".format(entry["filename"], format_size(written)))
+
+
+    # accepts remote path and file entry
+    # returns True if the collection budget has room for the file - skipped files are recorded in the manifest for a later run
+    def admit(self, remote, entry):
+        if not self.budget:
+            return True
+        reason = self.budget.admit(self.host, remote, entry)
+        if not reason:
+            return True
+        self.say("Skipped: {} - {} - {}".format(entry["filename"], format_size(entry.get("size") or 0), reason))
+        if self.manifest:
+            self.manifest.record(remote, entry, "skipped", reason=reason)
+        return False
+
+
+    # accepts session the file came from, remote path, start time, time the transfer finished, stream_file stats, bytes and error
+    # records transfer time as get_file (unpack for endpoint archive members) and local writes plus the rename/link/archive step as local_write
+    def record_file(self, session, remote, started, transferred, stats, written, error=None):
+        if not self.metrics:
+            return
+        write_seconds = stats.get("write_seconds", 0)
+        phase = "unpack" if isinstance(session, ArchiveMembers) else "get_file"
+        self.metrics.record(self.host, phase, max(0, transferred - started - write_seconds), size=written, error=error, path=remote, started=started)
+        if not error:
+            self.metrics.record(self.host, "local_write", write_seconds + time.time() - transferred, size=written, path=remote, started=transferred)
+
+
+    # accepts message
+    # prints per-file chatter only with --verbose
+    def say(self, message):
+        if self.verbose:
+            print(message)
+
+
+    # accepts display name
+    # returns large file progress callback with --verbose, otherwise None
+    def progress(self, name):
+        return print_progress(name) if self.verbose else None
+
+
+# accepts parsed args, sensor, dict of per-run shared state and the hostlist query the sensor was derived from
+# returns GetDirectory job for the sensor, or None if its paths could not be translated
+def build_job(args, sensor, shared, query):
+    os_type=sensor.os_environment_display_string.split(" ")[0] # returns mac, linux, or windows
+    pure_dst_path = translate_path(args["dstpath"],os_type=sys.platform,new_dir=sensor.computer_name)
+    if not pure_dst_path:
+        print("pure_dst_path returned None for os_type {}".format(os_type))
+        logging.error("pure_dst_path returned None for query {} + os_type:{} - query translated to {}".format(query,os_type,sensor.computer_name))
+        return None
 
-def main():
-    args = get_args()
-    cb = CbResponseAPI()
+    pure_src_path, pattern, plan = None, None, None
+    if args["artifact_plan"]:
+        plan = translate_plan(shared["plan_entries"], os_type, shared["plans"], pure_dst_path)
+        if not plan:
+            print("Artifact plan has no entries for os_type {} - {}".format(os_type, sensor.computer_name))
+            logging.error("Artifact plan has no entries for query {} + os_type:{} - query translated to {}".format(query,os_type,sensor.computer_name))
+            return None
+        print("Collecting Artifact Plan - {}: {} root(s)".format(sensor.computer_name, len(plan)))
+    else:
+        pure_src_path, pattern = translate_source(args["get_directory"], os_type, shared["patterns"])
+        # Check if pure_src_path exists before continuing (because translate_path() will no longer sys.exit(0)
+        if not pure_src_path:
+            print("pure_src_path returned None for os_type {}".format(os_type))
+            logging.error("pure_src_path returned None for query {} + os_type:{} - query translated to {}".format(query,os_type,sensor.computer_name))
+            return None
+        print("Downloading Directory Contents - {}: {}".format(sensor.computer_name,pure_src_path))
 
+    return GetDirectory(pure_src_path, pure_dst_path, recurse=args["recurse"], chunk_size=args["chunk_size"],
+                        concurrency=args["concurrency"], max_depth=args["max_depth"], resume=not args["force"],
+                        store=shared["store"], host=sensor.computer_name, pattern=pattern, plan=plan, archive_format=args["archive"],
+                        os_type=os_type, endpoint_archive=args["endpoint_archive"], endpoint_archive_timeout=args["endpoint_archive_timeout"],
+                        metrics=shared["metrics"], verbose=args["verbose"], index=shared["index"], sensor_id=sensor.id,
+                        budget=shared["budget"], smallest_first=args["small_first"],
+                        known_hashes=shared["known_hashes"], known_hashes_timeout=args["known_hashes_timeout"])
+
+
+# accepts parsed args, Metrics and known hash set (loaded from --known_hashes when None)
+# returns dict of per-run state shared by every job of this process
+def build_shared(args, metrics, known_hashes=None):
+    budgeted = args["max_file_size"] is not None or args["host_budget"] is not None or args["sweep_budget"] is not None
+    if args["known_hashes"] and known_hashes is None:
+        known_hashes = read_known_hashes(args["known_hashes"])
+    return {
+        "metrics": metrics,
+        "store": ObjectStore(args["dedup_store"]) if args["dedup_store"] else None,
+        "index": CollectionIndex(args["index"]).open() if args["index"] else None,
+        "known_hashes": known_hashes,
+        "budget": CollectionBudget(args["max_file_size"], args["host_budget"], args["sweep_budget"],
+                                   skipped_path=pathlib.Path(args["dstpath"]).joinpath(SKIPPED_NAME)) if budgeted else None,
+        "patterns": {},
+        "plans": {},
+        "plan_entries": read_plan_file(args["artifact_plan"]) if args["artifact_plan"] else None,
+    }
+
+
+# accepts Metrics, ProgressDisplay or None and shared state or None
+# stops the progress line, commits the collection index and skipped files list, then writes metrics output and the summary
+def finish(metrics, progress, shared=None):
+    if progress:
+        progress.stop()
+    if shared and shared["index"]:
+        shared["index"].close()
+    if shared and shared["budget"]:
+        shared["budget"].close()
+    metrics.close()
+
+
+# accepts shard number, list of (query, sensor document), ShardReporter and parsed args
+# worker process for --shards - schedules its part of the hostlist on its own API connection and reports back to the parent
+def run_shard(shard, targets, reporter, args):
+    setup_logging(args)
+    cb = CbResponseAPI()
+    metrics = Metrics(jsonl_path=shard_path(args["metrics_file"], shard), script="get_dir")
+    shared = build_shared(args, metrics)
+    scheduler = LiveResponseScheduler(cb, max_jobs=args["max_jobs"], retries=args["retries"], metrics=metrics)
+    priority_hosts = parse_priority_hosts(args["priority_hosts"])
+    tracker = JobTracker(timeout=args["timeout"], status=scheduler.status)
+    reporter.start(metrics)
+    for query, info in targets:
+        sensor = SensorRecord(info)
+        job = build_job(args, sensor, shared, query)
+        if not job:
+            reporter.failed(sensor.computer_name, "could not build job for {}".format(query))
+            continue
+        future = scheduler.submit(sensor.computer_name, job.run, sensor.id, priority=host_priority(sensor, priority_hosts))
+        reporter.watch(sensor.computer_name, tracker.add(sensor.computer_name, future))
+    try:
+        tracker.wait()
+    finally:
+        if shared["index"]:
+            shared["index"].close()
+        if shared["budget"]:
+            shared["budget"].close()
+        metrics.close(summary=False)
+        reporter.done(metrics, tracker.timed_out)
+
+
+# accepts parsed args
+# logs errors to --logfile, or get_dir.log in the working directory
+def setup_logging(args):
     if not args["logfile"]:
         logging.basicConfig(filename="get_dir.log",level=logging.ERROR)
     else:
@@ -130,111 +597,130 @@ def main():
             logging.basicConfig(filename="get_dir.log",level=logging.ERROR)
 
 
-    if args["get_directory"] and args["dstpath"] and args["hostname"]:
-        sensor = cb.select(Sensor).where("hostname:{}".format(args["hostname"])).first()
+def main():
+    args = get_args()
+    cb = CbResponseAPI()
+    setup_logging(args)
+
+    error = check_args(args)
+    if error:
+        print(error)
+        sys.exit(0)
+
+    known_hashes = None
+    if args["known_hashes"]:
+        try:
+            known_hashes = read_known_hashes(args["known_hashes"])
+        except (OSError, sqlite3.Error) as e:
+            print("ERROR: Could not read known hashes {} - {}".format(args["known_hashes"], e))
+            sys.exit(1)
+        print("Loaded {} known hash(es) from {}".format(len(known_hashes), args["known_hashes"]))
+
+    if (args["get_directory"] or args["artifact_plan"]) and args["dstpath"] and (args["hostname"] or args["hostlist"]):
+        metrics = Metrics(jsonl_path=args["metrics_file"], prom_path=args["prom_file"])
+        with metrics.timer(None, "sensor_lookup"):
+            inventory = SensorInventory(cb, cache_path=args["inventory_cache"], ttl=args["inventory_ttl"]).load(refresh=args["refresh_inventory"])
+        sharded = args["shards"] > 1 and args["hostlist"] and not args["hostname"]
+        shared = build_shared(args, metrics, known_hashes) if not sharded else None # each shard builds its own
+        scheduler = LiveResponseScheduler(cb, max_jobs=args["max_jobs"], retries=args["retries"], metrics=metrics)
+        progress = ProgressDisplay(metrics).start() if args["progress"] and not sharded else None
+        priority_hosts = parse_priority_hosts(args["priority_hosts"])
+        tracker = JobTracker(timeout=args["timeout"], status=scheduler.status)
+        targets = []
+        wait_queue = None
+        if args["watch"]:
+            fingerprint = job_fingerprint(args, WATCH_QUEUE_KEYS)
+            try:
+                wait_queue = OfflineWaitQueue(inventory, args["watch_queue"] or default_queue_path("get_dir", fingerprint),
+                                              deadline=args["deadline"], poll_interval=args["poll_interval"], fingerprint=fingerprint).load()
+            except ValueError as e:
+                print("ERROR: {}".format(e))
+                sys.exit(1)
+
+        # accepts online sensor and the query it was derived from
+        # builds and schedules its job
+        def dispatch(sensor, query):
+            if wait_queue:
+                wait_queue.discard(sensor)
+            if sharded:
+                targets.append((query, sensor._info))
+                return
+            job = build_job(args, sensor, shared, query)
+            if job:
+                tracker.add(sensor.computer_name, scheduler.submit(sensor.computer_name, job.run, sensor.id,
+                                                                  priority=host_priority(sensor, priority_hosts)))
+
+    if (args["get_directory"] or args["artifact_plan"]) and args["dstpath"] and args["hostname"]:
+        with metrics.timer(args["hostname"], "sensor_lookup"):
+            sensor = inventory.lookup_hostname(args["hostname"])
         if not sensor:
             print("Sensor query did not return any results - Exiting now")
             logging.error("ERROR: Sensor query did not return any results - hostname:{}".format(args["hostname"]))
             sys.exit(0)
-        if sensor.status.lower() != "online":
+        if sensor.status.lower() != "online" and wait_queue:
+            wait_queue.add(sensor, "hostname:{}".format(args["hostname"]))
+        elif sensor.status.lower() != "online":
             print("Sensor is offline - Exiting now")
             logging.error("ERROR: Sensor is offline - {} derived from hostname:{}".format(sensor.computer_name, args["hostname"]))
             sys.exit(0)
-
-        os_type=sensor.os_environment_display_string.split(" ")[0] # returns mac, linux, or windows
-        pure_src_path = translate_path(args["get_directory"],os_type=os_type)
-        pure_dst_path = translate_path(args["dstpath"],os_type=sys.platform,new_dir=sensor.computer_name)
-        print("Downloading Directory Contents - {}: {}".format(sensor.computer_name,pure_src_path))
-
-        # Check if pure_src_path and pure_dst_path exist before continuing (because translate_path() will no longer sys.exit(0)
-        if not pure_src_path:
-            print("pure_src_path returned None for os_type {} - Exiting now".format(os_type))
-            logging.error("pure_src_path returned None for query hostname:{} + os_type:{} - hostname query translated to {}".format(args["hostname"],os_type,sensor.computer_name))
-            sys.exit(0)
-        if not pure_dst_path:
-            print("pure_src_path or pure_dst_path returned None for os_type {} - Exiting now".format(os_type))
-            logging.error("pure_dst_path returned None for query hostname:{} + os_type:{} - hostname query translated to {}".format(args["hostname"],os_type,sensor.computer_name))
-            sys.exit(0)
-
-        job = GetDirectory(pure_src_path, pure_dst_path, recurse=args["recurse"])
-        get_directory_job = cb.live_response.submit_job(job.run, sensor.id)
+        else:
+            dispatch(sensor, "hostname:{}".format(args["hostname"]))
 
         try:
-            while True:
-                if get_directory_job._state.lower() == "finished":
-                    print("Job finished - Exiting now")
-                    sys.exit(0)
-                time.sleep(5)
+            if wait_queue:
+                wait_queue.watch(dispatch, wait=tracker.poll)
+            tracker.wait()
+            print("Exiting now")
+            sys.exit(0)
         except KeyboardInterrupt:
-            print("\rInterrupted!")
             sys.exit(0)
-
-
-    if args["get_directory"] and args["dstpath"] and args["hostlist"]:
-        job_dict = {}
-        p = pathlib.Path.cwd().joinpath(args["hostlist"])
-        with open(str(p), mode="r") as f:
-            rawlist = (line.rstrip() for line in f)
-            hostdict = {}
-
-            for host in rawlist:
-                if translate_host(host) == "ip":
-                    hostdict[host] = "ip"
-                elif translate_host(host) == "cidr":
-                    net = ipaddress.ip_network(host)
-                    for n in net:
-                        hostdict[str(n)] = "ip"
-                else:
-                    hostdict[host] = "hostname"
-
-            for host in hostdict:
-                if hostdict[host] == "hostname":
-                    sensor = cb.select(Sensor).where("hostname:{}".format(host.strip("\n\r"))).first()
-                if hostdict[host] == "ip":
-                    sensor = cb.select(Sensor).where("ip:{}".format(host.strip("\n\r"))).first()
-
-                if not sensor:
-                    print("Sensor query did not return any results - {}:{}".format(hostdict[host], host))
-                    logging.error("Sensor query did not return any results - {}:{}".format(hostdict[host], host))
-                    continue
-                if sensor.status.lower() != "online":
-                    print("Sensor is offline - {} derived from {}:{}".format(sensor.computer_name, hostdict[host], host))
-                    logging.error("Sensor is offline - {} derived from {}:{}".format(sensor.computer_name, hostdict[host], host))
-                    continue
-                else:
-                    os_type=sensor.os_environment_display_string.split(" ")[0] # returns mac, linux, or windows
-                    pure_src_path = translate_path(args["get_directory"],os_type=os_type)
-                    pure_dst_path = translate_path(args["dstpath"],os_type=sys.platform,new_dir=sensor.computer_name)
-                    print("Downloading Directory Contents - {}: {}".format(sensor.computer_name,pure_src_path))
-
-                    # Check if pure_src_path and pure_dst_path exist before continuing (because translate_path() will no longer sys.exit(0)
-                    if not pure_src_path:
-                        print("pure_src_path returned None for os_type {} - Exiting now".format(os_type))
-                        logging.error("pure_src_path returned None for query hostname:{} + os_type:{} - hostname query translated to {}".format(args["hostname"],os_type,sensor.computer_name))
-                    if not pure_dst_path:
-                        print("pure_src_path or pure_dst_path returned None for os_type {} - Exiting now".format(os_type))
-                        logging.error("pure_dst_path returned None for query hostname:{} + os_type:{} - hostname query translated to {}".format(args["hostname"],os_type,sensor.computer_name))
-
-                    job = GetDirectory(pure_src_path, pure_dst_path, recurse=args["recurse"])
-                    job_dict[sensor.computer_name] = cb.live_response.submit_job(job.run, sensor.id)
+        finally:
+            finish(metrics, progress, shared)
+
+
+    if (args["get_directory"] or args["artifact_plan"]) and args["dstpath"] and args["hostlist"]:
+        for query, sensor in metrics.timed(resolve_hostlist(args["hostlist"], inventory), "sensor_lookup", host=lambda item: item[1].computer_name if item[1] else item[0]):
+            if not sensor:
+                print("Sensor query did not return any results - {}".format(query))
+                logging.error("Sensor query did not return any results - {}".format(query))
+                continue
+            if sensor.status.lower() != "online" and wait_queue:
+                wait_queue.add(sensor, query)
+                continue
+            if sensor.status.lower() != "online":
+                print("Sensor is offline - {} derived from {}".format(sensor.computer_name, query))
+                logging.error("Sensor is offline - {} derived from {}".format(sensor.computer_name, query))
+                continue
+            else:
+                dispatch(sensor, query)
+
+        if sharded:
+            shard_args = dict(args, sweep_budget=args["sweep_budget"] // args["shards"] if args["sweep_budget"] else args["sweep_budget"])
+            driver = ShardedDriver(args["shards"], metrics, verbose=args["verbose"])
+            progress = ProgressDisplay(driver).start() if args["progress"] else None
+            try:
+                driver.run(run_shard, targets, shard_args)
+                print("Exiting now")
+                sys.exit(0)
+            except KeyboardInterrupt:
+                sys.exit(0)
+            finally:
+                finish(metrics, progress)
 
         try:
-            while True:
-                counter = 0
-                for job in job_dict:
-                    if job_dict[job]._state.lower() == "finished":
-                        counter += 1
-                if len(job_dict) == counter:
-                    print("All jobs finished - Exiting now")
-                    sys.exit(0)
-                time.sleep(5)
+            if wait_queue:
+                wait_queue.watch(dispatch, wait=tracker.poll)
+            tracker.wait()
+            print("Exiting now")
+            sys.exit(0)
         except KeyboardInterrupt:
-            print("\rInterrupted!")
             sys.exit(0)
+        finally:
+            finish(metrics, progress, shared)
 
 
-    elif args["get_directory"] and not (args["dstpath"] and (args["hostname"] or args["hostlist"])):
-        print("--hostname and --dstpath required with --get_directory")
+    elif (args["get_directory"] or args["artifact_plan"]) and not (args["dstpath"] and (args["hostname"] or args["hostlist"])):
+        print("--hostname or --hostlist, and --dstpath required with --get_directory or --artifact_plan")
         sys.exit(0)
 
 
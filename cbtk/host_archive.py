@@ -0,0 +1,249 @@
+#!/usr/bin/env python3
+
+import argparse,gzip,json,logging,lzma,os,pathlib,shutil,sys,tarfile,tempfile,threading,time,zipfile
+from lr_transfer import DEFAULT_CHUNK_SIZE,copy_chunks
+
+
+ARCHIVE_FORMATS = ["tar.gz","tar.xz","zip"]
+INDEX_SUFFIX = ".index.jsonl"
+SPOOL_SIZE = 8 * 1024 * 1024 # bytes a file is buffered in memory before its spool moves to disk
+ZIP_EPOCH = 315532800 # 1980-01-01 - earliest timestamp a zip entry can hold
+
+
+# accepts remote file path
+# returns archive member name - drive colons dropped, separators normalised and no leading slash
+def member_name(remote):
+    return remote.replace("\\","/").replace(":","").lstrip("/")
+
+
+# accepts listing entry
+# returns remote last write time as an epoch, or now if the listing did not carry one
+def entry_mtime(entry):
+    try:
+        return int(entry.get("last_write_time") or time.time())
+    except (TypeError, ValueError):
+        return int(time.time())
+
+
+# accepts archive path
+# returns archive format from its extension, or None
+def archive_format(path):
+    for fmt in ARCHIVE_FORMATS:
+        if str(path).endswith("." + fmt):
+            return fmt
+    return None
+
+
+# accepts archive path
+# returns list of index records - the last record for a member name wins
+def read_index(path):
+    records = {}
+    try:
+        with open(str(path) + INDEX_SUFFIX, mode="r") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue # torn final line from an interrupted run
+                records[record["name"]] = record
+    except OSError:
+        pass
+    return list(records.values())
+
+
+class HostArchive:
+    """Single compressed archive per host, written as files arrive, with a sidecar index for single-file extraction
+
+    tar archives hold one compressed stream per member, so the index can seek straight to any member
+    and an interrupted archive is resumed by truncating it to the last indexed member"""
+
+    def __init__(self, path, fmt="tar.gz"):
+        self.path = pathlib.Path(path)
+        self.fmt = fmt
+        self.index_path = pathlib.Path(str(self.path) + INDEX_SUFFIX)
+        self.entries = {}
+        self.lock = threading.Lock()
+        self.fp = None
+        self.zip = None
+        self.index = None
+
+
+    # accepts resume flag
+    # opens archive for appending when resuming and its index is intact, otherwise starts a new archive
+    def open(self, resume=True):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        records = read_index(self.path) if resume and self.path.exists() else []
+        if self.fmt == "zip":
+            self.open_zip(records)
+        else:
+            self.open_tar(records)
+        self.index = open(str(self.index_path), mode="a" if self.entries else "w")
+        return self
+
+
+    def open_tar(self, records):
+        end = max([record["offset"] + record["length"] for record in records] or [0])
+        if end and end <= self.path.stat().st_size:
+            self.fp = open(str(self.path), mode="r+b")
+            self.fp.truncate(end) # drops the end of archive marker and any member torn by an interrupted run
+            self.fp.seek(end)
+            self.entries = dict((record["remote"], record) for record in records)
+            print("Resuming archive {} - {} file(s) already collected".format(self.path, len(self.entries)))
+        else:
+            self.fp = open(str(self.path), mode="wb")
+
+
+    def open_zip(self, records):
+        if records:
+            try:
+                self.zip = zipfile.ZipFile(str(self.path), mode="a", compression=zipfile.ZIP_DEFLATED, allowZip64=True)
+                names = set(self.zip.namelist())
+                self.entries = dict((record["remote"], record) for record in records if record["name"] in names)
+                print("Resuming archive {} - {} file(s) already collected".format(self.path, len(self.entries)))
+                return
+            except zipfile.BadZipFile as e:
+                print("ERROR: Could not resume archive {} - starting over - {}".format(self.path, e))
+                logging.error("Could not resume archive {} - starting over - {}".format(self.path, e))
+        self.zip = zipfile.ZipFile(str(self.path), mode="w", compression=zipfile.ZIP_DEFLATED, allowZip64=True)
+
+
+    # returns spool for one in-progress download - held in memory until it outgrows SPOOL_SIZE
+    def spool(self):
+        return tempfile.SpooledTemporaryFile(max_size=SPOOL_SIZE, dir=str(self.path.parent))
+
+
+    # accepts remote path and listing entry
+    # returns True if the archive already holds this unchanged file
+    def is_complete(self, remote, entry):
+        record = self.entries.get(remote)
+        if not record:
+            return False
+        return record.get("size") == entry.get("size") and record.get("last_write_time") == entry.get("last_write_time")
+
+
+    # accepts spooled file content, remote path, listing entry and byte count
+    # appends the file as one archive member keeping its remote path and timestamp, then indexes it
+    def add(self, spool, remote, entry, size):
+        name = member_name(remote)
+        mtime = entry_mtime(entry)
+        spool.seek(0)
+        with self.lock:
+            if self.fmt == "zip":
+                offset, length = self.add_zip(spool, name, mtime, size)
+            else:
+                offset, length = self.add_tar(spool, name, mtime, size)
+            record = {"name": name, "remote": remote, "size": size, "last_write_time": entry.get("last_write_time"),
+                      "mtime": mtime, "offset": offset, "length": length}
+            self.entries[remote] = record
+            self.index.write(json.dumps(record) + "\n")
+            self.index.flush()
+
+
+    # returns (compressed offset, compressed length) of the new member
+    def add_tar(self, spool, name, mtime, size):
+        info = tarfile.TarInfo(name)
+        info.size = size
+        info.mtime = mtime
+        info.mode = 0o644
+        offset = self.fp.tell()
+        compressor = self.compressor()
+        try:
+            compressor.write(info.tobuf(tarfile.PAX_FORMAT, "utf-8", "surrogateescape"))
+            copy_chunks(spool, compressor, DEFAULT_CHUNK_SIZE)
+            remainder = size % tarfile.BLOCKSIZE
+            if remainder:
+                compressor.write(tarfile.NUL * (tarfile.BLOCKSIZE - remainder))
+        finally:
+            compressor.close()
+        self.fp.flush()
+        return offset, self.fp.tell() - offset
+
+
+    # returns (local header offset, compressed length) of the new member
+    def add_zip(self, spool, name, mtime, size):
+        info = zipfile.ZipInfo(name, date_time=time.localtime(max(mtime, ZIP_EPOCH))[:6])
+        info.compress_type = zipfile.ZIP_DEFLATED
+        info.external_attr = 0o644 << 16
+        with self.zip.open(info, mode="w", force_zip64=size > zipfile.ZIP64_LIMIT) as f:
+            copy_chunks(spool, f, DEFAULT_CHUNK_SIZE)
+        return info.header_offset, info.compress_size
+
+
+    # returns compressing writer for one tar member - closing it ends the compressed stream but not the archive
+    def compressor(self):
+        if self.fmt == "tar.xz":
+            return lzma.LZMAFile(self.fp, mode="wb")
+        return gzip.GzipFile(fileobj=self.fp, mode="wb", mtime=0)
+
+
+    # writes the end of archive marker (tar) or central directory (zip)
+    def close(self):
+        with self.lock:
+            if self.fp:
+                compressor = self.compressor()
+                compressor.write(tarfile.NUL * (tarfile.BLOCKSIZE * 2))
+                compressor.close()
+                self.fp.close()
+                self.fp = None
+            if self.zip:
+                self.zip.close()
+                self.zip = None
+            if self.index:
+                self.index.close()
+                self.index = None
+
+
+# accepts archive path, member name (or original remote path) and local destination file
+# extracts one file using the archive's index - only that member is decompressed
+# returns index record of the extracted file
+def extract_member(path, name, dstfile):
+    records = read_index(path)
+    record = None
+    for candidate in records:
+        if name in (candidate["name"], candidate["remote"]):
+            record = candidate
+    if not record:
+        raise KeyError("{} is not in the index for {}".format(name, path))
+
+    if archive_format(path) == "zip":
+        with zipfile.ZipFile(str(path)) as archive, archive.open(record["name"]) as src, open(str(dstfile), mode="wb") as dst:
+            shutil.copyfileobj(src, dst, DEFAULT_CHUNK_SIZE)
+    else:
+        with open(str(path), mode="rb") as f:
+            f.seek(record["offset"])
+            stream = lzma.LZMAFile(f) if archive_format(path) == "tar.xz" else gzip.GzipFile(fileobj=f)
+            with tarfile.open(fileobj=stream, mode="r|") as archive:
+                member = archive.next()
+                src = archive.extractfile(member)
+                with open(str(dstfile), mode="wb") as dst:
+                    shutil.copyfileobj(src, dst, DEFAULT_CHUNK_SIZE)
+    os.utime(str(dstfile), (record["mtime"], record["mtime"]))
+    return record
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description="List or extract single files from per-host archives written by get_dir.py --archive")
+    parser.add_argument("-a","--archive", help="Archive path (tar.gz, tar.xz or zip)", required=True)
+    parser.add_argument("-l","--list", help="List archived files from the index", action="store_true", required=False)
+    parser.add_argument("-x","--extract", help="Archive member name or original remote path to extract", required=False)
+    parser.add_argument("-dst","--dstpath", help="Destination file for --extract (defaults to the member's file name in cwd)", required=False)
+    return vars(parser.parse_args())
+
+
+def main():
+    args = get_args()
+    if args["list"]:
+        for record in sorted(read_index(args["archive"]), key=lambda record: record["name"]):
+            print("{}\t{}\t{}".format(record["size"], time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(record["mtime"])), record["remote"]))
+    if args["extract"]:
+        dstfile = args["dstpath"] or member_name(args["extract"]).split("/")[-1]
+        try:
+            record = extract_member(args["archive"], args["extract"], dstfile)
+        except (KeyError, OSError, tarfile.TarError, zipfile.BadZipFile) as e:
+            print("ERROR: Could not extract {} - {}".format(args["extract"], e))
+            sys.exit(1)
+        print("Extracted: {} -> {}".format(record["remote"], dstfile))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+
+import pathlib,re
+
+
+# accepts string
+# determines whether that string is an ip, cidr range, or hostname - returns verdict as a string
+def translate_host(host):
+    ip = "^(([0-9]|[1-9][0-9]|1[0-9]{2}|2[0-4][0-9]|25[0-5])\.){3}([0-9]|[1-9][0-9]|1[0-9]{2}|2[0-4][0-9]|25[0-5])$"
+    cidr = "^(([0-9]|[1-9][0-9]|1[0-9]{2}|2[0-4][0-9]|25[0-5])\.){3}([0-9]|[1-9][0-9]|1[0-9]{2}|2[0-4][0-9]|25[0-5])(\/(3[0-2]|[1-2][0-9]|[0-9]))$"
+    if re.match(ip, host):
+        return "ip"
+    if re.match(cidr, host):
+        return "cidr"
+    else:
+        return "hostname"
+
+
+# accepts hostlist path (relative to cwd)
+# yields (host, host_type) one line at a time - blank lines, comments and duplicates are skipped
+def read_hostlist(path):
+    seen = set()
+    p = pathlib.Path.cwd().joinpath(path)
+    with open(str(p), mode="r") as f:
+        for line in f:
+            host = line.split("#")[0].strip()
+            if not host:
+                continue
+            host_type = translate_host(host)
+            key = host if host_type != "hostname" else host.lower()
+            if key in seen:
+                continue
+            seen.add(key)
+            yield host, host_type
+
+
+# accepts hostlist path and loaded SensorInventory
+# yields (query, sensor) in one pass over the file - sensor is None when the entry matched nothing
+# cidr entries are range-matched against the inventory's ip index, and each sensor is yielded only once
+def resolve_hostlist(path, inventory):
+    dispatched = set()
+    for host, host_type in read_hostlist(path):
+        query = "{}:{}".format(host_type, host)
+        if host_type == "cidr":
+            sensors = inventory.lookup_network(host)
+        else:
+            sensor = inventory.resolve(host, host_type)
+            sensors = [sensor] if sensor else []
+        if not sensors:
+            yield query, None
+        for sensor in sensors:
+            if sensor.id in dispatched:
+                continue
+            dispatched.add(sensor.id)
+            yield query, sensor
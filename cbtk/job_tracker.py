@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+
+import concurrent.futures,logging,time
+
+
+STATUS_INTERVAL = 60 # seconds between outstanding host reports
+QUEUED_CHECK_INTERVAL = 1.0 # seconds between checks for queued jobs starting, so their timeout starts on time
+
+
+class JobTracker:
+    """Tracks Live Response job futures and reports each host the moment its job completes"""
+
+    def __init__(self, timeout=None, status_interval=STATUS_INTERVAL, status=None):
+        self.timeout = timeout
+        self.status_interval = status_interval
+        self.status = status
+        self.created = time.time()
+        self.reported = self.created
+        self.pending = {}
+        self.finished = []
+        self.failed = []
+        self.timed_out = []
+
+
+    # accepts host label and future returned by cb.live_response.submit_job or LiveResponseScheduler.submit
+    def add(self, host, future):
+        self.pending[future] = (host, time.time())
+        return future
+
+
+    # returns list of hosts whose jobs have not completed yet
+    def outstanding(self):
+        return sorted(host for host, _ in self.pending.values())
+
+
+    # accepts job future and the time it was added
+    # returns time the job started running, or None while it is still queued in a LiveResponseScheduler
+    def started(self, future, submitted):
+        return getattr(future, "started", submitted)
+
+
+    # returns time the earliest running job times out, or None without a timeout or running jobs
+    def next_deadline(self):
+        if not self.timeout:
+            return None
+        starts = [self.started(future, submitted) for future, (_, submitted) in self.pending.items()]
+        starts = [started for started in starts if started is not None]
+        return min(starts) + self.timeout if starts else None
+
+
+    # returns True if any pending job is still waiting for a scheduler slot
+    def queued(self):
+        return any(self.started(future, submitted) is None for future, (_, submitted) in self.pending.items())
+
+
+    # blocks until every job completes or times out, or Ctrl-C - the timeout runs per job from the moment
+    # the scheduler starts it, so jobs waiting for a --max_jobs slot or dispatched late from a watch queue get all of it
+    # returns True if every job finished without an exception
+    def wait(self):
+        try:
+            while self.pending:
+                wait_for = self.status_interval
+                deadline = self.next_deadline()
+                if deadline:
+                    wait_for = min(wait_for, max(0, deadline - time.time()))
+                if self.timeout and self.queued():
+                    wait_for = min(wait_for, QUEUED_CHECK_INTERVAL)
+                try:
+                    for future in concurrent.futures.as_completed(list(self.pending), timeout=wait_for):
+                        self.complete(future)
+                except concurrent.futures.TimeoutError:
+                    if deadline and time.time() >= deadline:
+                        self.expire()
+                        continue
+                    if time.time() - self.reported >= self.status_interval:
+                        self.print_outstanding()
+        except KeyboardInterrupt:
+            print("\rInterrupted!")
+            self.print_outstanding()
+            raise
+        self.print_summary()
+        return not (self.failed or self.timed_out)
+
+
+    # accepts seconds
+    # reports jobs completing within that time - for callers with other work to do between waits
+    def poll(self, timeout):
+        if not self.pending:
+            time.sleep(max(0, timeout))
+            return
+        try:
+            for future in concurrent.futures.as_completed(list(self.pending), timeout=max(0, timeout)):
+                self.complete(future)
+        except concurrent.futures.TimeoutError:
+            pass
+        self.expire()
+
+
+    # accepts completed future
+    # reports the result for its host immediately
+    def complete(self, future):
+        host, submitted = self.pending.pop(future)
+        elapsed = time.time() - (self.started(future, submitted) or submitted)
+        done = len(self.finished) + len(self.failed) + 1
+        total = done + len(self.pending)
+        e = future.exception() if not future.cancelled() else "cancelled"
+        if not e and future.result() is False: # GetDirectory returns False when its root could not be listed
+            e = "job reported failure - see the errors above"
+        if e:
+            self.failed.append(host)
+            print("[{}/{}] Job failed - {} - {}".format(done, total, host, e))
+            logging.error("Job failed - {} - {}".format(host, e))
+        else:
+            self.finished.append(host)
+            print("[{}/{}] Job finished - {} ({:.1f}s)".format(done, total, host, elapsed))
+        if self.status:
+            print("Queue - {}".format(self.status()))
+
+
+    # reports every job running longer than the timeout as timed out - jobs that have not started are cancelled,
+    # scheduler jobs already running on a session are abandoned so they stop at their next Live Response call
+    def expire(self):
+        if not self.timeout:
+            return
+        now = time.time()
+        for future, (host, submitted) in list(self.pending.items()):
+            started = self.started(future, submitted)
+            if started is None or now - started < self.timeout:
+                continue
+            del self.pending[future]
+            self.timed_out.append(host)
+            if future.cancel():
+                print("Job timed out before it started - cancelled - {}".format(host))
+                logging.error("Job timed out after {}s before it started - {}".format(self.timeout, host))
+                continue
+            if hasattr(future, "abandon"):
+                future.abandon()
+            print("Job timed out - abandoned while running - {}".format(host))
+            logging.error("Job timed out after {}s - abandoned while running - {}".format(self.timeout, host))
+
+
+    def print_outstanding(self):
+        self.reported = time.time()
+        hosts = self.outstanding()
+        if hosts:
+            print("Waiting on {} job(s) - {}".format(len(hosts), ", ".join(hosts)))
+        if self.status:
+            print("Queue - {}".format(self.status()))
+
+
+    def print_summary(self):
+        print("Jobs finished: {} - failed: {} - timed out: {} - elapsed: {:.1f}s".format(
+            len(self.finished), len(self.failed), len(self.timed_out), time.time() - self.created))
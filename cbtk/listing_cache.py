@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+
+import argparse,json,logging,pathlib,sqlite3,sys,time
+from concurrent.futures import ThreadPoolExecutor
+from collection_index import connect
+from remote_hash import path_key
+
+
+DEFAULT_CACHE_PATH = pathlib.Path.home().joinpath(".cbtk","listing_cache.db")
+DEFAULT_TTL = 300 # seconds a cached listing is served before the directory is listed again
+DEFAULT_MAX_ENTRIES = 5000 # listings kept before the least recently used are evicted
+DEFAULT_PREFETCH = 4 # child listings in flight at once while prefetching
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS listings (
+    sensor_id INTEGER NOT NULL,
+    path TEXT NOT NULL,
+    fetched REAL NOT NULL,
+    accessed REAL NOT NULL,
+    listing TEXT NOT NULL,
+    PRIMARY KEY (sensor_id, path)
+);
+CREATE INDEX IF NOT EXISTS listings_accessed ON listings (accessed);
+"""
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description="Inspect or clear the on-disk cache of directory listings used by cbtk_response.py --list_directory")
+    parser.add_argument("-db","--cache", help="Listing cache path (defaults to ~/.cbtk/listing_cache.db)", required=False)
+    subparsers = parser.add_subparsers(dest="command")
+    subparsers.add_parser("summary", help="Cached listings and their age per sensor")
+    clear = subparsers.add_parser("clear", help="Drop cached listings")
+    clear.add_argument("-s","--sensor_id", help="Only listings of this sensor id", type=int, required=False)
+    args = vars(parser.parse_args())
+    if not args["command"]:
+        parser.print_help()
+        sys.exit(0)
+    return args
+
+
+# accepts remote directory path and os_type
+# returns cache key for the directory - windows paths are case insensitive and always end in a separator
+def normalize_path(path, os_type):
+    sep = "\\" if os_type.lower() == "windows" else "/"
+    if os_type.lower() == "windows":
+        path = path.replace("/", "\\")
+    return path_key(path.rstrip(sep) + sep, os_type)
+
+
+# accepts remote directory path and its listing
+# returns remote paths of its subdirectories
+def child_directories(srcpath, listing):
+    return ["{}{}{}".format(srcpath, entry["filename"], srcpath[-1]) for entry in listing
+            if "DIRECTORY" in entry["attributes"] and entry["filename"] not in (".","..")]
+
+
+class ListingCache:
+    """SQLite cache of directory listings keyed by (sensor id, normalized path) with a TTL and least recently used eviction"""
+
+    def __init__(self, path=None, ttl=DEFAULT_TTL, max_entries=DEFAULT_MAX_ENTRIES):
+        self.path = pathlib.Path(path) if path else DEFAULT_CACHE_PATH
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.db = None
+        self.hits = 0
+        self.misses = 0
+
+
+    def open(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.db = connect(self.path)
+        self.db.executescript(SCHEMA)
+        self.db.commit()
+        return self
+
+
+    # accepts sensor id, remote directory path and os_type
+    # returns cached listing younger than the ttl, or None
+    def get(self, sensor_id, path, os_type):
+        key = normalize_path(path, os_type)
+        row = self.db.execute("SELECT fetched, listing FROM listings WHERE sensor_id = ? AND path = ?", (sensor_id, key)).fetchone()
+        if not row or time.time() - row["fetched"] > self.ttl:
+            self.misses += 1
+            return None
+        self.db.execute("UPDATE listings SET accessed = ? WHERE sensor_id = ? AND path = ?", (time.time(), sensor_id, key))
+        self.db.commit()
+        self.hits += 1
+        return json.loads(row["listing"])
+
+
+    # accepts sensor id, remote directory path and os_type
+    # returns True if a listing younger than the ttl is cached - does not count as a use
+    def fresh(self, sensor_id, path, os_type):
+        row = self.db.execute("SELECT fetched FROM listings WHERE sensor_id = ? AND path = ?", (sensor_id, normalize_path(path, os_type))).fetchone()
+        return bool(row) and time.time() - row["fetched"] <= self.ttl
+
+
+    # accepts sensor id, remote directory path, os_type and listing
+    # stores the listing and evicts the least recently used ones beyond max_entries
+    def put(self, sensor_id, path, os_type, listing):
+        now = time.time()
+        self.db.execute("INSERT OR REPLACE INTO listings (sensor_id, path, fetched, accessed, listing) VALUES (?, ?, ?, ?, ?)",
+                        (sensor_id, normalize_path(path, os_type), now, now, json.dumps(listing)))
+        self.db.execute("DELETE FROM listings WHERE rowid IN (SELECT rowid FROM listings ORDER BY accessed DESC LIMIT -1 OFFSET ?)", (self.max_entries,))
+        self.db.commit()
+
+
+    # accepts sensor id, list of remote directory paths and os_type
+    # returns the paths without a fresh cached listing
+    def stale(self, sensor_id, paths, os_type):
+        return [path for path in paths if not self.fresh(sensor_id, path, os_type)]
+
+
+    # accepts live session, sensor id, list of remote directory paths, os_type and listings in flight
+    # lists the directories one level ahead of the user, so stepping into one is answered from the cache
+    # returns number of directories listed
+    def prefetch(self, session, sensor_id, children, os_type, concurrency=DEFAULT_PREFETCH):
+        def fetch(child):
+            try:
+                return child, session.list_directory(child)
+            except Exception as e:
+                logging.error("Prefetch failed - {} - {}".format(child, e))
+                return child, None
+
+        listed = 0
+        if not children:
+            return listed
+        with ThreadPoolExecutor(max_workers=max(1, concurrency)) as executor:
+            for child, child_listing in executor.map(fetch, children): # listings come back here - the connection stays on this thread
+                if child_listing is not None:
+                    self.put(sensor_id, child, os_type, child_listing)
+                    listed += 1
+        return listed
+
+
+    def close(self):
+        if self.db:
+            self.db.close()
+            self.db = None
+
+
+def main():
+    args = get_args()
+    path = pathlib.Path(args["cache"]) if args["cache"] else DEFAULT_CACHE_PATH
+    if not path.exists():
+        print("ERROR: Listing cache does not exist - {}".format(path))
+        sys.exit(1)
+    db = connect(path)
+    try:
+        if args["command"] == "summary":
+            now = time.time()
+            for row in db.execute("SELECT sensor_id, COUNT(*) AS listings, MIN(fetched) AS oldest, MAX(fetched) AS newest FROM listings GROUP BY sensor_id ORDER BY sensor_id"):
+                print("sensor {} - {} listing(s) - fetched {:.0f}s to {:.0f}s ago".format(row["sensor_id"], row["listings"], now - row["newest"], now - row["oldest"]))
+        elif args["command"] == "clear":
+            if args["sensor_id"] is not None:
+                removed = db.execute("DELETE FROM listings WHERE sensor_id = ?", (args["sensor_id"],)).rowcount
+            else:
+                removed = db.execute("DELETE FROM listings").rowcount
+            db.commit()
+            print("Removed {} cached listing(s)".format(removed))
+    except sqlite3.Error as e:
+        print("ERROR: Listing cache query failed - {}".format(e))
+        sys.exit(1)
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    try:
+        main()
+    except KeyboardInterrupt:
+        print("\rInterrupted!")
+        sys.exit(0)
@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+
+import json,logging,pathlib,time
+from lr_scheduler import is_session_error
+from lr_transfer import DEFAULT_CHUNK_SIZE,format_size,stream_file
+from remote_archive import delete_remote_file
+
+
+DEFAULT_COMMAND_TIMEOUT = 120 # seconds create_process waits for a command to finish
+RESULTS_NAME = "batch_results.jsonl"
+
+
+class RunCommand:
+    """Operation running a command line on the endpoint - the result is its output"""
+
+    def __init__(self, command, timeout=DEFAULT_COMMAND_TIMEOUT):
+        self.command = command
+        self.timeout = timeout
+        self.kind = "run"
+        self.target = command
+
+
+    def run(self, session):
+        output = session.create_process(self.command, wait_for_output=True, wait_timeout=self.timeout)
+        if isinstance(output, bytes):
+            output = output.decode("utf-8", errors="replace")
+        return {"output": output}
+
+
+class ListDirectory:
+    """Operation listing one remote directory - the result is the listing"""
+
+    def __init__(self, srcpath):
+        self.srcpath = srcpath
+        self.kind = "list"
+        self.target = srcpath
+
+
+    def run(self, session):
+        listing = session.list_directory(self.srcpath)
+        return {"entries": len(listing), "listing": listing}
+
+
+class OperationError(Exception):
+    """Raised when a wrapped job finishes without collecting what it was asked for"""
+
+
+class GetFile:
+    """Operation downloading one remote file"""
+
+    def __init__(self, srcfile, dstfile, chunk_size=DEFAULT_CHUNK_SIZE):
+        self.srcfile = srcfile
+        self.dstfile = pathlib.Path(dstfile)
+        self.chunk_size = chunk_size
+        self.kind = "get"
+        self.target = srcfile
+
+
+    def run(self, session):
+        self.dstfile.parent.mkdir(parents=True, exist_ok=True)
+        written = stream_file(session, self.srcfile, self.dstfile, chunk_size=self.chunk_size)
+        return {"path": str(self.dstfile), "bytes": written}
+
+
+class CollectOutput:
+    """Operation running a command that writes a file on the endpoint, then pulling and removing that file"""
+
+    def __init__(self, command, remote_path, dstfile, timeout=DEFAULT_COMMAND_TIMEOUT, chunk_size=DEFAULT_CHUNK_SIZE):
+        self.command = command
+        self.remote_path = remote_path
+        self.dstfile = pathlib.Path(dstfile)
+        self.timeout = timeout
+        self.chunk_size = chunk_size
+        self.kind = "collect"
+        self.target = remote_path
+
+
+    def run(self, session):
+        # wait for the command to exit (its output is discarded) - without waiting create_process returns once the
+        # process starts and the file would be fetched while it is still being written
+        session.create_process(self.command, wait_for_output=True, wait_timeout=self.timeout)
+        self.dstfile.parent.mkdir(parents=True, exist_ok=True)
+        try:
+            written = stream_file(session, self.remote_path, self.dstfile, chunk_size=self.chunk_size)
+        finally:
+            delete_remote_file(session, self.remote_path)
+        return {"path": str(self.dstfile), "bytes": written}
+
+
+class JobOperation:
+    """Operation wrapping any job with a run(session) method (GetDirectory, CreateProc, ...) - a job returning False has failed"""
+
+    def __init__(self, kind, target, job):
+        self.kind = kind
+        self.target = target
+        self.job = job
+
+
+    def run(self, session):
+        result = self.job.run(session)
+        if result is False:
+            raise OperationError("{} {} did not complete - see the errors above".format(self.kind, self.target))
+        return {"result": result} if result is not None and not isinstance(result, bool) else {}
+
+
+class SessionBatch:
+    """Job running an ordered list of operations in one Live Response session, keeping a result per operation
+
+    a failed operation does not stop the ones after it, except session and timeout errors which fail the job so the
+    scheduler retries it - the retried batch skips operations that already succeeded and resumes at the failed one"""
+
+    def __init__(self, operations, host=None, results_path=None):
+        self.operations = operations
+        self.host = host
+        self.results_path = pathlib.Path(results_path) if results_path else None
+        self.results = [None] * len(operations)
+
+
+    # accepts live session
+    # returns list of per-operation result dictionaries
+    def run(self, session):
+        for index, operation in enumerate(self.operations):
+            if self.results[index] and self.results[index]["status"] == "ok":
+                continue
+            started = time.time()
+            result = {"host": self.host, "operation": index, "type": operation.kind, "target": operation.target, "started": int(started)}
+            try:
+                result.update(operation.run(session))
+                result["status"] = "ok"
+            except Exception as e:
+                result["status"] = "failed"
+                result["error"] = str(e)
+                print("ERROR: {} {} failed - {} - {}".format(operation.kind, operation.target, self.host, e))
+                logging.error("Batch operation {} {} failed - {} - {}".format(operation.kind, operation.target, self.host, e))
+                if is_session_error(e):
+                    self.finish(index, operation, result, started)
+                    raise
+            self.finish(index, operation, result, started)
+        return self.results
+
+
+    # accepts operation index, operation, result dictionary and start time
+    # records the result and reports it
+    def finish(self, index, operation, result, started):
+        result["seconds"] = round(time.time() - started, 3)
+        self.results[index] = result
+        self.write_result(result)
+        print("[{}] {} {} - {} ({:.1f}s){}".format(self.host, operation.kind, operation.target, result["status"], result["seconds"], describe(result)))
+
+
+    # accepts result dictionary
+    # appends it to the per-host results file so partial results survive an interrupted batch
+    def write_result(self, result):
+        if not self.results_path:
+            return
+        try:
+            self.results_path.parent.mkdir(parents=True, exist_ok=True)
+            with open(str(self.results_path), mode="a") as f:
+                f.write(json.dumps(result) + "\n")
+        except OSError as e:
+            print("ERROR: Could not write batch results {} - {}".format(self.results_path, e))
+            logging.error("Could not write batch results {} - {}".format(self.results_path, e))
+
+
+# accepts result dictionary
+# returns short suffix describing what the operation produced
+def describe(result):
+    if "entries" in result:
+        return " - {} entries".format(result["entries"])
+    if "bytes" in result:
+        return " - {}".format(format_size(result["bytes"]))
+    if "output" in result:
+        return " - {} line(s) of output".format(len(result["output"].splitlines()))
+    return ""
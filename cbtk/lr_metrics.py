@@ -0,0 +1,305 @@
+#!/usr/bin/env python3
+
+import json,logging,math,os,pathlib,sys,threading,time
+
+
+PHASES = ["sensor_lookup","session_setup","list_directory","remote_hash","get_file","endpoint_archive","unpack","local_write","job"]
+FILE_PHASES = ["get_file","unpack"] # one call per collected file
+TRANSFER_PHASES = ["get_file","endpoint_archive"] # bytes pulled over Live Response
+PROGRESS_INTERVAL = 1.0 # seconds between progress display refreshes
+SLOWEST_HOSTS = 5
+BUCKET_MIN = 0.001 # seconds - upper edge of the lowest latency bucket
+BUCKET_RATIO = 1.05 # each latency bucket is 5% wider than the one below, so percentiles are within 5%
+
+
+class LatencyHistogram:
+    """Fixed log-scale latency buckets for one phase - memory stays bounded however many calls are recorded"""
+
+    def __init__(self):
+        self.buckets = {} # bucket index -> calls
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+
+    # accepts seconds
+    def add(self, seconds):
+        index = 0 if seconds <= BUCKET_MIN else int(math.ceil(math.log(seconds / BUCKET_MIN, BUCKET_RATIO)))
+        self.buckets[index] = self.buckets.get(index, 0) + 1
+        self.count += 1
+        self.sum += seconds
+        self.max = max(self.max, seconds)
+
+
+    # returns plain dict of the histogram - sent between shard processes
+    def state(self):
+        return {"buckets": dict(self.buckets), "count": self.count, "sum": self.sum, "max": self.max}
+
+
+    # accepts dict from state()
+    def merge(self, state):
+        for index, calls in state["buckets"].items():
+            self.buckets[index] = self.buckets.get(index, 0) + calls
+        self.count += state["count"]
+        self.sum += state["sum"]
+        self.max = max(self.max, state["max"])
+
+
+    # accepts percentile (0-100)
+    # returns nearest-rank percentile as the upper edge of its bucket (never above the slowest call), or None when empty
+    def percentile(self, pct):
+        if not self.count:
+            return None
+        rank = max(1, min(self.count, int(math.ceil(pct / 100.0 * self.count))))
+        seen = 0
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if seen >= rank:
+                return min(BUCKET_MIN * BUCKET_RATIO ** index, self.max)
+
+
+# accepts dict of host -> phase -> counters
+# returns (files collected, bytes transferred)
+def totals(hosts):
+    files = sum(phases.get(phase, {}).get("calls", 0) - phases.get(phase, {}).get("errors", 0) for phases in hosts.values() for phase in FILE_PHASES)
+    size = sum(phases.get(phase, {}).get("bytes", 0) for phases in hosts.values() for phase in TRANSFER_PHASES)
+    return files, size
+
+
+# accepts label value
+# returns value escaped for the prometheus text format
+def prom_escape(value):
+    return str(value).replace("\\","\\\\").replace("\"","\\\"").replace("\n","\\n")
+
+
+class PhaseTimer:
+    """Context manager timing one operation - set .bytes and .path before it exits, exceptions are recorded as errors"""
+
+    def __init__(self, metrics, host, phase, path=None):
+        self.metrics = metrics
+        self.host = host
+        self.phase = phase
+        self.path = path
+        self.bytes = 0
+        self.started = None
+
+
+    def __enter__(self):
+        self.started = time.time()
+        return self
+
+
+    def __exit__(self, exc_type, exc, tb):
+        self.metrics.record(self.host, self.phase, time.time() - self.started, size=self.bytes, error=exc, path=self.path, started=self.started)
+        return False
+
+
+class Metrics:
+    """Thread-safe per-host/per-phase timings, byte counts, call counts and errors with JSON-lines and prometheus output"""
+
+    def __init__(self, jsonl_path=None, prom_path=None, script="get_dir"):
+        self.jsonl_path = jsonl_path
+        self.prom_path = prom_path
+        self.script = script
+        self.started = time.time()
+        self.lock = threading.Lock()
+        self.latencies = dict((phase, LatencyHistogram()) for phase in PHASES)
+        self.hosts = {}
+        self.running = set()
+        self.fp = None
+        if jsonl_path:
+            pathlib.Path(jsonl_path).parent.mkdir(parents=True, exist_ok=True)
+            self.fp = open(str(jsonl_path), mode="a")
+
+
+    # accepts host, phase and optional path
+    # returns PhaseTimer for use in a with block
+    def timer(self, host, phase, path=None):
+        return PhaseTimer(self, host, phase, path)
+
+
+    # accepts iterable, phase and host(item) callback naming the host each item belongs to
+    # yields every item, recording the time spent producing it (e.g. hostlist resolution) under that host
+    def timed(self, iterable, phase, host=None):
+        iterator = iter(iterable)
+        while True:
+            started = time.time()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            self.record(host(item) if host else None, phase, time.time() - started, started=started)
+            yield item
+
+
+    # accepts host, phase and seconds - byte count, error, remote path and start time optional
+    def record(self, host, phase, seconds, size=0, error=None, path=None, started=None):
+        host = host or "-"
+        with self.lock:
+            self.latencies.setdefault(phase, LatencyHistogram()).add(seconds)
+            counters = self.hosts.setdefault(host, {}).setdefault(phase, {"calls": 0, "seconds": 0.0, "bytes": 0, "errors": 0})
+            counters["calls"] += 1
+            counters["seconds"] += seconds
+            counters["bytes"] += size or 0
+            if error:
+                counters["errors"] += 1
+            if phase == "session_setup":
+                self.running.add(host)
+            elif phase == "job":
+                self.running.discard(host)
+            if self.fp:
+                event = {"ts": round(started or time.time() - seconds, 6), "script": self.script, "host": host, "phase": phase,
+                         "seconds": round(seconds, 6), "bytes": size or 0, "error": str(error) if error else None}
+                if path:
+                    event["path"] = path
+                self.fp.write(json.dumps(event) + "\n")
+
+
+    # returns dict of progress counters for the display
+    def progress(self):
+        with self.lock:
+            files, size = totals(self.hosts)
+            errors = sum(counters["errors"] for host in self.hosts.values() for counters in host.values())
+            done = sum(1 for host in self.hosts.values() if "job" in host)
+            running = len(self.running)
+        return {"files": files, "bytes": size, "errors": errors, "hosts_done": done, "hosts_running": running, "elapsed": time.time() - self.started}
+
+
+    # writes prometheus textfile collector file atomically - node_exporter never reads a partial file
+    def write_prom(self):
+        lines = []
+        with self.lock:
+            hosts = dict((host, dict((phase, dict(counters)) for phase, counters in phases.items())) for host, phases in self.hosts.items())
+            latencies = dict((phase, histogram.state()) for phase, histogram in self.latencies.items())
+        for name, key, kind, description in [
+                ("cbtk_phase_calls_total", "calls", "counter", "Operations per host and phase"),
+                ("cbtk_phase_seconds_total", "seconds", "counter", "Seconds spent per host and phase"),
+                ("cbtk_phase_bytes_total", "bytes", "counter", "Bytes transferred per host and phase"),
+                ("cbtk_phase_errors_total", "errors", "counter", "Failed operations per host and phase")]:
+            lines.append("# HELP {} {}".format(name, description))
+            lines.append("# TYPE {} {}".format(name, kind))
+            for host, phases in sorted(hosts.items()):
+                for phase, counters in sorted(phases.items()):
+                    lines.append('{}{{script="{}",host="{}",phase="{}"}} {}'.format(name, self.script, prom_escape(host), phase, counters[key]))
+        lines.append("# HELP cbtk_phase_latency_seconds Operation latency per phase")
+        lines.append("# TYPE cbtk_phase_latency_seconds summary")
+        for phase, state in sorted(latencies.items()):
+            histogram = LatencyHistogram()
+            histogram.merge(state)
+            if not histogram.count:
+                continue
+            for quantile in (50, 95, 99):
+                lines.append('cbtk_phase_latency_seconds{{script="{}",phase="{}",quantile="{}"}} {:.6f}'.format(self.script, phase, quantile / 100.0, histogram.percentile(quantile)))
+            lines.append('cbtk_phase_latency_seconds_sum{{script="{}",phase="{}"}} {:.6f}'.format(self.script, phase, histogram.sum))
+            lines.append('cbtk_phase_latency_seconds_count{{script="{}",phase="{}"}} {}'.format(self.script, phase, histogram.count))
+        lines.append("# HELP cbtk_run_timestamp_seconds Time the metrics were written")
+        lines.append("# TYPE cbtk_run_timestamp_seconds gauge")
+        lines.append('cbtk_run_timestamp_seconds{{script="{}"}} {:.0f}'.format(self.script, time.time()))
+
+        path = pathlib.Path(self.prom_path)
+        tmp_path = path.with_name(".{}.{}.tmp".format(path.name, os.getpid()))
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            with open(str(tmp_path), mode="w") as f:
+                f.write("\n".join(lines) + "\n")
+            os.replace(str(tmp_path), str(path))
+        except OSError as e:
+            print("ERROR: Could not write prometheus metrics {} - {}".format(path, e))
+            logging.error("Could not write prometheus metrics {} - {}".format(path, e))
+
+
+    def print_summary(self):
+        with self.lock:
+            latencies = dict((phase, histogram.state()) for phase, histogram in self.latencies.items())
+            hosts = dict((host, dict(phases)) for host, phases in self.hosts.items())
+        elapsed = max(time.time() - self.started, 0.001)
+        files, size = totals(hosts)
+        print("Metrics - {} file(s) - {:.1f}MB - {:.1f} files/sec - {:.2f} MB/sec - {:.1f}s".format(
+            files, size / (1024.0 * 1024), files / elapsed, size / elapsed / (1024 * 1024), elapsed))
+        for phase in PHASES:
+            if phase not in latencies or not latencies[phase]["count"]:
+                continue
+            histogram = LatencyHistogram()
+            histogram.merge(latencies[phase])
+            errors = sum(phases.get(phase, {}).get("errors", 0) for phases in hosts.values())
+            print("  {:<15} calls: {:<7} errors: {:<5} p50: {:.3f}s p95: {:.3f}s p99: {:.3f}s".format(
+                phase, histogram.count, errors, histogram.percentile(50), histogram.percentile(95), histogram.percentile(99)))
+        slowest = sorted(((phases["job"]["seconds"] + phases.get("session_setup", {}).get("seconds", 0), host)
+                          for host, phases in hosts.items() if "job" in phases), reverse=True)[:SLOWEST_HOSTS]
+        if slowest:
+            print("  Slowest hosts: {}".format(", ".join("{} ({:.1f}s)".format(host, seconds) for seconds, host in slowest)))
+
+
+    # accepts dict of host -> phase -> counters and dict of phase -> LatencyHistogram state from another process (sharded sweeps)
+    # adds them to this instance so the summary and prometheus output cover every shard
+    def merge(self, hosts, latencies):
+        with self.lock:
+            for phase, state in latencies.items():
+                self.latencies.setdefault(phase, LatencyHistogram()).merge(state)
+            for host, phases in hosts.items():
+                for phase, counters in phases.items():
+                    merged = self.hosts.setdefault(host, {}).setdefault(phase, {"calls": 0, "seconds": 0.0, "bytes": 0, "errors": 0})
+                    for key, value in counters.items():
+                        merged[key] = merged.get(key, 0) + value
+
+
+    # flushes JSON-lines output, writes the prometheus file and prints the summary (summary=False only flushes)
+    def close(self, summary=True):
+        with self.lock:
+            if self.fp:
+                self.fp.close()
+                self.fp = None
+        if not summary:
+            return
+        if self.prom_path:
+            self.write_prom()
+        self.print_summary()
+
+
+class ProgressDisplay:
+    """Status line refreshed from a background thread so progress output never blocks transfers"""
+
+    def __init__(self, metrics, interval=PROGRESS_INTERVAL, stream=None):
+        self.metrics = metrics
+        self.interval = interval
+        self.stream = stream or sys.stderr
+        self.tty = hasattr(self.stream, "isatty") and self.stream.isatty()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, name="progress")
+        self.thread.daemon = True
+
+
+    def start(self):
+        self.thread.start()
+        return self
+
+
+    def run(self):
+        last = 0
+        while not self.stopped.wait(self.interval):
+            # without a terminal to redraw on, print a plain line every 10 refreshes
+            if self.tty or time.time() - last >= self.interval * 10:
+                self.draw()
+                last = time.time()
+
+
+    def draw(self, end=""):
+        stats = self.metrics.progress()
+        line = "Hosts running: {} done: {} - files: {} - {:.1f}MB - {:.1f} files/sec - errors: {} - {:.0f}s".format(
+            stats["hosts_running"], stats["hosts_done"], stats["files"], stats["bytes"] / (1024.0 * 1024),
+            stats["files"] / max(stats["elapsed"], 0.001), stats["errors"], stats["elapsed"])
+        try:
+            if self.tty:
+                self.stream.write("\r\033[K" + line + end)
+            else:
+                self.stream.write(line + "\n")
+            self.stream.flush()
+        except (OSError, ValueError):
+            pass
+
+
+    def stop(self):
+        self.stopped.set()
+        if self.thread.is_alive():
+            self.thread.join(self.interval)
+        self.draw(end="\n")
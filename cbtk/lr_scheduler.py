@@ -0,0 +1,245 @@
+#!/usr/bin/env python3
+
+import heapq,itertools,logging,threading,time
+from concurrent.futures import Future
+from cbapi.errors import ServerError,TimeoutError as ApiTimeoutError
+from cbapi.live_response_api import LiveResponseError
+
+
+DEFAULT_MAX_JOBS = 10 # Live Response jobs running at once
+DEFAULT_RETRIES = 3
+DEFAULT_BACKOFF = 5 # seconds before the first retry, doubled for each further attempt
+PRIORITY_HIGH = 0
+PRIORITY_NORMAL = 10
+RETRYABLE_ERRORS = (LiveResponseError, ServerError, ApiTimeoutError)
+
+
+# accepts exception raised by a Live Response call
+# returns True if it is the path's own failure (file not found, access denied, ...) - a Live Response error carrying a win32 result code
+def is_path_error(e):
+    return isinstance(e, LiveResponseError) and getattr(e, "win32_error", None) is not None
+
+
+# accepts exception raised by a Live Response call
+# returns True for session and timeout errors that end the job so the scheduler can retry it, and for abandoned jobs
+def is_session_error(e):
+    return isinstance(e, JobAbandoned) or (isinstance(e, RETRYABLE_ERRORS) and not is_path_error(e))
+
+
+# accepts comma separated hostnames
+# returns set of lowercased hostnames
+def parse_priority_hosts(hosts):
+    return set(host.strip().lower() for host in (hosts or "").split(",") if host.strip())
+
+
+# accepts sensor and set of lowercased priority hostnames
+# returns scheduler priority for the sensor's job
+def host_priority(sensor, priority_hosts):
+    names = ((getattr(sensor, "computer_name", None) or "").lower(), (getattr(sensor, "computer_dns_name", None) or "").lower())
+    return PRIORITY_HIGH if priority_hosts.intersection(names) else PRIORITY_NORMAL
+
+
+class JobAbandoned(Exception):
+    """Raised by every session call of a job its caller gave up on, so the job ends and frees its slot"""
+
+
+class JobFuture(Future):
+    """Future of a scheduled job - started is set when the job first gets a slot, so time spent queued is not counted against it"""
+
+    def __init__(self):
+        Future.__init__(self)
+        self.started = None
+        self.abandoned = False
+
+
+    # gives up on a job that is already running - its next session call raises JobAbandoned and it is not retried
+    # (cancel() only stops jobs that have not started)
+    def abandon(self):
+        self.abandoned = True
+
+
+class TrackedSession:
+    """Live Response session handed to a scheduled job - calls fail with JobAbandoned once the job is abandoned"""
+
+    def __init__(self, session, future):
+        self._session = session
+        self._future = future
+
+
+    def __getattr__(self, name):
+        if self._future.abandoned:
+            raise JobAbandoned("job abandoned after its timeout")
+        return getattr(self._session, name)
+
+
+class ScheduledJob:
+    """Queued Live Response job with its retry state"""
+
+    def __init__(self, host, fn, sensor_id, priority):
+        self.host = host
+        self.fn = fn
+        self.sensor_id = sensor_id
+        self.priority = priority
+        self.attempts = 0
+        self.ran = False
+        self.not_before = 0
+        self.future = JobFuture()
+
+
+class LiveResponseScheduler:
+    """Front end for cb.live_response.submit_job with a concurrency limit, priorities and retries"""
+
+    def __init__(self, cb, max_jobs=DEFAULT_MAX_JOBS, retries=DEFAULT_RETRIES, backoff=DEFAULT_BACKOFF, metrics=None):
+        self.cb = cb
+        self.metrics = metrics
+        self.max_jobs = max(1, max_jobs)
+        self.retries = retries
+        self.backoff = backoff
+        self.queue = []
+        self.counter = itertools.count()
+        self.running = 0
+        self.completed = 0
+        self.failed = 0
+        self.retried = 0
+        self.started = time.time()
+        self.condition = threading.Condition()
+        self.stopped = False
+        self.dispatcher = threading.Thread(target=self.dispatch, name="lr-scheduler")
+        self.dispatcher.daemon = True
+        self.dispatcher.start()
+
+
+    # accepts host label, job callable, sensor id - priority (lower runs first) optional
+    # returns Future resolved with the job result once it succeeds, or its last exception once retries run out
+    def submit(self, host, fn, sensor_id, priority=PRIORITY_NORMAL):
+        job = ScheduledJob(host, fn, sensor_id, priority)
+        with self.condition:
+            self.push(job)
+            self.condition.notify()
+        return job.future
+
+
+    def push(self, job):
+        heapq.heappush(self.queue, (job.priority, next(self.counter), job))
+
+
+    # dispatcher thread - starts the highest priority job that is due once a slot is free
+    def dispatch(self):
+        while True:
+            with self.condition:
+                job, wait_for = self.next_job()
+                while job is None and not self.stopped:
+                    self.condition.wait(wait_for)
+                    job, wait_for = self.next_job()
+                if self.stopped:
+                    return
+                if job.future.started is None:
+                    if not job.future.set_running_or_notify_cancel(): # cancelled since next_job looked at it
+                        continue
+                    job.future.started = time.time()
+                self.running += 1
+            job.attempts += 1
+            try:
+                inner = self.cb.live_response.submit_job(self.wrap(job), job.sensor_id)
+            except Exception as e:
+                self.finish(job, None, e)
+                continue
+            inner.add_done_callback(lambda inner, job=job: self.finish(job, inner))
+
+
+    # accepts job
+    # returns job callable running on a TrackedSession, recording session setup (submit to first call) and job time with self.metrics
+    def wrap(self, job):
+        submitted = time.time()
+
+        def run(session):
+            job.ran = True
+            session = TrackedSession(session, job.future)
+            if not self.metrics:
+                return job.fn(session)
+            started = time.time()
+            self.metrics.record(job.host, "session_setup", started - submitted, started=submitted)
+            try:
+                result = job.fn(session)
+            except Exception as e:
+                self.metrics.record(job.host, "job", time.time() - started, error=e, started=started)
+                raise
+            self.metrics.record(job.host, "job", time.time() - started, started=started)
+            return result
+        return run
+
+
+    # returns (runnable job or None, seconds until the next retry is due or None) - caller holds the condition
+    def next_job(self):
+        if self.running >= self.max_jobs:
+            return None, None
+        now = time.time()
+        deferred = []
+        found = None
+        wait_for = None
+        while self.queue:
+            entry = heapq.heappop(self.queue)
+            job = entry[2]
+            if job.future.cancelled():
+                continue
+            if job.future.abandoned: # abandoned while waiting to be retried
+                job.future.set_exception(JobAbandoned("job abandoned after its timeout"))
+                continue
+            if job.not_before > now:
+                delay = job.not_before - now
+                wait_for = delay if wait_for is None else min(wait_for, delay)
+                deferred.append(entry)
+                continue
+            found = job
+            break
+        for entry in deferred:
+            heapq.heappush(self.queue, entry)
+        return found, wait_for
+
+
+    # accepts job, completed submit_job future (or None) and exception raised while submitting
+    # frees the job's slot, then requeues it with exponential backoff or resolves its future
+    def finish(self, job, inner, error=None):
+        if inner is not None:
+            error = inner.exception() if not inner.cancelled() else LiveResponseError("job cancelled")
+        if self.metrics and error is not None and not job.ran:
+            self.metrics.record(job.host, "session_setup", 0, error=error)
+        with self.condition:
+            self.running -= 1
+            if error is not None and isinstance(error, RETRYABLE_ERRORS) and job.attempts <= self.retries and not job.future.abandoned:
+                delay = self.backoff * (2 ** (job.attempts - 1))
+                job.not_before = time.time() + delay
+                self.retried += 1
+                self.push(job)
+                print("Retrying {} in {}s (attempt {}/{}) - {}".format(job.host, delay, job.attempts + 1, self.retries + 1, error))
+                logging.error("Retrying {} in {}s (attempt {}/{}) - {}".format(job.host, delay, job.attempts + 1, self.retries + 1, error))
+                self.condition.notify()
+                return
+            if error is None:
+                self.completed += 1
+            else:
+                self.failed += 1
+            self.condition.notify()
+        if error is None:
+            job.future.set_result(inner.result())
+        else:
+            job.future.set_exception(error)
+
+
+    # stops the dispatcher thread - queued jobs are left unstarted, running ones finish on their own
+    def stop(self):
+        with self.condition:
+            self.stopped = True
+            self.condition.notify_all()
+        self.dispatcher.join()
+
+
+    # returns one line summary of queue depth, running jobs and throughput
+    def status(self):
+        with self.condition:
+            queued = len(self.queue)
+            running = self.running
+            done = self.completed + self.failed
+            retried = self.retried
+        minutes = max(time.time() - self.started, 1) / 60.0
+        return "queued: {} - running: {} - done: {} - retries: {} - {:.1f} jobs/min".format(queued, running, done, retried, done / minutes)
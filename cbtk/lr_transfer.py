@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+
+import io,time
+
+
+DEFAULT_CHUNK_SIZE = 1024 * 1024 # bytes held in memory per transfer
+PROGRESS_INTERVAL = 64 * 1024 * 1024 # bytes between progress reports for large files
+
+
+# accepts live session and remote file path
+# returns file-like object for the remote file content
+# cbapi exposes the raw (unread) http response via get_raw_file - fall back to a buffered read for older sessions
+def open_remote_file(session, srcfile):
+    if hasattr(session, "get_raw_file"):
+        return session.get_raw_file(srcfile)
+    return io.BytesIO(session.get_file(srcfile))
+
+
+# accepts live session, remote file path and local file path (or writable file object) - chunk_size, progress callback, hashlib object and stats dict optional
+# streams remote file to disk chunk_size bytes at a time, calling progress(bytes_written) after each chunk
+# and feeding each chunk to hasher so the digest is ready without re-reading the file
+# returns total bytes written
+def stream_file(session, srcfile, dstfile, chunk_size=DEFAULT_CHUNK_SIZE, progress=None, hasher=None, stats=None):
+    fp = open_remote_file(session, srcfile)
+    try:
+        if hasattr(dstfile, "write"):
+            return copy_chunks(fp, dstfile, chunk_size, progress, hasher, stats)
+        with open(str(dstfile), mode="wb") as f:
+            return copy_chunks(fp, f, chunk_size, progress, hasher, stats)
+    finally:
+        fp.close()
+
+
+# accepts readable and writable file objects - chunk_size, progress callback, hashlib object and stats dict optional
+# stats["write_seconds"] accumulates time spent in local writes, so transfer and disk time can be told apart
+# returns total bytes copied
+def copy_chunks(src, dst, chunk_size=DEFAULT_CHUNK_SIZE, progress=None, hasher=None, stats=None):
+    written = 0
+    while True:
+        chunk = src.read(chunk_size)
+        if not chunk:
+            break
+        if stats is not None:
+            started = time.time()
+            dst.write(chunk)
+            stats["write_seconds"] = stats.get("write_seconds", 0) + time.time() - started
+        else:
+            dst.write(chunk)
+        if hasher:
+            hasher.update(chunk)
+        written += len(chunk)
+        if progress:
+            progress(written)
+    return written
+
+
+# accepts display name
+# returns progress callback that prints bytes written every PROGRESS_INTERVAL bytes
+def print_progress(name, interval=PROGRESS_INTERVAL):
+    state = {"next": interval}
+
+    def progress(written):
+        if written >= state["next"]:
+            print("Getting: {} - {} MB written".format(name, written // (1024 * 1024)))
+            state["next"] = written + interval
+    return progress
+
+
+# accepts byte count
+# returns human readable size string
+def format_size(size):
+    for unit in ["B","KB","MB","GB"]:
+        if size < 1024:
+            return "{:.0f}{}".format(size, unit) if unit == "B" else "{:.1f}{}".format(size, unit)
+        size /= 1024.0
+    return "{:.1f}TB".format(size)
@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+
+import collections,heapq,itertools,logging,time
+from concurrent.futures import FIRST_COMPLETED,ThreadPoolExecutor,wait
+from lr_scheduler import is_path_error,is_session_error
+
+
+DEFAULT_CONCURRENCY = 4 # list_directory/get_file requests in flight per session
+
+
+class DirectoryWalker:
+    """Pipelined directory traversal keeping a bounded number of Live Response requests in flight on one session"""
+
+    def __init__(self, session, concurrency=DEFAULT_CONCURRENCY, max_depth=None, metrics=None, host=None, smallest_first=False):
+        self.session = session
+        self.smallest_first = smallest_first
+        self.concurrency = max(1, concurrency)
+        self.max_depth = max_depth
+        self.hostname = session.session_data.get("hostname") if hasattr(session, "session_data") else None
+        self.metrics = metrics
+        self.host = host or self.hostname
+
+
+    # accepts remote directory path
+    # returns list of dictionaries (files) with metadata, or None if the directory itself failed (not found, access denied, ...)
+    # session, server and timeout errors are raised so the job ends and the scheduler can retry it
+    def list_directory(self, srcpath):
+        started = time.time()
+        try:
+            listing = self.session.list_directory(srcpath)
+        except Exception as e:
+            if self.metrics:
+                self.metrics.record(self.host, "list_directory", time.time() - started, error=e, path=srcpath, started=started)
+            if not is_path_error(e):
+                raise
+            print("ERROR: {} - {} - {}".format(e,srcpath,self.hostname))
+            logging.error("{} - {} - {}".format(e,srcpath,self.hostname))
+            return None
+        if self.metrics:
+            self.metrics.record(self.host, "list_directory", time.time() - started, path=srcpath, started=started)
+        return listing
+
+
+    # accepts root srcpath (with trailing separator), caller context for the root, and handlers
+    #   descend(srcpath, entry, context, depth) -> child context, or None to prune the subdirectory (coordinator thread)
+    #   fetch(srcpath, entry, context) -> runs on a worker thread for every file entry
+    #   on_listing(srcpath, listing, context) -> optional, called with every directory listing (coordinator thread)
+    #   want_file(srcpath, entry, context) -> optional, return False to skip a file without using a worker slot
+    # subdirectory listings are prefetched while files are still downloading
+    # with smallest_first, queued files are fetched smallest first instead of in listing order
+    # returns True if the root directory could be listed
+    def walk(self, srcpath, context, descend, fetch, on_listing=None, want_file=None):
+        return self.walk_roots([(srcpath, context)], descend, fetch, on_listing=on_listing, want_file=want_file)
+
+
+    # accepts list of (srcpath, context) roots and the walk() handlers
+    # traverses every root in one pipeline so they share the session's request slots
+    # returns True if the first root directory could be listed
+    def walk_roots(self, roots, descend, fetch, on_listing=None, want_file=None):
+        first_root = roots[0][0] if roots else None
+        listings = collections.deque((srcpath, context, 0) for srcpath, context in roots)
+        files = [] # heap of (size or listing order, order, srcpath, entry, context)
+        order = itertools.count()
+        pending = {}
+        listing_slots = max(1, self.concurrency // 2)
+        root_listed = None
+
+        executor = ThreadPoolExecutor(max_workers=self.concurrency)
+        try:
+            while listings or files or pending:
+                # fill free slots - listings first so the next level is known before files run out,
+                # but leave room for downloads so time to first byte stays low
+                while len(pending) < self.concurrency and (listings or files):
+                    in_flight = sum(1 for task in pending.values() if task[0] == "list")
+                    if listings and (not files or in_flight < listing_slots):
+                        path, ctx, depth = listings.popleft()
+                        future = executor.submit(self.list_directory, path)
+                        pending[future] = ("list", path, ctx, depth)
+                    else:
+                        _, _, path, entry, ctx = heapq.heappop(files)
+                        future = executor.submit(fetch, path, entry, ctx)
+                        pending[future] = ("file", path, ctx, entry)
+
+                done, _ = wait(list(pending), return_when=FIRST_COMPLETED)
+                for future in done:
+                    kind, path, ctx, extra = pending.pop(future)
+                    if kind == "file":
+                        self.file_done(future, path, extra)
+                        continue
+
+                    listing = future.result()
+                    if extra == 0 and path == first_root: # roots are listed concurrently - only the first one decides
+                        root_listed = listing is not None
+                    if not listing:
+                        continue
+                    if on_listing:
+                        on_listing(path, listing, ctx)
+                    for entry in listing:
+                        if "DIRECTORY" in entry["attributes"]:
+                            if entry["filename"] in (".",".."):
+                                continue
+                            depth = extra + 1
+                            if self.max_depth is not None and depth > self.max_depth:
+                                continue
+                            child = descend(path, entry, ctx, depth)
+                            if child is not None:
+                                listings.append(("{}{}{}".format(path,entry["filename"],path[-1]), child, depth))
+                        elif want_file is None or want_file(path, entry, ctx):
+                            n = next(order)
+                            heapq.heappush(files, ((entry.get("size") or 0) if self.smallest_first else n, n, path, entry, ctx))
+        finally:
+            for future in pending:
+                future.cancel()
+            executor.shutdown(wait=True)
+        return bool(root_listed)
+
+
+    # accepts completed fetch future, directory path and file entry
+    # logs fetch failures without stopping the rest of the traversal - session, server and timeout errors end it
+    def file_done(self, future, srcpath, entry):
+        e = future.exception()
+        if e is not None and is_session_error(e):
+            raise e
+        if e is not None:
+            print("ERROR: {} - {}{} - {}".format(e,srcpath,entry["filename"],self.hostname))
+            logging.error("{} - {}{} - {}".format(e,srcpath,entry["filename"],self.hostname))
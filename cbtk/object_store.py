@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+
+import json,logging,os,pathlib,shutil,threading,time,uuid
+
+
+INDEX_NAME = "index.jsonl"
+
+
+class ObjectStore:
+    """Content-addressed file store shared across hosts - each unique file is kept once and linked into host trees"""
+
+    def __init__(self, root):
+        self.root = pathlib.Path(root)
+        self.objects = self.root.joinpath("objects")
+        self.tmp = self.root.joinpath("tmp")
+        self.index_path = self.root.joinpath(INDEX_NAME)
+        self.lock = threading.Lock()
+        self.tmp.mkdir(parents=True, exist_ok=True)
+        self.objects.mkdir(parents=True, exist_ok=True)
+
+
+    # returns unique temporary path on the store's filesystem for an in-progress download
+    def temp_path(self):
+        return self.tmp.joinpath(uuid.uuid4().hex)
+
+
+    # accepts sha256 hex digest
+    # returns path of the stored object
+    def object_path(self, digest):
+        return self.objects.joinpath(digest[:2], digest)
+
+
+    # accepts completed temporary file and its sha256 hex digest
+    # moves the file into the store, or discards it if the object is already stored
+    # returns True if the object is new
+    def add(self, tmpfile, digest):
+        obj = self.object_path(digest)
+        if obj.exists():
+            os.remove(str(tmpfile))
+            return False
+        obj.parent.mkdir(exist_ok=True)
+        os.replace(str(tmpfile), str(obj))
+        return True
+
+
+    # accepts sha256 hex digest and local destination file
+    # links the stored object into the host tree - hardlink, then symlink, then a plain copy
+    # returns link type used
+    def link(self, digest, dstfile):
+        obj = self.object_path(digest)
+        dstfile = pathlib.Path(dstfile)
+        if dstfile.exists() or dstfile.is_symlink():
+            dstfile.unlink()
+        try:
+            os.link(str(obj), str(dstfile))
+            return "hardlink"
+        except OSError:
+            pass
+        try:
+            os.symlink(str(obj.resolve()), str(dstfile))
+            return "symlink"
+        except OSError:
+            shutil.copyfile(str(obj), str(dstfile))
+            return "copy"
+
+
+    # accepts host, remote path, sha256 hex digest and size
+    # appends a (host, remote path) -> hash mapping to the store index
+    def record(self, host, remote, digest, size):
+        line = json.dumps({"host": host, "path": remote, "sha256": digest, "size": size, "collected": int(time.time())})
+        with self.lock:
+            try:
+                with open(str(self.index_path), mode="a") as f:
+                    f.write(line + "\n")
+            except OSError as e:
+                print("ERROR: Could not update object store index {} - {}".format(self.index_path, e))
+                logging.error("Could not update object store index {} - {}".format(self.index_path, e))
@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+
+import csv,re
+
+
+NETSTAT_FIELDS = ["proto","local_address","foreign_address","state","pid","program"]
+TASKLIST_FIELDS = ["image_name","pid","session_name","session","mem_usage","status","user_name","cpu_time","window_title"]
+PS_FIELDS = ["user","pid","ppid","cpu","mem","vsz","rss","tty","stat","start","time","command"]
+PS_ALIASES = {"uid": "user", "c": "cpu", "stime": "start", "cmd": "command", "args": "command"}
+
+
+# accepts column header
+# returns lowercase field name [Image Name] -> image_name [%CPU] -> cpu [Session#] -> session
+def field_name(header):
+    return re.sub(r"[^a-z0-9]+", "_", header.strip().lower()).strip("_")
+
+
+# accepts netstat output - windows (netstat -ano), linux (netstat -antup) or mac (netstat -an)
+# yields one row per socket
+def parse_netstat(output):
+    for line in output.splitlines():
+        parts = line.split()
+        if len(parts) < 3 or not parts[0].lower().startswith(("tcp","udp")):
+            continue
+        if len(parts) > 4 and parts[1].isdigit() and parts[2].isdigit(): # Recv-Q and Send-Q columns on linux/mac
+            parts = parts[:1] + parts[3:]
+        rest = parts[3:]
+        state = rest.pop(0) if rest and not rest[0][:1].isdigit() and rest[0] != "-" else ""
+        pid, _, program = (rest[0] if rest else "").partition("/")
+        yield {"proto": parts[0].lower(), "local_address": parts[1], "foreign_address": parts[2], "state": state,
+               "pid": pid if pid != "-" else "", "program": program}
+
+
+# accepts tasklist output - the default table (with or without /v) or /fo csv
+# yields one row per process
+def parse_tasklist(output):
+    lines = [line for line in output.splitlines() if line.strip()]
+    if lines and lines[0].startswith('"'):
+        reader = csv.reader(lines)
+        header = [field_name(name) for name in next(reader)]
+        for values in reader:
+            yield dict(zip(header, values))
+        return
+    for n, line in enumerate(lines):
+        if set(line.strip()) <= set("= ") and n > 0: # ==== ==== underline gives the column widths
+            starts = [m.start() for m in re.finditer(r"=+", line)]
+            columns = list(zip(starts, starts[1:] + [None]))
+            header = [field_name(lines[n - 1][start:end]) for start, end in columns]
+            for row in lines[n + 1:]:
+                yield dict((name, row[start:end].strip()) for name, (start, end) in zip(header, columns))
+            return
+
+
+# accepts ps output with a header line (ps aux, ps -ef, ps -eo ...)
+# yields one row per process - the last column keeps its spaces
+def parse_ps(output):
+    lines = [line for line in output.splitlines() if line.strip()]
+    if not lines:
+        return
+    header = [PS_ALIASES.get(field_name(name), field_name(name)) for name in lines[0].split()]
+    for line in lines[1:]:
+        yield dict(zip(header, line.split(None, len(header) - 1)))
+
+
+PARSERS = {"netstat": (NETSTAT_FIELDS, parse_netstat), "tasklist": (TASKLIST_FIELDS, parse_tasklist), "ps": (PS_FIELDS, parse_ps)}
+
+
+# accepts command line
+# returns (fields, parser) for the program it runs, or None if there is no parser for it
+def parser_for(command):
+    program = command.strip().split(None, 1)[0].strip("\"'") if command.strip() else ""
+    program = re.split(r"[\\/]", program)[-1].lower()
+    if program.endswith(".exe"):
+        program = program[:-4]
+    return PARSERS.get(program)
@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+
+import fnmatch,re
+
+
+MAGIC = re.compile(r"[*?[]")
+
+
+# accepts raw path string with "/" or "\" separators
+# returns (literal root directory, list of pattern segments) - segments is empty when there is no wildcard
+# C:/Windows/Prefetch/*.pf -> ("C:/Windows/Prefetch", ["*.pf"])
+# C:/Users/**/NTUSER.DAT   -> ("C:/Users", ["**", "NTUSER.DAT"])
+def split_glob(path):
+    parts = [p for p in re.split(r"[\\/]+", path) if p]
+    for i, part in enumerate(parts):
+        if MAGIC.search(part):
+            root = "/".join(parts[:i])
+            if path.startswith(("/","\\")):
+                root = "/" + root
+            return root, parts[i:]
+    return path, []
+
+
+class PathPattern:
+    """Glob pattern relative to a root directory - supports *, ?, [...] and ** (any number of directories)"""
+
+    def __init__(self, segments, case_sensitive=True):
+        flags = 0 if case_sensitive else re.IGNORECASE
+        self.segments = []
+        for segment in segments:
+            if segment == "**":
+                self.segments.append(None)
+            else:
+                self.segments.append(re.compile(fnmatch.translate(segment), flags))
+        self.final = len(self.segments)
+
+
+    # returns initial match state for the root directory
+    def start(self):
+        return self.closure({0})
+
+
+    # accepts set of segment indexes
+    # returns set with every state reachable by letting ** match zero directories
+    def closure(self, states):
+        states = set(states)
+        for i in sorted(states):
+            while i < self.final and self.segments[i] is None:
+                i += 1
+                states.add(i)
+        return frozenset(states)
+
+
+    # accepts current states and one path component
+    # returns states after consuming that component
+    def advance(self, states, name):
+        nxt = set()
+        for i in states:
+            if i >= self.final:
+                continue
+            segment = self.segments[i]
+            if segment is None:
+                nxt.add(i) # ** consumes this component and may consume more
+                nxt.add(i + 1)
+            elif segment.match(name):
+                nxt.add(i + 1)
+        return self.closure(nxt)
+
+
+    # accepts parent states and subdirectory name
+    # returns child states, or None if nothing beneath the subdirectory can match (prune before listing it)
+    def descend(self, states, name):
+        child = self.advance(states, name)
+        if not any(i < self.final for i in child):
+            return None
+        return child
+
+
+    # accepts parent states and file name
+    # returns True if the file matches the pattern
+    def match_file(self, states, name):
+        return self.final in self.advance(states, name)
+
+
+# accepts raw --get_directory value and sensor os_type
+# returns (literal root directory, compiled PathPattern or None)
+def compile_glob(path, os_type="windows"):
+    root, segments = split_glob(path)
+    if not segments:
+        return path, None
+    return root, PathPattern(segments, case_sensitive=os_type.lower() != "windows")
+
+
+class PatternSet:
+    """Several PathPatterns matched together so a shared directory is listed once for all of them"""
+
+    def __init__(self, patterns):
+        self.patterns = list(patterns)
+
+
+    # returns initial match state - a set of (pattern index, segment index) pairs
+    def start(self):
+        return frozenset((i, state) for i, pattern in enumerate(self.patterns) for state in pattern.start())
+
+
+    # accepts states and one path component
+    # returns dict of pattern index -> states after consuming that component
+    def advance(self, states, name):
+        grouped = {}
+        for i, state in states:
+            grouped.setdefault(i, set()).add(state)
+        return dict((i, self.patterns[i].advance(grouped[i], name)) for i in grouped)
+
+
+    def descend(self, states, name):
+        child = set()
+        for i, advanced in self.advance(states, name).items():
+            if any(state < self.patterns[i].final for state in advanced):
+                child.update((i, state) for state in advanced)
+        return frozenset(child) if child else None
+
+
+    def match_file(self, states, name):
+        return any(self.patterns[i].final in advanced for i, advanced in self.advance(states, name).items())
@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+
+import logging,posixpath,tarfile,time,uuid,zipfile
+
+
+DEFAULT_ARCHIVE_TIMEOUT = 600 # seconds create_process waits for the endpoint to finish archiving
+REMOTE_TEMP = {"windows": "C:\\Windows\\Temp\\", "linux": "/tmp/", "mac": "/tmp/"}
+EXIT_MARKER = "CBTK_EXIT="
+
+
+class RemoteArchiveError(Exception):
+    """Endpoint could not archive a directory - callers fall back to per-file collection"""
+
+
+# accepts string
+# returns string quoted for a posix shell
+def quote_posix(value):
+    return "'{}'".format(value.replace("'", "'\\''"))
+
+
+# accepts string
+# returns string quoted as a powershell literal
+def quote_powershell(value):
+    return "'{}'".format(value.replace("'", "''"))
+
+
+# accepts remote path, remote directory and os_type
+# returns True if path is the directory or lies anywhere below it
+def is_under(path, directory, os_type):
+    if os_type.lower() == "windows":
+        path, directory = path.replace("/", "\\").lower(), directory.replace("/", "\\").lower()
+        sep = "\\"
+    else:
+        sep = "/"
+    directory = directory.rstrip(sep) + sep
+    return (path.rstrip(sep) + sep).startswith(directory)
+
+
+# accepts remote directory, remote archive path, os_type and find-style depth (None for unlimited, 1 for top level files only)
+# returns command line that archives the directory on the endpoint and prints EXIT_MARKER with its exit status, or None if unsupported
+# on linux/mac the archive itself is left out by name, so staging it inside srcpath does not archive it into itself
+def archive_command(srcpath, archive, os_type, depth=None):
+    if os_type.lower() == "windows":
+        if depth not in (None, 1):
+            return None # Compress-Archive flattens piped files, so a depth limit cannot keep the tree layout
+        items = "Get-ChildItem -LiteralPath {} -Force{}".format(quote_powershell(srcpath), " -File" if depth == 1 else "")
+        script = "$ProgressPreference='SilentlyContinue'; try {{ {} | Compress-Archive -DestinationPath {} -CompressionLevel Optimal -ErrorAction Stop; '{}0' }} catch {{ $_; '{}1' }}".format(
+            items, quote_powershell(archive), EXIT_MARKER, EXIT_MARKER)
+        return 'powershell.exe -NoProfile -NonInteractive -Command "{}"'.format(script)
+    if os_type.lower() in ["linux","mac"]:
+        script = "cd {} && find . {}-type f ! -name {} | tar -czf {} -T - ; echo {}$?".format(
+            quote_posix(srcpath), "-maxdepth {} ".format(depth) if depth else "", quote_posix(posixpath.basename(archive)), quote_posix(archive), EXIT_MARKER)
+        return "/bin/sh -c {}".format(quote_posix(script))
+    return None
+
+
+# accepts live session, remote directory, os_type, depth and timeout
+# archives the directory on the endpoint with a single create_process call
+# returns remote archive path - raises RemoteArchiveError if the endpoint could not build it
+def create_remote_archive(session, srcpath, os_type, depth=None, timeout=DEFAULT_ARCHIVE_TIMEOUT):
+    extension = ".zip" if os_type.lower() == "windows" else ".tar.gz"
+    staging = REMOTE_TEMP.get(os_type.lower(), "/tmp/")
+    if os_type.lower() == "windows" and is_under(staging, srcpath, os_type):
+        # Compress-Archive cannot leave out one nested file, so the archive would end up inside itself
+        raise RemoteArchiveError("the staging directory {} is inside {}".format(staging, srcpath))
+    archive = "{}cbtk_{}{}".format(staging, uuid.uuid4().hex, extension)
+    command = archive_command(srcpath.rstrip("\\/") or srcpath, archive, os_type, depth)
+    if not command:
+        raise RemoteArchiveError("endpoint archiving is not supported for os_type {} with this depth".format(os_type))
+    try:
+        output = session.create_process(command, wait_for_output=True, wait_timeout=timeout)
+    except Exception as e:
+        delete_remote_file(session, archive)
+        raise RemoteArchiveError("create_process failed - {}".format(e))
+    if isinstance(output, bytes):
+        output = output.decode("utf-8", "replace")
+    if "{}0".format(EXIT_MARKER) not in (output or ""):
+        delete_remote_file(session, archive)
+        raise RemoteArchiveError("archive command failed - {}".format((output or "no output").strip()[-500:]))
+    return archive
+
+
+# accepts live session and remote file path
+# removes the file, logging instead of raising so a failed cleanup never fails the collection
+def delete_remote_file(session, path):
+    try:
+        session.delete_file(path)
+    except Exception as e:
+        logging.error("Could not delete remote file {} - {}".format(path, e))
+
+
+class ArchiveMembers:
+    """Downloaded endpoint archive presented as remote directory listings, so files flow through the normal get_file path"""
+
+    def __init__(self, path, srcpath):
+        self.path = str(path)
+        self.srcpath = srcpath
+        self.sep = srcpath[-1] if srcpath[-1] in "\\/" else "/"
+        self.members = {}
+        if zipfile.is_zipfile(self.path):
+            self.archive = zipfile.ZipFile(self.path)
+        else:
+            self.archive = tarfile.open(self.path, mode="r:*")
+
+
+    # yields (remote parent path, directory entry, relative path parts) for every regular file in the archive
+    # members with absolute or parent-relative names are skipped
+    def entries(self):
+        if isinstance(self.archive, zipfile.ZipFile):
+            members = [(info.filename, info, info.file_size, time.mktime(info.date_time + (0, 0, -1)))
+                       for info in self.archive.infolist() if not info.filename.endswith(("/","\\"))]
+        else:
+            members = [(info.name, info, info.size, info.mtime) for info in self.archive.getmembers() if info.isfile()]
+        for name, info, size, mtime in members:
+            parts = [part for part in name.replace("\\","/").split("/") if part not in ("", ".")]
+            if not parts or ".." in parts or ":" in parts[0]:
+                logging.error("Skipping unsafe archive member {} in {}".format(name, self.path))
+                continue
+            parent = self.srcpath + "".join(part + self.sep for part in parts[:-1])
+            entry = {"filename": parts[-1], "size": size, "last_write_time": int(mtime), "attributes": ["ARCHIVE"]}
+            self.members[parent + parts[-1]] = info
+            yield parent, entry, parts
+
+
+    # accepts remote path of an archived file
+    # returns readable file object for it - stands in for session.get_raw_file
+    def get_raw_file(self, remote):
+        info = self.members[remote]
+        if isinstance(self.archive, zipfile.ZipFile):
+            return self.archive.open(info)
+        return self.archive.extractfile(info)
+
+
+    def close(self):
+        self.archive.close()
@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+
+import re,sqlite3
+from remote_archive import EXIT_MARKER,quote_posix,quote_powershell
+
+
+DEFAULT_HASH_TIMEOUT = 600 # seconds create_process waits for the endpoint to finish hashing
+SHA256 = re.compile(r"\b([0-9a-fA-F]{64})\b")
+SQLITE_HEADER = b"SQLite format 3\x00"
+
+
+class RemoteHashError(Exception):
+    """Endpoint could not hash a directory - callers download every file instead"""
+
+
+# accepts known hashes path - flat file with one sha256 per line (sha256sum/Get-FileHash output works too) or a collection index database
+# returns set of lowercase sha256 strings
+def read_known_hashes(path):
+    with open(str(path), mode="rb") as f:
+        header = f.read(len(SQLITE_HEADER))
+    if header == SQLITE_HEADER:
+        db = sqlite3.connect("file:{}?mode=ro".format(path), uri=True)
+        try:
+            return set(row[0].lower() for row in db.execute("SELECT DISTINCT sha256 FROM files WHERE sha256 IS NOT NULL"))
+        finally:
+            db.close()
+    known = set()
+    with open(str(path), mode="r", errors="replace") as f:
+        for line in f:
+            m = SHA256.search(line)
+            if m:
+                known.add(m.group(1).lower())
+    return known
+
+
+# accepts remote directory, os_type and find-style depth (None for unlimited, 1 for top level files only)
+# returns command line printing "<sha256> <path>" for every file and EXIT_MARKER with its exit status, or None if unsupported
+def hash_command(srcpath, os_type, depth=None):
+    if os_type.lower() == "windows":
+        recurse = "" if depth == 1 else " -Recurse" + (" -Depth {}".format(depth - 1) if depth else "")
+        script = ("$ProgressPreference='SilentlyContinue'; try {{ Get-ChildItem -LiteralPath {} -Force -File{} -ErrorAction SilentlyContinue | "
+                  "Get-FileHash -Algorithm SHA256 -ErrorAction SilentlyContinue | ForEach-Object {{ $_.Hash + ' ' + $_.Path }}; '{}0' }} catch {{ $_; '{}1' }}").format(
+            quote_powershell(srcpath), recurse, EXIT_MARKER, EXIT_MARKER)
+        return 'powershell.exe -NoProfile -NonInteractive -Command "{}"'.format(script)
+    if os_type.lower() in ["linux","mac"]:
+        hasher = "sha256sum" if os_type.lower() == "linux" else "shasum -a 256"
+        script = "find {} {}-type f -exec {} {{}} + ; echo {}$?".format(
+            quote_posix(srcpath), "-maxdepth {} ".format(depth) if depth else "", hasher, EXIT_MARKER)
+        return "/bin/sh -c {}".format(quote_posix(script))
+    return None
+
+
+# accepts remote path and os_type
+# returns key remote paths are matched on - windows paths are case insensitive
+def path_key(path, os_type):
+    return path.lower() if os_type.lower() == "windows" else path
+
+
+# accepts live session, remote directory, os_type, depth and timeout
+# hashes every file below the directory on the endpoint with a single create_process call
+# returns dict of path_key(remote path) -> lowercase sha256 - files the endpoint could not read are left out
+# raises RemoteHashError if the endpoint could not run the command
+def hash_remote_directory(session, srcpath, os_type, depth=None, timeout=DEFAULT_HASH_TIMEOUT):
+    command = hash_command(srcpath.rstrip("\\/") or srcpath, os_type, depth)
+    if not command:
+        raise RemoteHashError("endpoint hashing is not supported for os_type {}".format(os_type))
+    try:
+        output = session.create_process(command, wait_for_output=True, wait_timeout=timeout)
+    except Exception as e:
+        raise RemoteHashError("create_process failed - {}".format(e))
+    if isinstance(output, bytes):
+        output = output.decode("utf-8", "replace")
+    output = output or ""
+    if EXIT_MARKER not in output or (os_type.lower() == "windows" and "{}1".format(EXIT_MARKER) in output):
+        raise RemoteHashError("hash command failed - {}".format(output.strip()[-500:] or "no output"))
+    hashes = {}
+    for line in output.splitlines():
+        digest, _, path = line.partition(" ")
+        path = path[1:] if path[:1] in (" ","*") else path # sha256sum separates with two spaces, or " *" in binary mode
+        if len(digest) == 64 and path:
+            hashes[path_key(path, os_type)] = digest.lower()
+    return hashes
@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+
+import bisect,ipaddress,json,logging,os,pathlib,time
+
+
+DEFAULT_CACHE_PATH = pathlib.Path.home().joinpath(".cbtk","sensor_inventory.json")
+DEFAULT_TTL = 900 # seconds
+
+
+class SensorRecord:
+    """Read-only view of a single sensor document returned by /api/v1/sensor"""
+
+    def __init__(self, info):
+        self._info = info
+
+
+    def __getattr__(self, name):
+        try:
+            return self.__dict__["_info"][name]
+        except KeyError:
+            raise AttributeError(name)
+
+
+    def __repr__(self):
+        return "<SensorRecord id={} computer_name={}>".format(self._info.get("id"), self._info.get("computer_name"))
+
+
+    # returns list of ip address strings parsed from network_adapters ("ip,mac|ip,mac|")
+    @property
+    def ip_addresses(self):
+        ips = []
+        for adapter in (self._info.get("network_adapters") or "").split("|"):
+            ip = adapter.split(",")[0].strip()
+            if ip:
+                ips.append(ip)
+        return ips
+
+
+    @property
+    def os_type(self):
+        return (self._info.get("os_environment_display_string") or "").split(" ")[0] # returns mac, linux, or windows
+
+
+class SensorInventory:
+    """Bulk sensor inventory with hostname/computer_name/ip indexes and an on-disk snapshot"""
+
+    def __init__(self, cb, cache_path=None, ttl=DEFAULT_TTL):
+        self.cb = cb
+        self.cache_path = pathlib.Path(cache_path) if cache_path else DEFAULT_CACHE_PATH
+        self.ttl = ttl
+        self.fetched = 0
+        self.sensors = {}
+        self.by_name = {}
+        self.by_ip = {}
+        self.ip_ranges = {}
+
+
+    # accepts refresh flag
+    # loads snapshot from disk if it is fresh and belongs to this server, otherwise pulls every sensor in one request
+    def load(self, refresh=False):
+        sensors = None
+        if not refresh and self.ttl > 0:
+            sensors = self.read_snapshot()
+        if sensors is None:
+            sensors = self.fetch()
+            self.fetched = time.time()
+            self.write_snapshot(sensors)
+        self.build_indexes(sensors)
+        return self
+
+
+    # returns list of sensor dictionaries from a single bulk /api/v1/sensor query
+    def fetch(self):
+        print("Refreshing sensor inventory from {}".format(getattr(self.cb, "url", "server")))
+        return self.cb.get_object("/api/v1/sensor") or []
+
+
+    # returns list of sensor dictionaries from snapshot, or None if missing/stale/for another server
+    def read_snapshot(self):
+        try:
+            with open(str(self.cache_path), mode="r") as f:
+                snapshot = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if snapshot.get("server") != getattr(self.cb, "url", None):
+            return None
+        if time.time() - snapshot.get("fetched", 0) > self.ttl:
+            return None
+        self.fetched = snapshot["fetched"]
+        return snapshot.get("sensors", [])
+
+
+    # accepts list of sensor dictionaries
+    # writes snapshot atomically so concurrent runs never read a partial file
+    def write_snapshot(self, sensors):
+        snapshot = {"server": getattr(self.cb, "url", None), "fetched": self.fetched, "sensors": sensors}
+        tmp_path = self.cache_path.with_name("{}.{}.tmp".format(self.cache_path.name, os.getpid()))
+        try:
+            self.cache_path.parent.mkdir(parents=True, exist_ok=True)
+            with open(str(tmp_path), mode="w") as f:
+                json.dump(snapshot, f)
+            os.replace(str(tmp_path), str(self.cache_path))
+        except OSError as e:
+            print("ERROR: Could not write sensor inventory snapshot {} - {}".format(self.cache_path, e))
+            logging.error("Could not write sensor inventory snapshot {} - {}".format(self.cache_path, e))
+
+
+    # accepts list of sensor dictionaries
+    # builds lowercased hostname/computer_name and ip indexes - duplicates keep the preferred sensor
+    def build_indexes(self, sensors):
+        self.sensors = {}
+        self.by_name = {}
+        self.by_ip = {}
+        for info in sensors:
+            sensor = SensorRecord(info)
+            self.sensors[sensor.id] = sensor
+            for name in self.names_for(sensor):
+                self.by_name[name] = self.prefer(self.by_name.get(name), sensor)
+            for ip in sensor.ip_addresses:
+                self.by_ip[ip] = self.prefer(self.by_ip.get(ip), sensor)
+        self.build_ip_ranges()
+
+
+    # builds sorted (integer address, sensor) arrays per ip version so cidr ranges resolve by bisection
+    def build_ip_ranges(self):
+        addresses = {4: [], 6: []}
+        for ip, sensor in self.by_ip.items():
+            try:
+                address = ipaddress.ip_address(ip)
+            except ValueError:
+                continue
+            addresses[address.version].append((int(address), sensor))
+        self.ip_ranges = {}
+        for version, pairs in addresses.items():
+            pairs.sort(key=lambda pair: pair[0])
+            self.ip_ranges[version] = ([pair[0] for pair in pairs], [pair[1] for pair in pairs])
+
+
+    # accepts SensorRecord
+    # returns set of lowercased names the sensor can be looked up by
+    def names_for(self, sensor):
+        names = set()
+        for key in ("computer_name", "computer_dns_name", "hostname"):
+            name = (sensor._info.get(key) or "").strip().lower()
+            if name:
+                names.add(name)
+                names.add(name.split(".")[0])
+        return names
+
+
+    # accepts existing and candidate SensorRecord
+    # returns online sensors over offline ones, then the newest sensor id (reinstalls get a new id)
+    def prefer(self, current, candidate):
+        if current is None:
+            return candidate
+        current_rank = ((current.status or "").lower() == "online", current.id)
+        candidate_rank = ((candidate.status or "").lower() == "online", candidate.id)
+        return candidate if candidate_rank > current_rank else current
+
+
+    # accepts hostname string
+    # returns SensorRecord or None
+    def lookup_hostname(self, hostname):
+        hostname = hostname.strip().lower()
+        sensor = self.by_name.get(hostname)
+        if not sensor and "." in hostname:
+            sensor = self.by_name.get(hostname.split(".")[0])
+        return sensor
+
+
+    # accepts ip string
+    # returns SensorRecord or None
+    def lookup_ip(self, ip):
+        try:
+            return self.by_ip.get(str(ipaddress.ip_address(ip.strip())))
+        except ValueError:
+            return None
+
+
+    # accepts cidr string
+    # returns list of known sensors with an address inside the range - the address space itself is never enumerated
+    def lookup_network(self, cidr):
+        try:
+            net = ipaddress.ip_network(cidr.strip(), strict=False)
+        except ValueError:
+            return []
+        keys, sensors = self.ip_ranges.get(net.version, ([], []))
+        start = bisect.bisect_left(keys, int(net.network_address))
+        end = bisect.bisect_right(keys, int(net.broadcast_address))
+        found = {}
+        for sensor in sensors[start:end]:
+            found[sensor.id] = sensor
+        return list(found.values())
+
+
+    # accepts host string and host_type (translate_host() verdict)
+    # returns SensorRecord or None
+    def resolve(self, host, host_type="hostname"):
+        if host_type == "ip":
+            return self.lookup_ip(host)
+        return self.lookup_hostname(host)
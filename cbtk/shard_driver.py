@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+
+import logging,multiprocessing,os,pathlib,queue,signal,sys,threading,time
+from lr_metrics import totals
+
+
+STATUS_INTERVAL = 60 # seconds between aggregated shard reports
+PROGRESS_INTERVAL = 1.0 # seconds between progress snapshots sent by each shard
+STOP_GRACE = 10 # seconds shards get to exit after Ctrl-C before they are terminated
+
+
+# accepts list of items and shard count
+# returns list of shards - dealt round-robin so every shard gets a similar mix of the hostlist
+def partition(items, shards):
+    return [items[i::shards] for i in range(shards) if items[i::shards]]
+
+
+# accepts output path or None and shard number
+# returns per-shard path (metrics.jsonl -> metrics.shard2.jsonl) so shards never interleave writes
+def shard_path(path, shard):
+    if not path:
+        return None
+    path = pathlib.Path(path)
+    return str(path.with_name("{}.shard{}{}".format(path.stem, shard, path.suffix)))
+
+
+class ShardReporter:
+    """Worker side of the driver - forwards job results, progress snapshots and the final metrics to the parent"""
+
+    def __init__(self, events, shard):
+        self.events = events
+        self.shard = shard
+        self.stopped = threading.Event()
+        self.thread = None
+
+
+    # accepts Metrics
+    # sends its progress counters to the parent every PROGRESS_INTERVAL from a background thread
+    def start(self, metrics):
+        def run():
+            while not self.stopped.wait(PROGRESS_INTERVAL):
+                self.events.put(("progress", self.shard, metrics.progress()))
+        self.thread = threading.Thread(target=run, name="shard-progress")
+        self.thread.daemon = True
+        self.thread.start()
+
+
+    # accepts host label and job future
+    # reports the job to the parent the moment it completes
+    def watch(self, host, future):
+        submitted = time.time()
+        def done(future):
+            if future.cancelled() or getattr(future, "abandoned", False):
+                return # timed out - reported with the shard's timed out hosts
+            e = future.exception()
+            if not e and future.result() is False:
+                e = "job reported failure"
+            self.events.put(("job", self.shard, host, str(e) if e else None, time.time() - submitted))
+        future.add_done_callback(done)
+
+
+    # accepts host label and reason
+    # reports a host the shard could not schedule
+    def failed(self, host, reason):
+        self.events.put(("job", self.shard, host, reason, 0))
+
+
+    # accepts Metrics and list of hosts that timed out
+    # sends the shard's final counters and latencies to the parent
+    def done(self, metrics, timed_out=()):
+        self.stopped.set()
+        with metrics.lock:
+            hosts = dict((host, dict((phase, dict(counters)) for phase, counters in phases.items())) for host, phases in metrics.hosts.items())
+            latencies = dict((phase, histogram.state()) for phase, histogram in metrics.latencies.items())
+        self.events.put(("done", self.shard, {"hosts": hosts, "latencies": latencies, "timed_out": list(timed_out)}))
+
+
+# accepts worker, shard number, shard items, event queue, verbose flag and extra worker arguments
+# worker process entry point - Ctrl-C is left to the parent, output is silenced unless verbose
+def shard_main(worker, shard, items, events, verbose, args):
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    if not verbose:
+        sys.stdout = open(os.devnull, mode="w")
+    reporter = ShardReporter(events, shard)
+    try:
+        worker(shard, items, reporter, *args)
+    except Exception as e:
+        logging.error("Shard {} failed - {}".format(shard, e))
+        events.put(("error", shard, str(e)))
+
+
+class ShardedDriver:
+    """Parent side - runs each shard of the resolved hosts in its own worker process and aggregates their results"""
+
+    def __init__(self, shards, metrics, verbose=False, status_interval=STATUS_INTERVAL):
+        self.shards = max(1, shards)
+        self.metrics = metrics
+        self.verbose = verbose
+        self.status_interval = status_interval
+        self.started = time.time()
+        self.snapshots = {}
+        self.finished = []
+        self.failed = []
+        self.timed_out = []
+        self.total = 0
+
+
+    # returns progress counters summed across shards - stands in for Metrics.progress so ProgressDisplay works unchanged
+    def progress(self):
+        stats = {"files": 0, "bytes": 0, "errors": 0, "hosts_done": 0, "hosts_running": 0}
+        for snapshot in list(self.snapshots.values()):
+            for key in stats:
+                stats[key] += snapshot.get(key, 0)
+        stats["elapsed"] = time.time() - self.started
+        return stats
+
+
+    # accepts worker(shard, items, reporter, *args), list of items and extra worker arguments
+    # blocks until every shard has reported, merging job results and metrics as they arrive
+    # returns True if every job finished without an exception
+    def run(self, worker, items, *args):
+        context = multiprocessing.get_context("spawn") # workers never inherit the parent's scheduler threads
+        events = context.Queue()
+        shards = partition(items, self.shards)
+        self.total = len(items)
+        processes = {}
+        for shard, shard_items in enumerate(shards, start=1):
+            process = context.Process(target=shard_main, args=(worker, shard, shard_items, events, self.verbose, args), name="shard-{}".format(shard))
+            process.start()
+            processes[shard] = process
+        print("Started {} shard(s) for {} host(s)".format(len(processes), self.total))
+
+        remaining = set(processes)
+        last_status = time.time()
+        try:
+            while remaining:
+                try:
+                    self.handle(events.get(timeout=1), remaining)
+                except queue.Empty:
+                    for shard in list(remaining):
+                        if not processes[shard].is_alive():
+                            print("ERROR: Shard {} exited without reporting (exit code {})".format(shard, processes[shard].exitcode))
+                            logging.error("Shard {} exited without reporting (exit code {})".format(shard, processes[shard].exitcode))
+                            remaining.discard(shard)
+                if time.time() - last_status >= self.status_interval:
+                    self.print_status()
+                    last_status = time.time()
+        except KeyboardInterrupt:
+            print("\rInterrupted! - stopping {} shard(s)".format(len(remaining)))
+            for shard in remaining:
+                processes[shard].terminate()
+            raise
+        finally:
+            for process in processes.values():
+                process.join(STOP_GRACE)
+                if process.is_alive():
+                    process.kill()
+            self.print_summary()
+        return not (self.failed or self.timed_out) and len(self.finished) == self.total
+
+
+    # accepts event tuple from a shard and set of shards still running
+    def handle(self, event, remaining):
+        kind, shard = event[0], event[1]
+        if kind == "progress":
+            if shard in remaining: # a late snapshot never overwrites the final counters
+                self.snapshots[shard] = event[2]
+        elif kind == "job":
+            host, error, elapsed = event[2:]
+            done = len(self.finished) + len(self.failed) + 1
+            if error:
+                self.failed.append(host)
+                print("[{}/{}] Job failed - {} - {} (shard {})".format(done, self.total, host, error, shard))
+                logging.error("Job failed - {} - {}".format(host, error))
+            else:
+                self.finished.append(host)
+                print("[{}/{}] Job finished - {} ({:.1f}s) (shard {})".format(done, self.total, host, elapsed, shard))
+        elif kind == "done":
+            result = event[2]
+            self.timed_out.extend(result["timed_out"])
+            self.metrics.merge(result["hosts"], result["latencies"])
+            files, size = totals(result["hosts"])
+            self.snapshots[shard] = {"files": files, "bytes": size, "hosts_done": sum(1 for phases in result["hosts"].values() if "job" in phases),
+                                     "errors": sum(counters["errors"] for phases in result["hosts"].values() for counters in phases.values())}
+            remaining.discard(shard)
+        elif kind == "error":
+            print("ERROR: Shard {} failed - {}".format(shard, event[2]))
+            remaining.discard(shard)
+
+
+    def print_status(self):
+        stats = self.progress()
+        print("Shards - hosts done: {}/{} - running: {} - files: {} - errors: {} - {:.0f}s".format(
+            len(self.finished) + len(self.failed), self.total, stats["hosts_running"], stats["files"], stats["errors"], stats["elapsed"]))
+
+
+    def print_summary(self):
+        print("Jobs finished: {} - failed: {} - timed out: {} - elapsed: {:.1f}s".format(
+            len(self.finished), len(self.failed), len(self.timed_out), time.time() - self.started))
@@ -0,0 +1,270 @@
+#!/usr/bin/env python3
+
+import argparse,csv,logging,re,sys,threading,time
+from cbapi.response import *
+from collection_index import CollectionIndex
+from get_dir import translate_path,translate_source
+from hostlist import resolve_hostlist
+from job_tracker import JobTracker
+from lr_scheduler import DEFAULT_MAX_JOBS,DEFAULT_RETRIES,LiveResponseScheduler
+from lr_traversal import DEFAULT_CONCURRENCY,DirectoryWalker
+from sensor_inventory import SensorInventory
+
+
+STACK_KEYS = {
+    "full": ("path","name","size","last_write_time"),
+    "path": ("path","name"),
+    "name_size": ("name","size"),
+    "name": ("name",),
+}
+SAMPLE_HOSTS = 3 # hosts remembered per stack entry while it is still this rare
+USER_DIRS = re.compile(r"^((?:[a-z]:)?[\\/](?:users|documents and settings|home)[\\/])[^\\/]+", re.IGNORECASE)
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description="Stack directory listings across sensors using Carbon Black Response API - nothing is downloaded")
+    parser.add_argument("-hn","--hostname", help="Sensor hostname", required=False)
+    parser.add_argument("-hl","--hostlist", help="Hostlist of sensors separated by newlines. Can contain hostnames, IPs or CIDR ranges.", required=False)
+    parser.add_argument("-ld","--list_directory", help="Directory to list on every sensor [C:/Windows/System32/Tasks], or a wildcard pattern [C:/Users/*/AppData/Roaming/**/*.exe]", required=False)
+    parser.add_argument("-r","--recurse", help="Recursive flag for use with --list_directory", action="store_true", required=False)
+    parser.add_argument("-md","--max_depth", help="Maximum subdirectory depth for use with --recurse (defaults to unlimited)", type=int, required=False)
+    parser.add_argument("-sb","--stack_by", help="Fields entries are stacked on (defaults to full - path, name, size and last write time)", choices=sorted(STACK_KEYS), default="full", required=False)
+    parser.add_argument("-ku","--keep_users", help="Keep user profile directory names instead of folding C:/Users/<name> and /home/<name> together", action="store_true", required=False)
+    parser.add_argument("-mc","--max_count", help="Only report entries seen on at most this many hosts", type=int, required=False)
+    parser.add_argument("-t","--top", help="Entries to report, rarest first (defaults to 100, 0 for all)", type=int, default=100, required=False)
+    parser.add_argument("-o","--output", help="Write the ranked stacks to this CSV file instead of stdout", required=False)
+    parser.add_argument("-ix","--index", help="Record every listed file in this SQLite collection index (query it with collection_index.py)", required=False)
+    parser.add_argument("-c","--concurrency", help="List requests kept in flight per Live Response session (defaults to 4)", type=int, default=DEFAULT_CONCURRENCY, required=False)
+    parser.add_argument("-mj","--max_jobs", help="Live Response jobs running at once (defaults to 10)", type=int, default=DEFAULT_MAX_JOBS, required=False)
+    parser.add_argument("-rt","--retries", help="Retries with exponential backoff for jobs failing on session or timeout errors (defaults to 3)", type=int, default=DEFAULT_RETRIES, required=False)
+    parser.add_argument("-to","--timeout", help="Seconds to wait for jobs before reporting outstanding hosts as timed out (defaults to no timeout)", type=int, required=False)
+    parser.add_argument("-lf","--logfile", help="Destination log file (defaults to cwd/stack_files.log) (does not truncate automatically with each program execution)", required=False)
+    parser.add_argument("-ic","--inventory_cache", help="Sensor inventory snapshot path (defaults to ~/.cbtk/sensor_inventory.json)", required=False)
+    parser.add_argument("-it","--inventory_ttl", help="Seconds before the sensor inventory snapshot is refreshed (defaults to 900, 0 disables the snapshot)", type=int, default=900, required=False)
+    parser.add_argument("-ri","--refresh_inventory", help="Ignore the sensor inventory snapshot and pull a fresh sensor list", action="store_true", required=False)
+    return vars(parser.parse_args())
+
+
+class ListingStack:
+    """Incremental frequency count of directory entries across hosts - paths and names are interned, listings are never kept"""
+
+    def __init__(self, stack_by="full", fold_users=True):
+        self.fields = STACK_KEYS[stack_by]
+        self.fold_users = fold_users
+        self.lock = threading.Lock()
+        self.paths = {} # normalized directory path -> id
+        self.path_names = []
+        self.host_names = []
+        self.counts = {}
+        self.samples = {} # key -> host ids, only while the entry is seen on SAMPLE_HOSTS hosts or fewer
+        self.hosts = 0
+
+
+    # accepts hostname
+    # returns host id used in samples
+    def add_host(self, hostname):
+        with self.lock:
+            self.host_names.append(hostname)
+            self.hosts += 1
+            return len(self.host_names) - 1
+
+
+    # accepts remote directory path and os_type
+    # returns directory path with case and user profile names folded so hosts line up
+    def normalize(self, path, os_type):
+        if os_type.lower() == "windows":
+            path = path.lower()
+        if self.fold_users:
+            path = USER_DIRS.sub(lambda match: match.group(1) + "%user%", path)
+        return path
+
+
+    # accepts host id, remote directory path, listing and os_type
+    # folds every file entry of one listing into the stack - each key counts once per host
+    def add_listing(self, host_id, srcpath, listing, os_type, seen):
+        path = self.normalize(srcpath, os_type)
+        with self.lock:
+            path_id = self.paths.get(path)
+            if path_id is None and "path" in self.fields:
+                path_id = self.paths[path] = len(self.path_names)
+                self.path_names.append(sys.intern(path))
+            for entry in listing:
+                if "DIRECTORY" in entry.get("attributes", []):
+                    continue
+                name = entry["filename"].lower() if os_type.lower() == "windows" else entry["filename"]
+                values = {"path": path_id, "name": sys.intern(name), "size": entry.get("size"), "last_write_time": entry.get("last_write_time")}
+                key = tuple(values[field] for field in self.fields)
+                if key in seen:
+                    continue
+                seen.add(key)
+                count = self.counts.get(key, 0) + 1
+                self.counts[key] = count
+                if count <= SAMPLE_HOSTS:
+                    self.samples[key] = self.samples.get(key, ()) + (host_id,)
+                elif count == SAMPLE_HOSTS + 1:
+                    del self.samples[key]
+
+
+    # accepts max_count and top (0 for all)
+    # yields row dictionaries rarest first
+    def ranked(self, max_count=None, top=100):
+        with self.lock:
+            items = [(count, key) for key, count in self.counts.items() if max_count is None or count <= max_count]
+        paths = self.fields.index("path") if "path" in self.fields else None
+        items.sort(key=lambda item: (item[0], [self.path_names[value] if i == paths else str(value) for i, value in enumerate(item[1])]))
+        for count, key in items[:top or None]:
+            values = dict(zip(self.fields, key))
+            row = {
+                "count": count,
+                "hosts_pct": round(100.0 * count / max(self.hosts, 1), 2),
+                "path": self.path_names[values["path"]] if "path" in values else "",
+                "name": values.get("name", ""),
+                "size": values.get("size", ""),
+                "last_write_time": time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(values["last_write_time"])) if values.get("last_write_time") else "",
+                "sample_hosts": ";".join(self.host_names[host_id] for host_id in self.samples.get(key, ())),
+            }
+            yield row
+
+
+class StackFiles:
+    """Job listing a directory on an endpoint and folding each listing into the shared ListingStack"""
+
+    def __init__(self, srcpath, stack, hostname, os_type, recurse=False, max_depth=None, pattern=None, concurrency=DEFAULT_CONCURRENCY, index=None, sensor_id=None):
+        self.srcpath = srcpath
+        self.stack = stack
+        self.hostname = hostname
+        self.os_type = os_type
+        self.recurse = recurse
+        self.max_depth = max_depth
+        self.pattern = pattern
+        self.concurrency = concurrency
+        self.index = index
+        self.sensor_id = sensor_id
+        self.states = {}
+        self.host_id = None
+        self.seen = set() # keys this host already counted - kept across scheduler retries so a retried job does not count them twice
+
+
+    def run(self, session):
+        if self.host_id is None:
+            self.host_id = self.stack.add_host(self.hostname)
+        host_id, seen = self.host_id, self.seen
+        walker = DirectoryWalker(session, concurrency=self.concurrency, max_depth=self.max_depth if (self.recurse or self.pattern) else None)
+        if self.pattern:
+            self.states[self.srcpath] = self.pattern.start()
+        walker.walk(self.srcpath, None, self.descend, None, on_listing=lambda path, listing, ctx: self.add_listing(host_id, path, listing, seen),
+                    want_file=lambda path, entry, ctx: False)
+        print("Listed: {} - {} distinct entries so far".format(self.hostname, len(self.stack.counts)))
+
+
+    # accepts host id, listed srcpath, listing and set of keys this host already counted
+    # folds the listing into the stack and queues it for the collection index
+    def add_listing(self, host_id, srcpath, listing, seen):
+        if self.index:
+            self.index.record_listing(self.hostname, self.sensor_id, srcpath, listing)
+        self.stack.add_listing(host_id, srcpath, self.filter(srcpath, listing), self.os_type, seen)
+
+
+    # accepts listed srcpath and listing
+    # returns file entries matching the pattern (every entry without one)
+    def filter(self, srcpath, listing):
+        if not self.pattern:
+            return listing
+        states = self.states.get(srcpath)
+        return [entry for entry in listing if "DIRECTORY" not in entry["attributes"] and self.pattern.match_file(states, entry["filename"])]
+
+
+    # accepts parent srcpath, directory entry, context and depth
+    # returns True to list the subdirectory, None to prune it
+    def descend(self, srcpath, entry, context, depth):
+        if self.pattern:
+            states = self.pattern.descend(self.states[srcpath], entry["filename"])
+            if states is None:
+                return None
+            self.states["{}{}{}".format(srcpath,entry["filename"],srcpath[-1])] = states
+            return True
+        return True if self.recurse else None
+
+
+# accepts ListingStack, parsed args
+# writes ranked stacks as CSV to --output or stdout
+def write_stacks(stack, args):
+    fields = ["count","hosts_pct","path","name","size","last_write_time","sample_hosts"]
+    out = open(args["output"], mode="w", newline="") if args["output"] else sys.stdout
+    try:
+        writer = csv.DictWriter(out, fieldnames=fields)
+        writer.writeheader()
+        for row in stack.ranked(max_count=args["max_count"], top=args["top"]):
+            writer.writerow(row)
+    finally:
+        if args["output"]:
+            out.close()
+            print("Wrote stacks for {} host(s) - {} distinct entries - {}".format(stack.hosts, len(stack.counts), args["output"]))
+
+
+# accepts parsed args, sensor, ListingStack, dict of compiled patterns and CollectionIndex or None
+# returns StackFiles job for the sensor, or None if its path could not be translated
+def build_job(args, sensor, stack, patterns, index=None):
+    os_type = sensor.os_type
+    srcpath, pattern = translate_source(args["list_directory"], os_type, patterns)
+    if not srcpath:
+        logging.error("pure_src_path returned None for os_type {} - {}".format(os_type, sensor.computer_name))
+        return None
+    return StackFiles(srcpath, stack, sensor.computer_name, os_type, recurse=args["recurse"], max_depth=args["max_depth"],
+                      pattern=pattern, concurrency=args["concurrency"], index=index, sensor_id=sensor.id)
+
+
+def main():
+    args = get_args()
+    cb = CbResponseAPI()
+
+    if not args["logfile"]:
+        logging.basicConfig(filename="stack_files.log",level=logging.ERROR)
+    else:
+        logpath = translate_path(args["logfile"],os_type=sys.platform)
+        logging.basicConfig(filename=logpath or "stack_files.log",level=logging.ERROR)
+
+    if not (args["list_directory"] and (args["hostname"] or args["hostlist"])):
+        print("--hostname or --hostlist required with --list_directory")
+        sys.exit(0)
+
+    inventory = SensorInventory(cb, cache_path=args["inventory_cache"], ttl=args["inventory_ttl"]).load(refresh=args["refresh_inventory"])
+    scheduler = LiveResponseScheduler(cb, max_jobs=args["max_jobs"], retries=args["retries"])
+    tracker = JobTracker(timeout=args["timeout"], status=scheduler.status)
+    stack = ListingStack(stack_by=args["stack_by"], fold_users=not args["keep_users"])
+    patterns = {}
+    index = CollectionIndex(args["index"]).open() if args["index"] else None
+
+    if args["hostname"]:
+        sensor = inventory.lookup_hostname(args["hostname"])
+        targets = [("hostname:{}".format(args["hostname"]), sensor)]
+    else:
+        targets = resolve_hostlist(args["hostlist"], inventory)
+
+    for query, sensor in targets:
+        if not sensor:
+            print("Sensor query did not return any results - {}".format(query))
+            logging.error("Sensor query did not return any results - {}".format(query))
+            continue
+        if sensor.status.lower() != "online":
+            print("Sensor is offline - {} derived from {}".format(sensor.computer_name, query))
+            logging.error("Sensor is offline - {} derived from {}".format(sensor.computer_name, query))
+            continue
+        job = build_job(args, sensor, stack, patterns, index)
+        if job:
+            tracker.add(sensor.computer_name, scheduler.submit(sensor.computer_name, job.run, sensor.id))
+
+    try:
+        tracker.wait()
+    finally:
+        if index:
+            index.close()
+        write_stacks(stack, args)
+
+
+if __name__ == "__main__":
+    try:
+        main()
+    except KeyboardInterrupt:
+        print("\rInterrupted!")
+        sys.exit(0)
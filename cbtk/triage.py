@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+
+import argparse,logging,pathlib,sys
+from cbapi.response import *
+from artifact_plan import OS_TYPES,read_plan_file
+from get_dir import GetDirectory,translate_path,translate_source
+from host_archive import member_name
+from hostlist import resolve_hostlist
+from job_tracker import JobTracker
+from lr_batch import DEFAULT_COMMAND_TIMEOUT,RESULTS_NAME,CollectOutput,GetFile,JobOperation,ListDirectory,RunCommand,SessionBatch
+from lr_scheduler import DEFAULT_MAX_JOBS,DEFAULT_RETRIES,LiveResponseScheduler,host_priority,parse_priority_hosts
+from lr_traversal import DEFAULT_CONCURRENCY
+from lr_transfer import DEFAULT_CHUNK_SIZE
+from sensor_inventory import SensorInventory
+
+
+# Batch files list one operation per line under an os section, run in order in a single Live Response session:
+#
+#   [windows]
+#   run ipconfig /all
+#   list C:/Windows/Temp/
+#   get C:/Windows/Prefetch/*.pf
+#   collect C:/Windows/Temp/sam.hive reg save HKLM\SAM C:\Windows\Temp\sam.hive /y
+#
+#   [linux]
+#   run ps auxww
+#   get /var/log/auth.log
+#
+# run executes a command and keeps its output, list keeps a directory listing, get downloads a file, a directory
+# (ending in a separator) or wildcard pattern like get_dir.py, and collect runs a command that writes the given
+# remote file, then pulls and deletes it. Results are appended to dstpath/<host>/batch_results.jsonl as each operation finishes.
+
+OPERATIONS = ("run","list","get","collect")
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description="Run an ordered batch of commands, listings and downloads on sensors in one Live Response session per host")
+    parser.add_argument("-hn","--hostname", help="Sensor hostname", required=False)
+    parser.add_argument("-hl","--hostlist", help="Hostlist of sensors separated by newlines. Can contain hostnames, IPs or CIDR ranges.", required=False)
+    parser.add_argument("-bf","--batch_file", help="Batch file of operations per os ([windows]/[linux]/[mac] sections)", required=False)
+    parser.add_argument("-op","--operation", help="Operation run on every os, after any --batch_file operations [\"run netstat -ano\"] (can be repeated)", action="append", default=[], required=False)
+    parser.add_argument("-dst","--dstpath", help="Destination directory path for results and retrieved files", required=False)
+    parser.add_argument("-r","--recurse", help="Recurse into subdirectories for get operations on a directory", action="store_true", required=False)
+    parser.add_argument("-md","--max_depth", help="Maximum subdirectory depth for use with --recurse (defaults to unlimited)", type=int, required=False)
+    parser.add_argument("-ct","--command_timeout", help="Seconds to wait for each run/collect command (defaults to 120)", type=int, default=DEFAULT_COMMAND_TIMEOUT, required=False)
+    parser.add_argument("-c","--concurrency", help="List/get requests kept in flight per Live Response session (defaults to 4)", type=int, default=DEFAULT_CONCURRENCY, required=False)
+    parser.add_argument("-cs","--chunk_size", help="Bytes buffered in memory per file transfer (defaults to 1048576)", type=int, default=DEFAULT_CHUNK_SIZE, required=False)
+    parser.add_argument("-mj","--max_jobs", help="Live Response jobs running at once (defaults to 10)", type=int, default=DEFAULT_MAX_JOBS, required=False)
+    parser.add_argument("-rt","--retries", help="Retries with exponential backoff for jobs failing on session or timeout errors (defaults to 3)", type=int, default=DEFAULT_RETRIES, required=False)
+    parser.add_argument("-ph","--priority_hosts", help="Comma separated hostnames dispatched ahead of the rest of the hostlist", required=False)
+    parser.add_argument("-to","--timeout", help="Seconds to wait for jobs before reporting outstanding hosts as timed out (defaults to no timeout)", type=int, required=False)
+    parser.add_argument("-v","--verbose", help="Print every file as it is listed and downloaded", action="store_true", required=False)
+    parser.add_argument("-lf","--logfile", help="Destination log file (defaults to cwd/triage.log) (does not truncate automatically with each program execution)", required=False)
+    parser.add_argument("-ic","--inventory_cache", help="Sensor inventory snapshot path (defaults to ~/.cbtk/sensor_inventory.json)", required=False)
+    parser.add_argument("-it","--inventory_ttl", help="Seconds before the sensor inventory snapshot is refreshed (defaults to 900, 0 disables the snapshot)", type=int, default=900, required=False)
+    parser.add_argument("-ri","--refresh_inventory", help="Ignore the sensor inventory snapshot and pull a fresh sensor list", action="store_true", required=False)
+    return vars(parser.parse_args())
+
+
+# accepts --batch_file path and list of --operation lines
+# returns dict of os_type -> list of (operation, argument) - exits on malformed lines
+def read_batch(path, extra):
+    lines = read_plan_file(path) if path else dict((os_type, []) for os_type in OS_TYPES)
+    batch = {}
+    for os_type in OS_TYPES:
+        for line in lines[os_type] + extra:
+            operation, _, argument = line.strip().partition(" ")
+            operation = operation.lower()
+            if operation not in OPERATIONS or not argument.strip():
+                print("ERROR: Malformed batch operation [{}] {} - expected one of {} followed by its argument".format(os_type, line, "/".join(OPERATIONS)))
+                sys.exit(1)
+            if operation == "collect" and len(argument.split(None, 1)) < 2:
+                print("ERROR: collect needs a remote file and the command that writes it - {}".format(line))
+                sys.exit(1)
+            batch.setdefault(os_type, []).append((operation, argument.strip()))
+    return batch
+
+
+# accepts raw remote file path and os_type
+# returns remote file path with the sensor's separators
+def translate_file(path, os_type):
+    if os_type.lower() == "windows":
+        return str(pathlib.PureWindowsPath(path))
+    return str(pathlib.PurePosixPath(path))
+
+
+# accepts raw get argument, sensor os_type and dict of compiled patterns per get argument
+# returns True if the argument names a single file - no wildcard and no trailing separator
+def is_file(path, os_type, patterns):
+    _, pattern = translate_source(path, os_type, patterns.setdefault(path, {}))
+    return pattern is None and not path.endswith(("/","\\"))
+
+
+# accepts parsed args, sensor, list of (operation, argument) and dict of compiled patterns per get argument
+# returns SessionBatch for the sensor, or None if its paths could not be translated
+def build_batch(args, sensor, operations, patterns):
+    os_type = sensor.os_type
+    host_dir = translate_path(args["dstpath"], os_type=sys.platform, new_dir=sensor.computer_name)
+    if not host_dir:
+        logging.error("pure_dst_path returned None for os_type {} - {}".format(os_type, sensor.computer_name))
+        return None
+
+    batch = []
+    for operation, argument in operations:
+        if operation == "run":
+            batch.append(RunCommand(argument, timeout=args["command_timeout"]))
+        elif operation == "list":
+            srcpath = translate_path(argument, os_type=os_type)
+            if not srcpath:
+                return None
+            batch.append(ListDirectory(srcpath))
+        elif operation == "get" and is_file(argument, os_type, patterns):
+            remote = translate_file(argument, os_type)
+            dstfile = pathlib.Path(host_dir).joinpath(*member_name(remote).split("/"))
+            batch.append(GetFile(remote, dstfile, chunk_size=args["chunk_size"]))
+        elif operation == "get":
+            srcpath, pattern = translate_source(argument, os_type, patterns.setdefault(argument, {}))
+            if not srcpath:
+                return None
+            dstpath = str(pathlib.Path(host_dir).joinpath(*member_name(srcpath).split("/")))
+            pathlib.Path(dstpath).mkdir(parents=True, exist_ok=True)
+            job = GetDirectory(srcpath, dstpath, recurse=args["recurse"], chunk_size=args["chunk_size"], concurrency=args["concurrency"],
+                               max_depth=args["max_depth"], host=sensor.computer_name, pattern=pattern, os_type=os_type, verbose=args["verbose"])
+            batch.append(JobOperation("get", argument, job))
+        elif operation == "collect":
+            remote, command = argument.split(None, 1)
+            remote = translate_file(remote, os_type)
+            dstfile = pathlib.Path(host_dir).joinpath(*member_name(remote).split("/"))
+            batch.append(CollectOutput(command, remote, dstfile, timeout=args["command_timeout"], chunk_size=args["chunk_size"]))
+    return SessionBatch(batch, host=sensor.computer_name, results_path=pathlib.Path(host_dir).joinpath(RESULTS_NAME))
+
+
+def main():
+    args = get_args()
+    cb = CbResponseAPI()
+
+    if not args["logfile"]:
+        logging.basicConfig(filename="triage.log",level=logging.ERROR)
+    else:
+        logpath = translate_path(args["logfile"],os_type=sys.platform)
+        logging.basicConfig(filename=logpath or "triage.log",level=logging.ERROR)
+
+    if not ((args["batch_file"] or args["operation"]) and args["dstpath"] and (args["hostname"] or args["hostlist"])):
+        print("--hostname or --hostlist, and --dstpath required with --batch_file or --operation")
+        sys.exit(0)
+
+    try:
+        batches = read_batch(args["batch_file"], args["operation"])
+    except (OSError, ValueError) as e:
+        print("ERROR: Could not read batch file - {}".format(e))
+        sys.exit(1)
+
+    inventory = SensorInventory(cb, cache_path=args["inventory_cache"], ttl=args["inventory_ttl"]).load(refresh=args["refresh_inventory"])
+    scheduler = LiveResponseScheduler(cb, max_jobs=args["max_jobs"], retries=args["retries"])
+    priority_hosts = parse_priority_hosts(args["priority_hosts"])
+    tracker = JobTracker(timeout=args["timeout"], status=scheduler.status)
+    patterns = {}
+
+    if args["hostname"]:
+        targets = [("hostname:{}".format(args["hostname"]), inventory.lookup_hostname(args["hostname"]))]
+    else:
+        targets = resolve_hostlist(args["hostlist"], inventory)
+
+    for query, sensor in targets:
+        if not sensor:
+            print("Sensor query did not return any results - {}".format(query))
+            logging.error("Sensor query did not return any results - {}".format(query))
+            continue
+        if sensor.status.lower() != "online":
+            print("Sensor is offline - {} derived from {}".format(sensor.computer_name, query))
+            logging.error("Sensor is offline - {} derived from {}".format(sensor.computer_name, query))
+            continue
+        operations = batches.get(sensor.os_type.lower())
+        if not operations:
+            print("Batch has no operations for os_type {} - {}".format(sensor.os_type, sensor.computer_name))
+            continue
+        batch = build_batch(args, sensor, operations, patterns)
+        if batch:
+            print("Running {} operation(s) in one session - {}".format(len(operations), sensor.computer_name))
+            tracker.add(sensor.computer_name, scheduler.submit(sensor.computer_name, batch.run, sensor.id,
+                                                              priority=host_priority(sensor, priority_hosts)))
+
+    tracker.wait()
+
+
+if __name__ == "__main__":
+    try:
+        main()
+    except KeyboardInterrupt:
+        print("\rInterrupted!")
+        sys.exit(0)
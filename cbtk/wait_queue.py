@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+
+import hashlib,json,logging,os,pathlib,time
+
+
+DEFAULT_DEADLINE = 86400 # seconds to keep waiting for offline sensors
+DEFAULT_POLL_INTERVAL = 300 # seconds between batched inventory refreshes
+
+
+# accepts parsed args dictionary and the keys that define the job
+# returns short hash of those arguments - a queue only resumes for the same job
+def job_fingerprint(args, keys):
+    job = dict((key, args.get(key)) for key in keys)
+    return hashlib.sha256(json.dumps(job, sort_keys=True, default=str).encode("utf-8")).hexdigest()[:16]
+
+
+# accepts script name and job fingerprint
+# returns default persistent queue path for that script and job
+def default_queue_path(name, fingerprint=None):
+    if fingerprint:
+        return pathlib.Path.home().joinpath(".cbtk","{}_{}_watch_queue.json".format(name, fingerprint))
+    return pathlib.Path.home().joinpath(".cbtk","{}_watch_queue.json".format(name))
+
+
+class OfflineWaitQueue:
+    """Persistent queue of offline sensors, dispatched as soon as a batched inventory refresh shows them online"""
+
+    def __init__(self, inventory, path, deadline=DEFAULT_DEADLINE, poll_interval=DEFAULT_POLL_INTERVAL, fingerprint=None):
+        self.inventory = inventory
+        self.path = pathlib.Path(path)
+        self.fingerprint = fingerprint
+        self.poll_interval = poll_interval
+        self.deadline = time.time() + deadline
+        self.hosts = {}
+
+
+    # reads queue left by a previous run - its deadline and pending hosts carry over
+    # raises ValueError if the queue was left by a run with different job arguments
+    def load(self):
+        try:
+            with open(str(self.path), mode="r") as f:
+                saved = json.load(f)
+        except (OSError, ValueError):
+            return self
+        if self.fingerprint and saved.get("fingerprint") not in (None, self.fingerprint):
+            raise ValueError("watch queue {} was left by a run with different job arguments - finish that run or pass another --watch_queue".format(self.path))
+        self.deadline = saved.get("deadline", self.deadline)
+        for sensor_id, entry in saved.get("hosts", {}).items():
+            self.hosts[int(sensor_id)] = entry
+        if self.hosts:
+            print("Resuming watch queue {} - {} host(s) pending".format(self.path, len(self.hosts)))
+        return self
+
+
+    # writes queue atomically - removes the file once nothing is pending
+    def save(self):
+        try:
+            if not self.hosts:
+                if self.path.exists():
+                    self.path.unlink()
+                return
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = self.path.with_name(self.path.name + ".tmp")
+            with open(str(tmp_path), mode="w") as f:
+                json.dump({"fingerprint": self.fingerprint, "deadline": self.deadline, "hosts": self.hosts}, f)
+            os.replace(str(tmp_path), str(self.path))
+        except OSError as e:
+            print("ERROR: Could not write watch queue {} - {}".format(self.path, e))
+            logging.error("Could not write watch queue {} - {}".format(self.path, e))
+
+
+    # accepts offline sensor and the hostlist query it was derived from
+    def add(self, sensor, query):
+        if sensor.id not in self.hosts:
+            print("Sensor is offline - queued {} derived from {} until it checks in".format(sensor.computer_name, query))
+            self.hosts[sensor.id] = {"computer_name": sensor.computer_name, "query": query, "added": int(time.time())}
+            self.save()
+
+
+    # accepts sensor dispatched outside the queue (e.g. online on this run's hostlist pass)
+    def discard(self, sensor):
+        if self.hosts.pop(sensor.id, None):
+            self.save()
+
+
+    # accepts dispatch(sensor, query) callback and a wait(seconds) callback used between refreshes
+    # refreshes the whole inventory in one query per poll interval and dispatches every pending host that is online
+    # returns list of computer names still offline at the deadline
+    def watch(self, dispatch, wait=time.sleep):
+        while self.hosts and time.time() < self.deadline:
+            print("Waiting on {} offline host(s) - next check in {}s - deadline {}".format(
+                len(self.hosts), self.poll_interval, time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(self.deadline))))
+            next_check = min(time.time() + self.poll_interval, self.deadline)
+            while time.time() < next_check:
+                wait(next_check - time.time())
+            self.inventory.load(refresh=True)
+            for sensor_id, entry in list(self.hosts.items()):
+                sensor = self.inventory.sensors.get(sensor_id)
+                if sensor and (sensor.status or "").lower() == "online":
+                    print("Sensor checked in - {} derived from {}".format(sensor.computer_name, entry["query"]))
+                    del self.hosts[sensor_id]
+                    dispatch(sensor, entry["query"])
+            self.save()
+
+        missed = sorted(entry["computer_name"] for entry in self.hosts.values())
+        for name in missed:
+            print("Sensor never came online before the deadline - {}".format(name))
+            logging.error("Sensor never came online before the deadline - {}".format(name))
+        self.hosts = {}
+        self.save()
+        return missed
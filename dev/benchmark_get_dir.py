@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+
+import argparse,contextlib,io,json,logging,os,pathlib,shutil,sys,tempfile,time
+from cbapi.response import CbResponseAPI
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parents[1].joinpath("cbtk")))
+from collection_manifest import MANIFEST_NAME
+from get_dir import GetDirectory
+from host_archive import ARCHIVE_FORMATS,INDEX_SUFFIX
+from job_tracker import JobTracker
+from lr_scheduler import DEFAULT_MAX_JOBS,LiveResponseScheduler
+from lr_transfer import DEFAULT_CHUNK_SIZE,format_size
+from lr_traversal import DEFAULT_CONCURRENCY
+from mock_cb_server import MOCK_ROOT,TREE_SHAPES,MockServer,MockState
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description="Measure GetDirectory throughput against the local mock CB Response server")
+    parser.add_argument("-hc","--host_counts", help="Comma separated sensor counts to run (defaults to 1,8)", default="1,8", required=False)
+    parser.add_argument("-ts","--tree_shapes", help="Comma separated tree shapes - {} - or depth:width:files (defaults to flat,wide)".format("/".join(sorted(TREE_SHAPES))), default="flat,wide", required=False)
+    parser.add_argument("-fs","--file_sizes", help="Comma separated bytes per file (defaults to 4096,262144)", default="4096,262144", required=False)
+    parser.add_argument("-os","--os_name", help="Sensor os (defaults to windows)", choices=sorted(MOCK_ROOT), default="windows", required=False)
+    parser.add_argument("-l","--latency", help="Seconds each Live Response command takes (defaults to 0.05)", type=float, default=0.05, required=False)
+    parser.add_argument("-sl","--session_latency", help="Seconds before a new session turns active (defaults to 0.5)", type=float, default=0.5, required=False)
+    parser.add_argument("-bw","--bandwidth", help="Bytes/sec per file download (defaults to unlimited)", type=int, default=0, required=False)
+    parser.add_argument("-er","--error_rate", help="Fraction of Live Response commands that fail (defaults to 0)", type=float, default=0.0, required=False)
+    parser.add_argument("-c","--concurrency", help="List/get requests kept in flight per session (defaults to 4)", type=int, default=DEFAULT_CONCURRENCY, required=False)
+    parser.add_argument("-mj","--max_jobs", help="Live Response jobs running at once (defaults to 10)", type=int, default=DEFAULT_MAX_JOBS, required=False)
+    parser.add_argument("-cs","--chunk_size", help="Bytes buffered in memory per file transfer (defaults to 1048576)", type=int, default=DEFAULT_CHUNK_SIZE, required=False)
+    parser.add_argument("-ea","--endpoint_archive", help="Benchmark --endpoint_archive collection instead of per-file", action="store_true", required=False)
+    parser.add_argument("-ar","--archive", help="Benchmark --archive output in this format", choices=ARCHIVE_FORMATS, required=False)
+    parser.add_argument("-rp","--repeat", help="Runs per scenario - the fastest is reported (defaults to 1)", type=int, default=1, required=False)
+    parser.add_argument("-o","--output", help="Append results to this JSON lines file", required=False)
+    parser.add_argument("-b","--baseline", help="JSON lines file from an earlier --output run to compare against", required=False)
+    parser.add_argument("-v","--verbose", help="Show get_dir output while benchmarking", action="store_true", required=False)
+    return vars(parser.parse_args())
+
+
+# accepts comma separated string and value parser
+# returns list of parsed values
+def parse_list(value, parse=str):
+    return [parse(item.strip()) for item in value.split(",") if item.strip()]
+
+
+# accepts scenario dictionary
+# returns key used to match a scenario against the baseline
+def scenario_key(scenario):
+    return (scenario["hosts"], scenario["shape"], scenario["file_size"], scenario["mode"], scenario.get("archive"))
+
+
+# accepts local collection root
+# returns number of files collected - loose files plus members indexed in --archive output
+def count_collected(dstpath):
+    collected = 0
+    for root, dirs, files in os.walk(dstpath):
+        for name in files:
+            if name.endswith(INDEX_SUFFIX):
+                with open(os.path.join(root, name), mode="r") as f:
+                    collected += sum(1 for _ in f)
+            elif name != MANIFEST_NAME and not name.endswith(tuple("." + fmt for fmt in ARCHIVE_FORMATS)):
+                collected += 1
+    return collected
+
+
+# accepts parsed args, mock server, host count, tree shape and file size
+# runs GetDirectory on every mock sensor through the scheduler exactly as get_dir.py does
+# returns scenario result dictionary
+def run_scenario(args, server, hosts, shape, file_size):
+    server.state.configure(hosts, os_name=args["os_name"], shape=shape.replace(":", ","), file_size=file_size)
+    cb = CbResponseAPI(url=server.url, token="mock", ssl_verify=False)
+    dstpath = tempfile.mkdtemp(prefix="cbtk_bench_")
+    output = None if args["verbose"] else io.StringIO()
+    scheduler = LiveResponseScheduler(cb, max_jobs=args["max_jobs"], retries=0)
+    try:
+        tracker = JobTracker(status_interval=3600)
+        server.state.reset()
+        started = time.time()
+        futures = []
+        with (contextlib.redirect_stdout(output) if output else contextlib.ExitStack()):
+            for sensor in server.state.sensors.values():
+                job = GetDirectory(MOCK_ROOT[args["os_name"]], os.path.join(dstpath, sensor.hostname), recurse=True,
+                                   chunk_size=args["chunk_size"], concurrency=args["concurrency"], resume=False,
+                                   host=sensor.hostname, archive_format=args["archive"], os_type=args["os_name"],
+                                   endpoint_archive=args["endpoint_archive"])
+                futures.append(tracker.add(sensor.hostname, scheduler.submit(sensor.hostname, job.run, sensor.id)))
+            ok = tracker.wait() and all(future.result() for future in futures) # GetDirectory returns False if the root could not be listed
+        elapsed = time.time() - started
+        collected = count_collected(dstpath)
+    finally:
+        scheduler.stop()
+        shutil.rmtree(dstpath, ignore_errors=True)
+
+    stats = server.state.snapshot()
+    first_bytes = sorted(host["first_byte"] - started for host in stats["hosts"].values() if host["first_byte"])
+    totals = stats["totals"]
+    return {
+        "hosts": hosts,
+        "shape": shape,
+        "file_size": file_size,
+        "mode": "endpoint_archive" if args["endpoint_archive"] else "per_file",
+        "archive": args["archive"],
+        "latency": args["latency"],
+        "concurrency": args["concurrency"],
+        "elapsed": round(elapsed, 3),
+        "files": collected,
+        "downloads": totals["files"],
+        "bytes": totals["bytes"],
+        "files_per_sec": round(collected / elapsed, 1),
+        "mb_per_sec": round(totals["bytes"] / elapsed / (1024 * 1024), 2),
+        "ttfb_mean": round(sum(first_bytes) / len(first_bytes), 3) if first_bytes else None,
+        "ttfb_max": round(first_bytes[-1], 3) if first_bytes else None,
+        "listings": totals["listings"],
+        "commands": totals["commands"],
+        "errors": totals["errors"],
+        "jobs_ok": ok,
+        "run_at": int(started),
+    }
+
+
+# accepts path of a JSON lines results file
+# returns dict of scenario key -> latest result
+def read_results(path):
+    results = {}
+    try:
+        with open(path, mode="r") as f:
+            for line in f:
+                try:
+                    result = json.loads(line)
+                except ValueError:
+                    continue
+                results[scenario_key(result)] = result
+    except OSError as e:
+        print("ERROR: Could not read baseline {} - {}".format(path, e))
+    return results
+
+
+# accepts result and baseline result or None
+# returns formatted table row - scenarios where a job failed are flagged instead of compared
+def format_row(result, baseline=None):
+    row = "{:>5} {:>10} {:>8} {:>9.2f}s {:>7} {:>9} {:>10.1f} {:>8.2f} {:>8} {:>6}".format(
+        result["hosts"], result["shape"], format_size(result["file_size"]), result["elapsed"], result["files"],
+        format_size(result["bytes"]), result["files_per_sec"], result["mb_per_sec"],
+        "{:.3f}s".format(result["ttfb_mean"]) if result["ttfb_mean"] is not None else "-", result["errors"])
+    if not result["jobs_ok"]:
+        row += "   FAILED - not every host was collected, see benchmark_get_dir.log"
+    elif baseline and baseline.get("files_per_sec"):
+        row += "   {:+.1f}% files/sec".format(100.0 * (result["files_per_sec"] - baseline["files_per_sec"]) / baseline["files_per_sec"])
+    return row
+
+
+def main():
+    args = get_args()
+    logging.basicConfig(filename="benchmark_get_dir.log",level=logging.ERROR)
+    baseline = read_results(args["baseline"]) if args["baseline"] else {}
+    state = MockState(hosts=1, os_name=args["os_name"], latency=args["latency"], session_latency=args["session_latency"],
+                      bandwidth=args["bandwidth"], error_rate=args["error_rate"])
+    server = MockServer(("127.0.0.1", 0), state).start()
+    print("Mock CB Response server on {} - latency {}s - bandwidth {} - error rate {}".format(
+        server.url, args["latency"], "{}/s".format(format_size(args["bandwidth"])) if args["bandwidth"] else "unlimited", args["error_rate"]))
+    print("{:>5} {:>10} {:>8} {:>10} {:>7} {:>9} {:>10} {:>8} {:>8} {:>6}".format(
+        "hosts", "shape", "size", "elapsed", "files", "bytes", "files/sec", "MB/sec", "ttfb", "errors"))
+
+    try:
+        for hosts in parse_list(args["host_counts"], int):
+            for shape in parse_list(args["tree_shapes"]):
+                for file_size in parse_list(args["file_sizes"], int):
+                    runs = [run_scenario(args, server, hosts, shape, file_size) for _ in range(max(1, args["repeat"]))]
+                    result = min(runs, key=lambda run: (not run["jobs_ok"], run["elapsed"])) # fastest successful run
+                    print(format_row(result, baseline.get(scenario_key(result))))
+                    if args["output"]:
+                        with open(args["output"], mode="a") as f:
+                            f.write(json.dumps(result) + "\n")
+    except KeyboardInterrupt:
+        print("\rInterrupted!")
+    finally:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -3,6 +3,10 @@
 import argparse,configparser,glob,json,os,pathlib,sys
 from cbapi.live_response_api import LiveResponseError
 from cbapi.response import *
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parents[1].joinpath("cbtk")))
+from listing_cache import DEFAULT_TTL,ListingCache,child_directories
+from lr_transfer import DEFAULT_CHUNK_SIZE,format_size,print_progress,stream_file
+from sensor_inventory import SensorInventory
 
 
 def get_args():
@@ -17,7 +21,15 @@ def get_args():
     parser.add_argument("-gd","--get_directory", help="Pull down every file in directory (backslashes in filepath must be escaped, and directories must end in a backslash) [C:\\\Windows\\\]", required=False)
     parser.add_argument("-dst","--dstpath", help="Destination directory path for storing retrieved files", required=False)
     parser.add_argument("-r","--recurse", help="Recursive flag for use with --list_direcrory and --get_directory", action="store_true", required=False)
+    parser.add_argument("-cs","--chunk_size", help="Bytes buffered in memory per file transfer (defaults to 1048576)", type=int, default=DEFAULT_CHUNK_SIZE, required=False)
     parser.add_argument("-v","--verbose", help="Verbose output", action="store_true", required=False)
+    parser.add_argument("-lc","--listing_cache", help="Directory listing cache path for --list_directory (defaults to ~/.cbtk/listing_cache.db)", required=False)
+    parser.add_argument("-lt","--listing_ttl", help="Seconds a cached directory listing is reused (defaults to 300, 0 disables the cache)", type=int, default=DEFAULT_TTL, required=False)
+    parser.add_argument("-rl","--refresh_listing", help="List the directory again even if a cached listing is fresh", action="store_true", required=False)
+    parser.add_argument("-pf","--prefetch", help="Also list subdirectories into the cache after printing, so browsing into them is instant", action="store_true", required=False)
+    parser.add_argument("-ic","--inventory_cache", help="Sensor inventory snapshot path (defaults to ~/.cbtk/sensor_inventory.json)", required=False)
+    parser.add_argument("-it","--inventory_ttl", help="Seconds before the sensor inventory snapshot is refreshed (defaults to 900, 0 disables the snapshot)", type=int, default=900, required=False)
+    parser.add_argument("-ri","--refresh_inventory", help="Ignore the sensor inventory snapshot and pull a fresh sensor list", action="store_true", required=False)
     return vars(parser.parse_args())
 
 
@@ -34,7 +46,7 @@ def dict_list_to_kv_dict(dict_array,k,v):
 # srcpath and dstpath should be generated using translate_path() ...
 # because if paths dont have trailing slashes this will break
 # downloads all files in remote srcpath to local dstpath
-def get_directory_contents(session,srcpath,dstpath,recurse=False):
+def get_directory_contents(session,srcpath,dstpath,recurse=False,chunk_size=DEFAULT_CHUNK_SIZE):
     if not os.path.isdir(dstpath):
         print("ERROR: --dstpath does not exist! - building {} now...".format(dstpath))
         d = pathlib.Path(dstpath)
@@ -59,7 +71,7 @@ def get_directory_contents(session,srcpath,dstpath,recurse=False):
                     #except FileExistsError as e:
                     #    print("ERROR: {}".format(e))
                     #    continue
-                    get_directory_contents(session,"{}{}{}".format(srcpath,f["filename"],srcpath[-1]),str(p),recurse=recurse)
+                    get_directory_contents(session,"{}{}{}".format(srcpath,f["filename"],srcpath[-1]),str(p),recurse=recurse,chunk_size=chunk_size)
                     continue
             else:
                 print("GET FAILED - Directory: {} - Add with trailing backslash to get contents".format(f["filename"]))
@@ -68,8 +80,9 @@ def get_directory_contents(session,srcpath,dstpath,recurse=False):
             print("Getting: {}".format(f["filename"]))
             #with open("{}/{}".format(dstpath,f["filename"]), "wb") as dstfile:
             pure_dst_file = pathlib.Path(dstpath).joinpath(f["filename"])
-            with open(str(pure_dst_file), mode="wb") as dstfile:
-                dstfile.write(session.get_file(r"{}{}".format(srcpath,f["filename"])))
+            written = stream_file(session, r"{}{}".format(srcpath,f["filename"]), pure_dst_file,
+                                  chunk_size=chunk_size, progress=print_progress(f["filename"]))
+            print("Got: {} - {}".format(f["filename"], format_size(written)))
 
 
 # accepts live session and srcpath
@@ -140,18 +153,40 @@ def translate_path(path,os_type="windows",new_dir=None):
 def main():
     args = get_args()
     cb = CbResponseAPI()
+    inventory = SensorInventory(cb, cache_path=args["inventory_cache"], ttl=args["inventory_ttl"])
+    if args["hostname"] or args["hostlist"]:
+        inventory.load(refresh=args["refresh_inventory"])
 
 # get_directory_listing() AND print_directory_listing()
     if args["list_directory"] and args["hostname"]:
-        sensor = cb.select(Sensor).where("hostname:{}".format(args["hostname"])).first()
+        sensor = inventory.lookup_hostname(args["hostname"])
         os_type=sensor.os_environment_display_string.split(" ")[0] # returns mac, linux, or windows
         pure_path = translate_path(args["list_directory"],os_type=os_type)
         print_banner("Listing Directory Contents - {}: {}".format(sensor.computer_name,pure_path))
 
-        with sensor.lr_session() as session:
-            directory_listing = get_directory_listing(session,pure_path)
-            if directory_listing:
+        cache = ListingCache(args["listing_cache"], ttl=args["listing_ttl"]).open() if args["listing_ttl"] > 0 else None
+        try:
+            directory_listing = cache.get(sensor.id, pure_path, os_type) if cache and not args["refresh_listing"] else None
+            if directory_listing is not None:
+                # cached - a session is only opened if there are subdirectories left to prefetch
                 print_directory_listing(directory_listing, verbose=args["verbose"])
+                pending = cache.stale(sensor.id, child_directories(pure_path, directory_listing), os_type) if args["prefetch"] else []
+                if pending:
+                    with cb.live_response.request_session(sensor.id) as session:
+                        print("Prefetched {} subdirectory listing(s)".format(cache.prefetch(session, sensor.id, pending, os_type)))
+            else:
+                with cb.live_response.request_session(sensor.id) as session:
+                    directory_listing = get_directory_listing(session,pure_path)
+                    if directory_listing:
+                        print_directory_listing(directory_listing, verbose=args["verbose"])
+                        if cache:
+                            cache.put(sensor.id, pure_path, os_type, directory_listing)
+                            pending = cache.stale(sensor.id, child_directories(pure_path, directory_listing), os_type) if args["prefetch"] else []
+                            if pending:
+                                print("Prefetched {} subdirectory listing(s)".format(cache.prefetch(session, sensor.id, pending, os_type)))
+        finally:
+            if cache:
+                cache.close()
 
     elif args["list_directory"] and not args["hostname"]:
         print("--hostname required with --list_directory")
@@ -160,24 +195,24 @@ def main():
 
 # get_directory()
     if args["get_directory"] and args["dstpath"] and args["hostname"]:
-        sensor = cb.select(Sensor).where("hostname:{}".format(args["hostname"])).first()
+        sensor = inventory.lookup_hostname(args["hostname"])
         os_type=sensor.os_environment_display_string.split(" ")[0] # returns mac, linux, or windows
         pure_src_path = translate_path(args["get_directory"],os_type=os_type)
         pure_dst_path = translate_path(args["dstpath"],os_type=sys.platform)
         print_banner("Downloading Directory Contents - {}: {}".format(sensor.computer_name,pure_src_path))
 
-        with sensor.lr_session() as session:
+        with cb.live_response.request_session(sensor.id) as session:
             if args["recurse"]:
-                get_directory_contents(session,pure_src_path,pure_dst_path,recurse=True)
+                get_directory_contents(session,pure_src_path,pure_dst_path,recurse=True,chunk_size=args["chunk_size"])
             else:
-                get_directory_contents(session,pure_src_path,pure_dst_path)
+                get_directory_contents(session,pure_src_path,pure_dst_path,chunk_size=args["chunk_size"])
 
     if args["get_directory"] and args["dstpath"] and args["hostlist"]:
         p = pathlib.Path.cwd().joinpath(args["hostlist"])
         with open(str(p), mode="r") as f:
             hostlist = f.readlines()
             for host in hostlist:
-                sensor = cb.select(Sensor).where("hostname:{}".format(host.strip("\n\r"))).first()
+                sensor = inventory.lookup_hostname(host.strip("\n\r"))
                 os_type=sensor.os_environment_display_string.split(" ")[0] # returns mac, linux, or windows
                 pure_src_path = translate_path(args["get_directory"],os_type=os_type)
                 pure_dst_path = translate_path(args["dstpath"],os_type=sys.platform,new_dir=sensor.computer_name)
@@ -208,8 +243,8 @@ def main():
 
 # print sensor details
     if args["details"] and args["hostname"]:
-        sensor = cb.select(Sensor).where("hostname:{}".format(args["hostname"])).first()
-        print(sensor)
+        sensor = inventory.lookup_hostname(args["hostname"])
+        print_dict(sensor._info)
 
     elif args["details"] and not args["hostname"]:
         print("--hostname required with --details")
@@ -0,0 +1,781 @@
+#!/usr/bin/env python3
+
+import argparse,hashlib,http.server,io,itertools,json,os,random,re,shlex,shutil,socketserver,ssl,subprocess,tarfile,tempfile,threading,time,zipfile,zlib
+from urllib.parse import parse_qs,urlparse
+
+
+MOCK_ROOT = {"windows": "C:\\cbtk_mock\\", "linux": "/cbtk_mock/"}
+TEMP_DIRS = {"windows": ["c:","windows","temp"], "linux": ["tmp"]}
+OS_DETAILS = {"windows": ("Windows 10 Enterprise Edition", 1), "linux": ("Linux CentOS 7.6", 3)}
+SUPPORTED_COMMANDS = ["get file","put file","delete file","directory list","create process","process list","kill","create directory","reg enum key","memdump"]
+TREE_SHAPES = {
+    "flat": (0, 0, 500), # depth, subdirectories per directory, files per directory
+    "wide": (2, 8, 8),
+    "deep": (8, 2, 2),
+}
+NOISE = random.Random(0).getrandbits(8 * 1024 * 1024).to_bytes(1024 * 1024, "little") # served as file content - incompressible like most evidence
+SEND_CHUNK = 64 * 1024
+
+
+# accepts tree shape name or "depth,width,files"
+# returns (depth, width, files)
+def parse_shape(shape):
+    if shape in TREE_SHAPES:
+        return TREE_SHAPES[shape]
+    depth, width, files = [int(value) for value in shape.split(",")]
+    return depth, width, files
+
+
+# accepts depth, subdirectories per directory, files per directory and file size
+# returns nested dict of directory name -> dict and file name -> size
+def build_tree(depth, width, files, file_size):
+    tree = dict(("file_{:04d}.dat".format(i), file_size) for i in range(files))
+    if depth > 0:
+        for i in range(width):
+            tree["dir_{:03d}".format(i)] = build_tree(depth - 1, width, files, file_size)
+    return tree
+
+
+# accepts remote path and os name
+# returns list of lowercased path parts
+def split_path(path, os_name):
+    parts = [part for part in path.replace("\\","/").split("/") if part]
+    return [part.lower() for part in parts] if os_name == "windows" else parts
+
+
+# accepts file seed and size
+# yields deterministic content chunks for a synthetic file
+def file_chunks(seed, size):
+    offset = seed % len(NOISE)
+    while size > 0:
+        chunk = NOISE[offset:offset + min(size, SEND_CHUNK)]
+        offset = (offset + len(chunk)) % len(NOISE)
+        size -= len(chunk)
+        yield chunk
+
+
+class MockSensor:
+    """Synthetic endpoint - a shared read-only tree mounted under MOCK_ROOT plus files created by Live Response commands"""
+
+    def __init__(self, sensor_id, os_name, tree, online=True):
+        self.id = sensor_id
+        self.os_name = os_name
+        self.hostname = "mock-{:04d}".format(sensor_id)
+        self.online = online
+        mount = split_path(MOCK_ROOT[os_name], os_name)
+        self.root = {}
+        node = self.root
+        for part in mount[:-1]:
+            node = node.setdefault(part, {})
+        node[mount[-1]] = tree
+        node = self.root
+        for part in TEMP_DIRS[os_name]:
+            node = node.setdefault(part, {})
+        self.created = {} # path parts tuple -> local file holding its content
+        self.deleted = set()
+
+
+    def info(self):
+        display, os_type = OS_DETAILS[self.os_name]
+        return {
+            "id": self.id,
+            "computer_name": self.hostname.upper(),
+            "computer_dns_name": "{}.mock.local".format(self.hostname),
+            "status": "Online" if self.online else "Offline",
+            "os_environment_display_string": display,
+            "os_type": os_type,
+            "network_adapters": "10.{}.{}.{},00:50:56:00:{:02x}:{:02x}|".format(
+                (self.id >> 16) & 255, (self.id >> 8) & 255, self.id & 255, (self.id >> 8) & 255, self.id & 255),
+            "group_id": 1,
+            "build_version_string": "006.002.000.00000",
+            "last_checkin_time": time.strftime("%Y-%m-%d %H:%M:%S.000000-00:00", time.gmtime()),
+            "next_checkin_time": time.strftime("%Y-%m-%d %H:%M:%S.000000-00:00", time.gmtime(time.time() + 30)),
+            "num_storefiles_bytes": "0", # cbapi orders sensors by pending upload size before opening sessions
+            "num_eventlog_bytes": "0",
+        }
+
+
+    # accepts remote path
+    # returns ("dir", dict), ("file", size), ("created", local path) or (None, None)
+    def lookup(self, path):
+        parts = tuple(split_path(path, self.os_name))
+        if parts in self.created:
+            return "created", self.created[parts]
+        if parts in self.deleted:
+            return None, None
+        node = self.root
+        for part in parts:
+            if not isinstance(node, dict) or part not in node:
+                return None, None
+            node = node[part]
+        return ("dir", node) if isinstance(node, dict) else ("file", node)
+
+
+    # accepts remote directory path
+    # returns directory list result in the shape the CB server sends - None if the directory does not exist
+    def list_directory(self, path):
+        kind, node = self.lookup(path)
+        if kind != "dir":
+            return None
+        parts = tuple(split_path(path, self.os_name))
+        mtime = int(time.time()) - 86400
+        files = [{"filename": name, "attributes": ["DIRECTORY"], "size": 0, "create_time": mtime, "last_write_time": mtime,
+                  "last_access_time": mtime, "alt_name": ""} for name in (".","..")]
+        for name, child in sorted(node.items()):
+            if parts + (name,) in self.deleted:
+                continue
+            is_dir = isinstance(child, dict)
+            files.append({"filename": name, "attributes": ["DIRECTORY"] if is_dir else ["ARCHIVE"], "size": 0 if is_dir else child,
+                          "create_time": mtime, "last_write_time": mtime, "last_access_time": mtime, "alt_name": ""})
+        for created, local in self.created.items():
+            if created[:-1] == parts:
+                files.append({"filename": created[-1], "attributes": ["ARCHIVE"], "size": os.path.getsize(local),
+                              "create_time": mtime, "last_write_time": mtime, "last_access_time": mtime, "alt_name": ""})
+        return files
+
+
+    # accepts remote directory path and find-style depth (None for unlimited)
+    # yields (relative path parts, size, content seed) for every synthetic file beneath it
+    def walk(self, path, depth=None):
+        kind, node = self.lookup(path)
+        if kind != "dir":
+            return
+        stack = [((), node)]
+        while stack:
+            rel, node = stack.pop()
+            for name, child in sorted(node.items()):
+                if isinstance(child, dict):
+                    if depth is None or len(rel) + 2 <= depth:
+                        stack.append((rel + (name,), child))
+                else:
+                    yield rel + (name,), child, self.seed(split_path(path, self.os_name) + list(rel) + [name])
+
+
+    # accepts remote path parts
+    # returns content seed so each file's bytes are stable across runs and hosts
+    def seed(self, parts):
+        return zlib.crc32("/".join(parts).encode("utf-8"))
+
+
+class MockState:
+    """Fleet, sessions, commands and counters shared by every request handler"""
+
+    def __init__(self, hosts=4, os_name="windows", shape="wide", file_size=64 * 1024, latency=0.05, session_latency=0.5,
+                 bandwidth=0, error_rate=0.0, archive_rate=50 * 1024 * 1024, offline=0, seed=0):
+        self.lock = threading.Lock()
+        self.latency = latency
+        self.session_latency = session_latency
+        self.bandwidth = bandwidth
+        self.error_rate = error_rate
+        self.archive_rate = archive_rate
+        self.random = random.Random(seed)
+        self.workdir = tempfile.mkdtemp(prefix="cbtk_mock_")
+        self.ids = itertools.count(1)
+        self.configure(hosts, os_name, shape, file_size, offline)
+
+
+    # accepts fleet size, os name, tree shape, file size and count of offline sensors
+    # rebuilds the fleet and clears sessions and counters
+    def configure(self, hosts, os_name="windows", shape="wide", file_size=64 * 1024, offline=0):
+        tree = build_tree(*(parse_shape(shape) + (file_size,)))
+        with self.lock:
+            self.sensors = dict((i, MockSensor(i, os_name, tree, online=i > offline)) for i in range(1, hosts + 1))
+            self.sessions = {}
+            self.commands = {}
+            self.downloads = {}
+        self.reset()
+
+
+    def reset(self):
+        with self.lock:
+            self.started = time.time()
+            self.stats = dict((sensor_id, {"first_byte": None, "files": 0, "bytes": 0, "listings": 0, "commands": 0, "errors": 0})
+                              for sensor_id in self.sensors)
+
+
+    # returns copy of per-sensor counters with totals
+    def snapshot(self):
+        with self.lock:
+            hosts = dict((str(sensor_id), dict(stats)) for sensor_id, stats in self.stats.items())
+        totals = {}
+        for key in ("files", "bytes", "listings", "commands", "errors"):
+            totals[key] = sum(stats[key] for stats in hosts.values())
+        return {"started": self.started, "hosts": hosts, "totals": totals}
+
+
+    # accepts sensor id
+    # returns new session dictionary - it turns active session_latency seconds later, or never for offline sensors
+    def create_session(self, sensor_id):
+        sensor = self.sensors.get(sensor_id)
+        if not sensor:
+            return None
+        with self.lock:
+            session_id = next(self.ids)
+            self.sessions[session_id] = {"id": session_id, "sensor_id": sensor_id, "hostname": sensor.hostname, "os_type": sensor.info()["os_type"],
+                                         "supported_commands": SUPPORTED_COMMANDS, "current_working_directory": MOCK_ROOT[sensor.os_name],
+                                         "create_time": time.time(), "status": "pending",
+                                         "ready_at": time.time() + self.session_latency if sensor.online else None}
+        return self.session(session_id)
+
+
+    # returns session dictionary with its current status, or None
+    def session(self, session_id):
+        with self.lock:
+            session = self.sessions.get(session_id)
+            if not session:
+                return None
+            if session["status"] == "pending" and session["ready_at"] and time.time() >= session["ready_at"]:
+                session["status"] = "active"
+            return dict((key, value) for key, value in session.items() if key != "ready_at")
+
+
+    # accepts session id and posted command
+    # returns command dictionary - the command is carried out now and reported once latency (plus any endpoint work) elapses
+    def create_command(self, session_id, data):
+        session = self.session(session_id)
+        if not session or session["status"] == "close":
+            return None
+        sensor = self.sensors[session["sensor_id"]]
+        with self.lock:
+            command_id = next(self.ids)
+            stats = self.stats[sensor.id]
+            stats["commands"] += 1
+            inject_error = self.random.random() < self.error_rate
+        command = {"id": command_id, "session_id": session_id, "sensor_id": sensor.id, "name": data.get("name"), "object": data.get("object"),
+                   "status": "pending", "create_time": time.time(), "result_code": 0, "result_type": "WinHresult", "result_desc": ""}
+        delay = self.latency
+        if inject_error:
+            self.fail(command, "mock injected error")
+        elif data.get("name") == "directory list":
+            files = sensor.list_directory(data.get("object") or "")
+            if files is None:
+                self.fail(command, "ERROR_PATH_NOT_FOUND")
+            else:
+                command["files"] = files
+                with self.lock:
+                    stats["listings"] += 1
+        elif data.get("name") == "get file":
+            kind, node = sensor.lookup(data.get("object") or "")
+            if kind not in ("file", "created"):
+                self.fail(command, "ERROR_FILE_NOT_FOUND")
+            else:
+                command["file_id"] = command_id
+                with self.lock:
+                    self.downloads[command_id] = (sensor, kind, node, data.get("object"))
+        elif data.get("name") == "delete file":
+            self.delete_file(sensor, data.get("object") or "")
+        elif data.get("name") == "create process":
+            delay += self.create_process(sensor, command, data)
+        if command["status"] == "pending":
+            command["status"] = "complete"
+        command["ready_at"] = time.time() + delay
+        with self.lock:
+            self.commands[command_id] = command
+        return command
+
+
+    def fail(self, command, description):
+        command["status"] = "error"
+        command["result_code"] = 2147942402
+        command["result_desc"] = description
+        with self.lock:
+            self.stats[command["sensor_id"]]["errors"] += 1
+
+
+    def delete_file(self, sensor, path):
+        parts = tuple(split_path(path, sensor.os_name))
+        with self.lock:
+            local = sensor.created.pop(parts, None)
+        if local and os.path.exists(local):
+            os.remove(local)
+        elif not local:
+            sensor.deleted.add(parts)
+
+
+    # accepts sensor, command dictionary and posted data
+    # understands the endpoint archive and hash commands built by remote_archive.py and remote_hash.py and commands wrapped by create_proc.py - anything else just echoes the command line
+    # returns seconds of simulated endpoint work
+    def create_process(self, sensor, command, data):
+        line = data.get("object") or ""
+        output = "mock: {}\n".format(line)
+        work = 0
+        archive_job, hash_job = parse_archive_command(line), parse_hash_command(line)
+        if archive_job:
+            srcpath, archive, depth = archive_job
+            files = list(sensor.walk(srcpath, depth))
+            if not files:
+                output = "no files to archive\nCBTK_EXIT=1\n"
+            else:
+                local = os.path.join(self.workdir, "{}.{}".format(command["id"], "zip" if sensor.os_name == "windows" else "tar.gz"))
+                write_archive(local, files, sensor.os_name)
+                sensor.created[tuple(split_path(archive, sensor.os_name))] = local
+                work = sum(size for _, size, _ in files) / float(self.archive_rate)
+                output = "CBTK_EXIT=0\n"
+        if hash_job:
+            srcpath, depth = hash_job
+            sep = "\\" if sensor.os_name == "windows" else "/"
+            root = srcpath.rstrip("\\/")
+            lines = []
+            for parts, size, seed in sensor.walk(srcpath, depth):
+                digest = file_sha256(seed, size)
+                path = root + sep + sep.join(parts)
+                lines.append("{} {}".format(digest.upper(), path) if sensor.os_name == "windows" else "{}  {}".format(digest, path))
+                work += size / float(self.archive_rate)
+            output = "\n".join(lines + ["CBTK_EXIT=0",""])
+        wrapped = parse_wrapped_command(line) if not (archive_job or hash_job) else None # archive and hash commands are wrapped too
+        if wrapped is not None:
+            output, status = command_output(wrapped, sensor.os_name)
+            output = "{}CBTK_EXIT={}\n".format(output, status)
+        if data.get("output_file"):
+            local = os.path.join(self.workdir, "{}.out".format(command["id"]))
+            with open(local, mode="w") as f:
+                f.write(output)
+            sensor.created[tuple(split_path(data["output_file"], sensor.os_name))] = local
+        command["pid"] = 4000 + command["id"] % 1000
+        return work
+
+
+    # accepts command id and longest wait
+    # returns command dictionary once it is due - blocks like a server-side wait so each command costs one latency
+    def command(self, command_id, wait=30):
+        with self.lock:
+            command = self.commands.get(command_id)
+        if not command:
+            return None
+        remaining = command["ready_at"] - time.time()
+        if remaining > 0:
+            time.sleep(min(remaining, wait))
+        if time.time() < command["ready_at"]:
+            return dict(command, status="pending")
+        return dict((key, value) for key, value in command.items() if key != "ready_at")
+
+
+    # accepts file id
+    # returns (sensor, size, chunk iterator) for the file content download, or None
+    def download(self, file_id):
+        with self.lock:
+            download = self.downloads.get(file_id)
+        if not download:
+            return None
+        sensor, kind, node, path = download
+        if kind == "created":
+            size = os.path.getsize(node)
+            chunks = read_chunks(node)
+        else:
+            size = node
+            chunks = file_chunks(sensor.seed(split_path(path, sensor.os_name)), size)
+        return sensor, size, chunks
+
+
+    # accepts sensor id and bytes sent - the first call for a sensor records its time to first byte
+    def sent(self, sensor_id, size, finished=False):
+        with self.lock:
+            stats = self.stats[sensor_id]
+            if stats["first_byte"] is None:
+                stats["first_byte"] = time.time()
+            stats["bytes"] += size
+            if finished:
+                stats["files"] += 1
+
+
+# accepts local path
+# yields file content chunks
+def read_chunks(path):
+    with open(path, mode="rb") as f:
+        while True:
+            chunk = f.read(SEND_CHUNK)
+            if not chunk:
+                break
+            yield chunk
+
+
+# accepts create process command line
+# returns (remote directory, remote archive path, depth) for commands built by remote_archive.archive_command, or None
+def parse_archive_command(line):
+    if "Compress-Archive" in line:
+        literals = [value.replace("''","'") for value in re.findall(r"'((?:[^']|'')*)'", line)]
+        literals = [value for value in literals if value not in ("SilentlyContinue",) and not value.startswith("CBTK_EXIT")]
+        if len(literals) < 2:
+            return None
+        return literals[0], literals[1], 1 if " -File " in line else None
+    try:
+        outer = shlex.split(line)
+        if outer[:2] != ["/bin/sh","-c"] or len(outer) < 3:
+            return None
+        tokens = shlex.split(outer[2])
+    except ValueError:
+        return None
+    if "tar" not in tokens or "cd" not in tokens:
+        return None
+    srcpath = tokens[tokens.index("cd") + 1]
+    archive = tokens[tokens.index("-czf") + 1]
+    depth = int(tokens[tokens.index("-maxdepth") + 1]) if "-maxdepth" in tokens else None
+    return srcpath, archive, depth
+
+
+# accepts create_process command line
+# returns (srcpath, depth) for the endpoint hash commands built by remote_hash.py, or None
+def parse_hash_command(line):
+    if "Get-FileHash" in line:
+        literals = [value.replace("''","'") for value in re.findall(r"'((?:[^']|'')*)'", line)]
+        literals = [value for value in literals if value not in ("SilentlyContinue"," ") and not value.startswith("CBTK_EXIT")]
+        if not literals:
+            return None
+        depth = re.search(r" -Depth (\d+)", line)
+        return literals[0], 1 if " -Recurse" not in line else (int(depth.group(1)) + 1 if depth else None)
+    try:
+        outer = shlex.split(line)
+        if outer[:2] != ["/bin/sh","-c"] or len(outer) < 3:
+            return None
+        tokens = shlex.split(outer[2])
+    except ValueError:
+        return None
+    if "find" not in tokens or not ("sha256sum" in tokens or "shasum" in tokens):
+        return None
+    depth = int(tokens[tokens.index("-maxdepth") + 1]) if "-maxdepth" in tokens else None
+    return tokens[tokens.index("find") + 1], depth
+
+
+WRAPPED_WINDOWS = re.compile(r'^cmd\.exe /v:on /s /c "(.*) & echo CBTK_EXIT=!errorlevel!"$')
+WRAPPED_POSIX_SUFFIX = "; echo CBTK_EXIT=$?"
+CANNED_OUTPUT = {
+    ("windows", "netstat"): "\nActive Connections\n\n  Proto  Local Address          Foreign Address        State           PID\n"
+                            "  TCP    0.0.0.0:135            0.0.0.0:0              LISTENING       1044\n"
+                            "  TCP    10.0.0.5:49712         52.1.2.3:443           ESTABLISHED     4120\n"
+                            "  UDP    0.0.0.0:123            *:*                                    1376\n",
+    ("windows", "tasklist"): "\nImage Name                     PID Session Name        Session#    Mem Usage\n"
+                             "========================= ======== ================ =========== ============\n"
+                             "System Idle Process              0 Services                   0          8 K\n"
+                             "System                           4 Services                   0        144 K\n"
+                             "svchost.exe                    912 Services                   0     23,456 K\n",
+    ("linux", "netstat"): "Active Internet connections (servers and established)\n"
+                          "Proto Recv-Q Send-Q Local Address           Foreign Address         State       PID/Program name\n"
+                          "tcp        0      0 0.0.0.0:22              0.0.0.0:*               LISTEN      812/sshd\n"
+                          "udp        0      0 0.0.0.0:68              0.0.0.0:*                           640/dhclient\n",
+    ("linux", "ps"): "USER         PID %CPU %MEM    VSZ   RSS TTY      STAT START   TIME COMMAND\n"
+                     "root           1  0.0  0.1 167000 11000 ?        Ss   Oct01   0:12 /sbin/init splash\n"
+                     "root         812  0.0  0.0  72300  5600 ?        Ss   Oct01   0:00 /usr/sbin/sshd -D\n",
+}
+
+
+# accepts create_process command line
+# returns the command inside a create_proc.wrap_command shell wrapper, or None
+def parse_wrapped_command(line):
+    m = WRAPPED_WINDOWS.match(line)
+    if m:
+        return m.group(1)
+    try:
+        outer = shlex.split(line)
+    except ValueError:
+        return None
+    if outer[:2] == ["/bin/sh","-c"] and len(outer) == 3 and outer[2].endswith(WRAPPED_POSIX_SUFFIX):
+        return outer[2][:-len(WRAPPED_POSIX_SUFFIX)]
+    return None
+
+
+# accepts wrapped command and os name
+# returns (output, exit status) - canned output for netstat/tasklist/ps, "exit N" fails with N, anything else echoes
+def command_output(command, os_name):
+    program = command.split()[0].lower() if command.split() else ""
+    if program == "exit":
+        return "", int(command.split()[1]) if len(command.split()) > 1 else 0
+    return CANNED_OUTPUT.get((os_name, program), "mock: {}\n".format(command)), 0
+
+
+# accepts file seed and size
+# returns sha256 hex digest of the synthetic file content
+def file_sha256(seed, size):
+    hasher = hashlib.sha256()
+    for chunk in file_chunks(seed, size):
+        hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+# accepts local archive path, list of (relative parts, size, seed) and os name
+# writes zip (windows) or tar.gz (linux) of the synthetic files
+def write_archive(path, files, os_name):
+    if os_name == "windows":
+        with zipfile.ZipFile(path, mode="w", compression=zipfile.ZIP_STORED) as archive:
+            for parts, size, seed in files:
+                with archive.open("\\".join(parts), mode="w", force_zip64=True) as f:
+                    for chunk in file_chunks(seed, size):
+                        f.write(chunk)
+    else:
+        with tarfile.open(path, mode="w:gz", compresslevel=1) as archive:
+            for parts, size, seed in files:
+                info = tarfile.TarInfo("./" + "/".join(parts))
+                info.size = size
+                info.mtime = int(time.time()) - 86400
+                archive.addfile(info, io.BytesIO(b"".join(file_chunks(seed, size))))
+
+
+class MockHandler(http.server.BaseHTTPRequestHandler):
+    """CB Response REST and Live Response endpoints used by cbapi's CbResponseAPI and LiveResponseSession"""
+
+    protocol_version = "HTTP/1.1"
+    routes = [
+        ("GET", r"^/api/info$", "get_info"),
+        ("GET", r"^/api/v1/sensor$", "get_sensors"),
+        ("GET", r"^/api/v1/sensor/(\d+)$", "get_sensor"),
+        ("GET", r"^/api/v1/cblr/session$", "get_sessions"),
+        ("GET", r"^/api/v1/storage/events/partition$", "get_partitions"),
+        ("POST", r"^/api/v1/cblr/session$", "post_session"),
+        ("GET", r"^/api/v1/cblr/session/(\d+)$", "get_session"),
+        ("PUT", r"^/api/v1/cblr/session/(\d+)$", "put_session"),
+        ("GET", r"^/api/v1/cblr/session/(\d+)/keepalive$", "get_keepalive"),
+        ("POST", r"^/api/v1/cblr/session/(\d+)/command$", "post_command"),
+        ("GET", r"^/api/v1/cblr/session/(\d+)/command/(\d+)$", "get_command"),
+        ("GET", r"^/api/v1/cblr/session/(\d+)/file/(\d+)/content$", "get_file_content"),
+        ("DELETE", r"^/api/v1/cblr/session/(\d+)/file/(\d+)$", "delete_file"),
+        ("GET", r"^/mock/stats$", "get_stats"),
+        ("POST", r"^/mock/reset$", "post_reset"),
+    ]
+
+
+    def do_GET(self):
+        self.route("GET")
+
+
+    def do_POST(self):
+        self.route("POST")
+
+
+    def do_PUT(self):
+        self.route("PUT")
+
+
+    def do_DELETE(self):
+        self.route("DELETE")
+
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            http.server.BaseHTTPRequestHandler.log_message(self, format, *args)
+
+
+    @property
+    def state(self):
+        return self.server.state
+
+
+    def route(self, method):
+        url = urlparse(self.path)
+        self.query = parse_qs(url.query)
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length) if length else b""
+        try:
+            self.body = json.loads(body.decode("utf-8")) if body else {}
+        except ValueError:
+            return self.send_json({"reason": "malformed json"}, 400)
+        if not url.path.startswith("/mock/") and not self.headers.get("X-Auth-Token"):
+            return self.send_json({"reason": "missing X-Auth-Token"}, 401)
+        for route_method, pattern, name in self.routes:
+            match = re.match(pattern, url.path)
+            if match and route_method == method:
+                return getattr(self, name)(*[int(group) for group in match.groups()])
+        self.send_json({"status": "NOT_FOUND", "reason": "no route for {} {}".format(method, url.path)}, 404)
+
+
+    def send_json(self, data, code=200):
+        payload = json.dumps(data).encode("utf-8")
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+
+    def get_info(self):
+        self.send_json({"version": "6.3.0.00000", "cblrEnabled": True, "server_node_id": 0})
+
+
+    # cbapi reads the event partitions when it connects to a 6.x server
+    def get_partitions(self):
+        self.send_json({"writer": {"name": "writer", "status": "writer", "info": {"sizeInBytes": 0, "isLegacy": False}}})
+
+
+    def get_sensors(self):
+        sensors = [sensor.info() for sensor in self.state.sensors.values()]
+        for key in ("hostname", "ip"):
+            if key in self.query:
+                value = self.query[key][0].lower()
+                field = "computer_name" if key == "hostname" else "network_adapters"
+                sensors = [sensor for sensor in sensors if value in sensor[field].lower()]
+        self.send_json(sensors)
+
+
+    def get_sensor(self, sensor_id):
+        sensor = self.state.sensors.get(sensor_id)
+        if not sensor:
+            return self.send_json({"status": "NOT_FOUND", "reason": "Sensor not found"}, 404)
+        self.send_json(sensor.info())
+
+
+    def get_sessions(self):
+        sessions = [self.state.session(session_id) for session_id in list(self.state.sessions)]
+        if "active_only" in self.query:
+            sessions = [session for session in sessions if session["status"] in ("pending", "active")]
+        self.send_json(sessions)
+
+
+    def post_session(self):
+        session = self.state.create_session(self.body.get("sensor_id"))
+        if not session:
+            return self.send_json({"status": "NOT_FOUND", "reason": "Sensor not found"}, 404)
+        self.send_json(session)
+
+
+    def get_session(self, session_id):
+        session = self.state.session(session_id)
+        if not session:
+            return self.send_json({"status": "NOT_FOUND", "reason": "Session not found"}, 404)
+        self.send_json(session)
+
+
+    def put_session(self, session_id):
+        with self.state.lock:
+            session = self.state.sessions.get(session_id)
+            if session and self.body.get("status") == "close":
+                session["status"] = "close"
+        self.get_session(session_id)
+
+
+    def get_keepalive(self, session_id):
+        self.send_json({})
+
+
+    def post_command(self, session_id):
+        command = self.state.create_command(session_id, self.body)
+        if not command:
+            return self.send_json({"status": "NOT_FOUND", "reason": "Session not found"}, 404)
+        self.send_json(dict((key, value) for key, value in command.items() if key not in ("ready_at", "files")))
+
+
+    def get_command(self, session_id, command_id):
+        command = self.state.command(command_id)
+        if not command:
+            return self.send_json({"status": "NOT_FOUND", "reason": "Command not found"}, 404)
+        self.send_json(command)
+
+
+    # streams file content at the configured bandwidth - counters feed files/sec, MB/sec and time to first byte
+    def get_file_content(self, session_id, file_id):
+        download = self.state.download(file_id)
+        if not download:
+            return self.send_json({"status": "NOT_FOUND", "reason": "File not found"}, 404)
+        sensor, size, chunks = download
+        self.send_response(200)
+        self.send_header("Content-Type", "application/octet-stream")
+        self.send_header("Content-Length", str(size))
+        self.end_headers()
+        started = time.time()
+        sent = 0
+        for chunk in chunks:
+            self.wfile.write(chunk)
+            sent += len(chunk)
+            self.state.sent(sensor.id, len(chunk), finished=sent >= size)
+            if self.state.bandwidth:
+                ahead = sent / float(self.state.bandwidth) - (time.time() - started)
+                if ahead > 0:
+                    time.sleep(ahead)
+        if size == 0:
+            self.state.sent(sensor.id, 0, finished=True)
+
+
+    def delete_file(self, session_id, file_id):
+        with self.state.lock:
+            self.state.downloads.pop(file_id, None)
+        self.send_json({})
+
+
+    def get_stats(self):
+        self.send_json(self.state.snapshot())
+
+
+    def post_reset(self):
+        self.state.reset()
+        self.send_json({})
+
+
+# accepts directory
+# writes a throwaway self-signed certificate and key for 127.0.0.1 with the openssl command line tool
+# returns (certificate path, key path)
+def self_signed_cert(workdir):
+    cert, key = os.path.join(workdir, "mock_cert.pem"), os.path.join(workdir, "mock_key.pem")
+    subprocess.run(["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "1", "-subj", "/CN=127.0.0.1",
+                    "-keyout", key, "-out", cert], check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return cert, key
+
+
+class MockServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    """Threaded HTTPS server holding one MockState - cbapi only connects to https:// urls"""
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, state, verbose=False, tls=True):
+        http.server.HTTPServer.__init__(self, address, MockHandler)
+        self.state = state
+        self.verbose = verbose
+        self.tls = tls
+        if tls:
+            context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+            context.load_cert_chain(*self_signed_cert(state.workdir))
+            self.socket = context.wrap_socket(self.socket, server_side=True, do_handshake_on_connect=False) # handshake on the handler thread
+
+
+    @property
+    def url(self):
+        return "{}://{}:{}".format("https" if self.tls else "http", *self.server_address[:2])
+
+
+    # serves requests on a daemon thread
+    # returns self
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever, name="mock-cb-server")
+        thread.daemon = True
+        thread.start()
+        return self
+
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+        shutil.rmtree(self.state.workdir, ignore_errors=True)
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description="Local stand-in for the CB Response REST and Live Response API with synthetic sensors")
+    parser.add_argument("-p","--port", help="Port to listen on (defaults to 8899)", type=int, default=8899, required=False)
+    parser.add_argument("-hc","--hosts", help="Number of synthetic sensors (defaults to 4)", type=int, default=4, required=False)
+    parser.add_argument("-os","--os_name", help="Sensor os (defaults to windows)", choices=sorted(MOCK_ROOT), default="windows", required=False)
+    parser.add_argument("-ts","--tree_shape", help="Synthetic tree under {} - {} or depth,width,files (defaults to wide)".format(MOCK_ROOT["windows"], "/".join(sorted(TREE_SHAPES))), default="wide", required=False)
+    parser.add_argument("-fs","--file_size", help="Bytes per synthetic file (defaults to 65536)", type=int, default=64 * 1024, required=False)
+    parser.add_argument("-l","--latency", help="Seconds each Live Response command takes to complete (defaults to 0.05)", type=float, default=0.05, required=False)
+    parser.add_argument("-sl","--session_latency", help="Seconds before a new session turns active (defaults to 0.5)", type=float, default=0.5, required=False)
+    parser.add_argument("-bw","--bandwidth", help="Bytes/sec per file download (defaults to unlimited)", type=int, default=0, required=False)
+    parser.add_argument("-er","--error_rate", help="Fraction of Live Response commands that fail (defaults to 0)", type=float, default=0.0, required=False)
+    parser.add_argument("-off","--offline", help="Number of sensors reported offline (defaults to 0)", type=int, default=0, required=False)
+    parser.add_argument("-ph","--plain_http", help="Serve plain http instead of https with a self-signed certificate (cbapi itself only accepts https)", action="store_true", required=False)
+    parser.add_argument("-v","--verbose", help="Log every request", action="store_true", required=False)
+    return vars(parser.parse_args())
+
+
+def main():
+    args = get_args()
+    state = MockState(hosts=args["hosts"], os_name=args["os_name"], shape=args["tree_shape"], file_size=args["file_size"], latency=args["latency"],
+                      session_latency=args["session_latency"], bandwidth=args["bandwidth"], error_rate=args["error_rate"], offline=args["offline"])
+    server = MockServer(("127.0.0.1", args["port"]), state, verbose=args["verbose"], tls=not args["plain_http"])
+    print("Mock CB Response server listening on {} - {} sensor(s), tree under {}".format(server.url, args["hosts"], MOCK_ROOT[args["os_name"]]))
+    print("Point cbapi at it with url={} token=mock ssl_verify=False - counters at {}/mock/stats".format(server.url, server.url))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\rInterrupted!")
+    finally:
+        server.server_close()
+        shutil.rmtree(state.workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,13 +1,17 @@
 #!/usr/bin/env python3
 
-import cbapi,argparse,configparser,json,requests,sys
+import cbapi,argparse,codecs,configparser,json,requests,sys
+from requests.adapters import HTTPAdapter
+
+CHUNK_SIZE = 64 * 1024 # bytes read from the sensor response at a time
+POOL_SIZE = 10 # keep-alive connections held per host
 
 def get_args():
     parser = argparse.ArgumentParser(description="Interact with Carbon Black Response API")
     parser.add_argument("-i","--id", help="sensor_id", required=False)
     parser.add_argument("-hts","--hostname_to_sensor", help="Lookup sensor_id by hostname", required=False)
     parser.add_argument("-its","--ip_to_sensor", help="Lookup sensor_id by IP address", required=False)
-    parser.add_argument("-sth","--sensor_to_hostname", help="Lookup hostname by IP address", required=False)
+    parser.add_argument("-sth","--sensor_to_hostname", help="Lookup hostname by sensor_id", required=False)
     parser.add_argument("-s","--server", help="Carbon Black Server FQDN", required=False)
     parser.add_argument("--no_check_ssl", help="Ignore SSL certificate errors", required=False, action="store_true")
     return vars(parser.parse_args())
@@ -18,24 +22,121 @@ def get_config(config_path):
     config.read("cbtk.cfg")
 
 
+# Parses a JSON array incrementally
+# Accepts iterable of text chunks
+# Yields each element as soon as it is complete - only the element being parsed is held in memory
+def iter_json_array(chunks):
+    decoder = json.JSONDecoder()
+    buffer = ""
+    opened = False
+    for chunk in chunks:
+        buffer += chunk
+        pos = 0
+        while True:
+            while pos < len(buffer) and buffer[pos] in " \t\r\n,":
+                pos += 1
+            if pos == len(buffer):
+                break
+            if not opened:
+                if buffer[pos] != "[":
+                    raise ValueError("expected a JSON array, got {!r}".format(buffer[pos:pos + 80]))
+                opened = True
+                pos += 1
+                continue
+            if buffer[pos] == "]":
+                return
+            try:
+                element, pos = decoder.raw_decode(buffer, pos)
+            except ValueError:
+                break # element continues in the next chunk
+            yield element
+        buffer = buffer[pos:]
+    raise ValueError("JSON array ended early")
+
+
+# Accepts sensor dict
+# Returns list of IP addresses from network_adapters ("ip,mac|ip,mac|")
+def sensor_ips(sensor):
+    return [adapter.split(",")[0] for adapter in (sensor.get("network_adapters") or "").split("|") if adapter]
+
+
+class SensorClient:
+    """CB Response sensor API client reusing one pooled keep-alive session and streaming sensor lists"""
+
+    def __init__(self, api_token, api_url_base, ssl_check=True, pool_size=POOL_SIZE):
+        self.api_url_base = api_url_base
+        self.session = requests.Session()
+        self.session.headers.update({"X-Auth-Token": api_token})
+        self.session.verify = ssl_check
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=3)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+
+    # Accepts api path and query parameters
+    # Returns streamed response - exits on HTTP or certificate errors
+    def get(self, path, params=None):
+        try:
+            response = self.session.get("{}{}".format(self.api_url_base, path), params=params, stream=True)
+        except requests.exceptions.SSLError as request_error:
+            print("ERROR: {} - check your certificate, or use the --no_check_ssl flag to ignore this warning".format(request_error))
+            sys.exit()
+        if response.status_code != 200:
+            response.close()
+            print("{}: Try again!".format(response.status_code))
+            sys.exit()
+        return response
+
+
+    # Accepts server-side filters (hostname, ip, groupid) - the server narrows the list before it is sent
+    # Yields sensor dicts one at a time while the response is still downloading
+    def iter_sensors(self, **filters):
+        response = self.get("sensor", params=dict((key, value) for key, value in filters.items() if value))
+        try:
+            decoder = codecs.getincrementaldecoder("utf-8")()
+            for sensor in iter_json_array(decoder.decode(chunk) for chunk in response.iter_content(CHUNK_SIZE)):
+                yield sensor
+        finally:
+            response.close()
+
+
+    # Accepts sensor_id
+    # Returns sensor dict
+    def get_sensor(self, sensor_id):
+        response = self.get("sensor/{}".format(sensor_id))
+        try:
+            return json.loads(response.content.decode("utf-8"))
+        finally:
+            response.close()
+
+
+    def close(self):
+        self.session.close()
+
+
 # Queries list of all sensors and attributes in JSON
 # Accepts api_token, api_url_base, and ssl_check flag
-# Returns deserialized JSON object - python object (list of dicts) 
+# Returns generator of sensor dicts - the full payload is never held in memory
 def get_all_sensors(api_token, api_url_base, ssl_check):
-    headers = {"X-Auth-Token": api_token}
-    api_url = "{}sensor".format(api_url_base)
+    return SensorClient(api_token, api_url_base, ssl_check).iter_sensors()
 
-    try:
-        response = requests.get(api_url, headers=headers, verify=ssl_check)
-        if response.status_code == 200:
-            deserialized_json = json.loads(response.content.decode("utf-8"))
-            return deserialized_json
-        else:
-            print("{}: Try again!".format(response.status_code))
-            sys.exit()
-    except requests.exceptions.SSLError as request_error:
-        print("ERROR: {} - check your certificate, or use the --no_check_ssl flag to ignore this warning".format(request_error))
-        sys.exit()
+
+# Accepts SensorClient and parsed args
+# Yields (lookup, value, sensor) for every sensor matching --hostname_to_sensor, --ip_to_sensor or --sensor_to_hostname
+# each lookup is narrowed server-side, then matched exactly while the sensors stream in
+def lookup_sensors(client, args):
+    if args["hostname_to_sensor"]:
+        hostname = args["hostname_to_sensor"].lower()
+        for sensor in client.iter_sensors(hostname=hostname):
+            if sensor["computer_name"].lower() == hostname:
+                yield "hostname_to_sensor", sensor["id"], sensor
+    if args["ip_to_sensor"]:
+        for sensor in client.iter_sensors(ip=args["ip_to_sensor"]):
+            if args["ip_to_sensor"] in sensor_ips(sensor):
+                yield "ip_to_sensor", sensor["id"], sensor
+    if args["sensor_to_hostname"]:
+        sensor = client.get_sensor(args["sensor_to_hostname"])
+        yield "sensor_to_hostname", sensor["computer_name"], sensor
 
 
 def main():
@@ -45,28 +146,23 @@ def main():
 
     args = get_args()
 
+    if args["server"]:
+        api_url_base = "https://{}/api/v1/".format(args["server"])
+
     if args["no_check_ssl"]:
         ssl_check = False
     else:
         ssl_check = True
 
-    sensors = get_all_sensors(api_token, api_url_base, ssl_check)
+    client = SensorClient(api_token, api_url_base, ssl_check)
 
-    #print(json.dumps(sensors, indent=4, sort_keys=False))
+    #print(json.dumps(next(client.iter_sensors()), indent=4, sort_keys=False))
 
-    if args["hostname_to_sensor"]:
-        for sensor in sensors:
-            if sensor["computer_name"].lower() == args["hostname_to_sensor"].lower():
-                print(sensor["id"])
-            else:
-                continue
-    else:
-        pass
-
-    if args["ip_to_sensor"]:
-        pass
-    else:
-        pass
+    try:
+        for lookup, value, sensor in lookup_sensors(client, args):
+            print(value)
+    finally:
+        client.close()
 
 
 if __name__ == "__main__":